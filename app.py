@@ -1,30 +1,19 @@
-from joblib import load
-
-# Load the trained model
-rf_clf_irregular_balanced = load('rf_model_irregular.joblib')
-
 import streamlit as st
-import os
-import google.generativeai as genai
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-from joblib import load
-from dotenv import load_dotenv
-load_dotenv()  # Make sure this is at the beginning of the script to load the environment variables
 import warnings
+import numpy as np
 from dotenv import load_dotenv
-import os
+from charts import fertility_pie, prediction_counts_chart
+from cycle_analytics import fertility_status
+from gemini_client import get_client
+from registry import load_compiled
+load_dotenv()  # Make sure this is at the beginning of the script to load the environment variables;
+# the Gemini client reads GEMINI_API_KEY on first use
 
 # Suppress warnings
 warnings.filterwarnings("ignore")
 
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
-
-
-
-# Load the trained model
-rf_clf_irregular_balanced = load('rf_model_irregular.joblib')
+# Load the trained model (once per server process, shared by every session)
+rf_clf_irregular_balanced = load_compiled('irregular')
 
 # Setup for the Streamlit app
 st.title("Cycle Prediction and Feedback with Gemini")
@@ -34,30 +23,20 @@ cycle_number = st.number_input("Cycle Number", min_value=1, value=10)
 cycle_length = st.number_input("Cycle Length (Days)", min_value=1, value=28)
 ovulation_day = st.number_input("Estimated Ovulation Day", min_value=1, max_value=31, value=14)
 
-# Create a DataFrame to hold the user inputs
-input_data = pd.DataFrame({
-    "Cycle Number": [cycle_number],
-    "Cycle Length": [cycle_length],
-    "Ovulation Day": [ovulation_day]
-})
+# Hold the user inputs in training order: Cycle Number, Cycle Length, Ovulation Day
+input_data = np.array([[cycle_number, cycle_length, ovulation_day]])
 
 # **Fertility Prediction**:
 def predict_fertility(ovulation_day):
-    # Fertility is high if ovulation is between days 12 and 16
-    if 12 <= ovulation_day <= 16:
-        return "High Fertility"
-    else:
-        return "Low Fertility"
+    # Fertility is high if ovulation is between days 12 and 16, the rule the
+    # training labels use (see cycle_analytics.py)
+    return str(fertility_status(ovulation_day))
 
 # Predict Fertility based on Ovulation Day
 fertility_prediction = predict_fertility(ovulation_day)
 
-# Visualize Fertility Prediction using a Pie Chart
-fig, ax = plt.subplots()
-ax.pie([1 if fertility_prediction == "High Fertility" else 0, 1 if fertility_prediction == "Low Fertility" else 0],
-       labels=["High Fertility", "Low Fertility"], autopct='%1.1f%%', startangle=90, colors=["#4CAF50", "#FF5733"])
-ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
-st.pyplot(fig)
+# Visualize Fertility Prediction using a Pie Chart (rendered once per process)
+st.image(fertility_pie(fertility_prediction == "High Fertility"))
 
 # Display the fertility prediction
 st.write(f"Fertility Prediction: {fertility_prediction}")
@@ -65,7 +44,7 @@ st.write(f"Fertility Prediction: {fertility_prediction}")
 # Predict button for cycle irregularity
 if st.button('Predict Irregular Cycle'):
     # Make prediction using the loaded model
-    model_prediction = rf_clf_irregular_balanced.predict(input_data)
+    model_prediction = rf_clf_irregular_balanced.predict(input_data)[0]
 
     if model_prediction == 1:
         st.write("Prediction: Irregular Cycle")
@@ -73,20 +52,15 @@ if st.button('Predict Irregular Cycle'):
         st.write("Prediction: Regular Cycle")
 
     # Visualize the cycle prediction using a bar chart
-    fig, ax = plt.subplots()
-    ax.bar(['Regular Cycle', 'Irregular Cycle'], [255, 30], color=['#FF5733', '#4CAF50'])
-    ax.set_title("Prediction Counts")
-    st.pyplot(fig)
+    st.image(prediction_counts_chart())
 
 # Section for asking questions to Gemini
 user_question = st.text_input("Ask a question about your cycle")
 
 if user_question:
-    # Use Gemini to generate a response to the user’s question
-    model = genai.GenerativeModel("gemini-1.5-flash")
-    
+    # Use Gemini to generate a response to the user’s question (shared client, cached answers)
     try:
-        response = model.generate_content(user_question)
-        st.write("Gemini's Response:", response.text)
+        response = get_client().ask(user_question).result()
+        st.write("Gemini's Response:", response)
     except Exception as e:
         st.write(f"Error occurred: {e}")
@@ -1,27 +1,16 @@
 import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
-from joblib import load
-import os
-from dotenv import load_dotenv
-import streamlit as st
-import os
-import google.generativeai as genai
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from joblib import load
 from dotenv import load_dotenv
+from charts import fertility_gauge
+from features import FEATURE_COLUMNS
+from registry import load_compiled
 
 # Load environment variables (if needed)
 load_dotenv()
 
-# Configure the Gemini API using the environment variable
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
-
-# Load the new trained models
-rf_fertility = load("rf_fertility_model.joblib")
-rf_regular_cycle = load("rf_regular_cycle_model.joblib")
+# Load the new trained models (once per server process, shared by every session)
+rf_fertility = load_compiled("fertility", expected_features=FEATURE_COLUMNS)
+rf_regular_cycle = load_compiled("regular_cycle", expected_features=FEATURE_COLUMNS)
 
 # Set up Streamlit page configuration
 st.set_page_config(
@@ -57,17 +46,18 @@ peak_cycle = st.selectbox("Peak Cycle (Yes=1, No=0)", [1, 0])
 body_mass_index = st.number_input("Body Mass Index (BMI)", min_value=10.0, max_value=50.0, value=22.0, step=0.1)
 reproductive_status = st.selectbox("Reproductive Status (Fertile=1, Not Fertile=0)", [1, 0])
 
-# Prediction Input Data
-input_data = pd.DataFrame({
-    "Cycle Length": [cycle_length],
-    "Average Cycle Length": [average_cycle_length],
-    "Ovulation Day": [ovulation_day],
-    "Luteal Phase Length": [luteal_phase_length],
-    "High Fertility Start": [high_fertility_start],
-    "Peak Cycle": [peak_cycle],
-    "Body Mass Index": [body_mass_index],
-    "Reproductive Status": [reproductive_status]
-})
+# Prediction Input Data, in the order the models were trained on
+input_values = {
+    "Cycle Length": cycle_length,
+    "Average Cycle Length": average_cycle_length,
+    "Ovulation Day": ovulation_day,
+    "Luteal Phase Length": luteal_phase_length,
+    "High Fertility Start": high_fertility_start,
+    "Peak Cycle": peak_cycle,
+    "Body Mass Index": body_mass_index,
+    "Reproductive Status": reproductive_status
+}
+input_data = np.array([[input_values[name] for name in FEATURE_COLUMNS]])
 
 # Predict Fertility
 fertility_status = rf_fertility.predict(input_data)[0]
@@ -81,13 +71,7 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # Circular Visualization for Fertility
-fig, ax = plt.subplots(figsize=(3, 3))
-circle = plt.Circle((0.5, 0.5), 0.4, color=fertility_color, ec="black", lw=3)
-ax.add_artist(circle)
-ax.set_xlim(0, 1)
-ax.set_ylim(0, 1)
-ax.axis("off")
-st.pyplot(fig)
+st.image(fertility_gauge(fertility_color))
 
 # Predict Cycle Regularity
 if st.button('🔮 Predict Cycle Regularity', key="predict_button"):
@@ -1,21 +1,19 @@
 import streamlit as st
-import os
-import google.generativeai as genai
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from joblib import load
 from dotenv import load_dotenv
+from charts import fertility_gauge
+from gemini_client import get_client
+from prediction_cache import cached_model
 
-# Load environment variables (if needed, but not necessary for Streamlit secrets)
+# Load environment variables (if needed, but not necessary for Streamlit secrets);
+# the Gemini client reads GEMINI_API_KEY on first use
 load_dotenv()
 
-# Load the fertility and cycle irregularity models
-rf_clf_fertility_noisy = load('rf_model_fertility.joblib')  # Model trained with 'Ovulation Day (Noisy)'
-rf_clf_irregular_balanced = load('rf_model_irregular.joblib')  # Model trained with 'Ovulation Day'
-
-# Configure the Gemini API using the environment variable
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+# Load the fertility and cycle irregularity models (once per server process, as
+# memory-mapped arrays). Predictions are cached across reruns and sessions, so the
+# fertility prediction below only runs the forest for inputs not seen before.
+rf_clf_fertility_noisy = cached_model('fertility_v3')  # Model trained with 'Ovulation Day (Noisy)'
+rf_clf_irregular_balanced = cached_model('irregular')  # Model trained with 'Ovulation Day'
 
 # Set up page configuration and title
 st.set_page_config(
@@ -55,22 +53,16 @@ cycle_number = st.number_input("Cycle Number", min_value=1, value=10, help="Ente
 cycle_length = st.number_input("Cycle Length (Days)", min_value=1, value=28, help="Enter the length of your cycle in days.")
 ovulation_day = st.number_input("Estimated Ovulation Day", min_value=1, max_value=31, value=14, help="Select the estimated ovulation day.")
 
-# Create the DataFrame with only the relevant columns for prediction
+# Create the input rows with only the relevant columns for prediction, in training order
 # Ensure that "Ovulation Day (Noisy)" is used for fertility and "Ovulation Day" for cycle irregularity
-input_data_fertility = pd.DataFrame({
-    "Cycle Number": [cycle_number],  # Features for fertility model (use "Ovulation Day (Noisy)")
-    "Cycle Length": [cycle_length],
-    "Ovulation Day (Noisy)": [ovulation_day]  # For fertility model
-})
-
-input_data_irregularity = pd.DataFrame({
-    "Cycle Number": [cycle_number],  # Features for cycle irregularity model (use "Ovulation Day")
-    "Cycle Length": [cycle_length],
-    "Ovulation Day": [ovulation_day]  # For irregularity model
-})
+# Columns: Cycle Number, Cycle Length, Ovulation Day (Noisy)
+input_data_fertility = np.array([[cycle_number, cycle_length, ovulation_day]])
+
+# Columns: Cycle Number, Cycle Length, Ovulation Day
+input_data_irregularity = np.array([[cycle_number, cycle_length, ovulation_day]])
 
 # **Predict fertility** based on the input data
-fertility_status = rf_clf_fertility_noisy.predict(input_data_fertility)
+fertility_status = rf_clf_fertility_noisy.predict(input_data_fertility)[0]
 
 # Display the fertility prediction
 if fertility_status == 1:
@@ -88,18 +80,12 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # Alternative representation: A simple colored circle or graphic for fertility
-fig, ax = plt.subplots(figsize=(3, 3))
-circle = plt.Circle((0.5, 0.5), 0.4, color=fertility_color, ec="black", lw=3)
-ax.add_artist(circle)
-ax.set_xlim(0, 1)
-ax.set_ylim(0, 1)
-ax.axis("off")
-st.pyplot(fig)
+st.image(fertility_gauge(fertility_color))
 
 # Predict button for cycle irregularity with a custom icon and color
 if st.button('🔮 Predict Cycle Regularity', key="predict_button"):
     # For cycle irregularity, use the cycle irregularity model
-    model_prediction = rf_clf_irregular_balanced.predict(input_data_irregularity)
+    model_prediction = rf_clf_irregular_balanced.predict(input_data_irregularity)[0]
 
     # Display the cycle irregularity result in a box with peaceful colors
     if model_prediction == 1:
@@ -121,12 +107,11 @@ st.write("### Ask Gemini about your cycle:")
 user_question = st.text_input("Ask a question about your cycle", help="Type your question here.")
 
 if user_question:
-    # Use Gemini to generate a response to the user’s question
-    model = genai.GenerativeModel("gemini-1.5-flash")
-    
+    # Use Gemini to generate a response to the user’s question (cached, streamed as it arrives)
     try:
-        response = model.generate_content(user_question)
-        st.write(f"**Gemini's Response:** {response.text}")
+        answer = get_client().ask(user_question)
+        st.write("**Gemini's Response:**")
+        st.write_stream(answer.stream())
     except Exception as e:
         st.write(f"Error occurred: {e}")
 
@@ -1,23 +1,35 @@
 import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
-import pickle
+import numpy as np
 from dotenv import load_dotenv
-import os
-import google.generativeai as genai
-
-# Load environment variables (if needed)
+from charts import chart_cache_stats, feature_importance_chart, fertility_gauge, sweep_chart
+from drift_monitor import default_monitor
+from ensemble import load_ensemble
+from features import FEATURE_COLUMNS as feature_columns
+from gemini_client import get_client
+from history import default_history
+from instrumentation import start_rerun
+from prediction_cache import cached_model, default_cache
+from registry import feature_importances
+from sweep import sweep
+
+# Load environment variables (if needed); the Gemini client reads GEMINI_API_KEY on first use
 load_dotenv()
 
-# Configure the Gemini API using the environment variable
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
-
-# Load the models from pickle files
-with open('rf_fertility_model.pkl', 'rb') as file:
-    rf_fertility = pickle.load(file)
-
-with open('rf_regular_cycle_model.pkl', 'rb') as file:
-    rf_regular_cycle = pickle.load(file)
+# Stage timings of this rerun, when turned on with APP_PROFILE=1 or ?profile=1 (see instrumentation.py)
+run = start_rerun("app_v4")
+run.watch("prediction_cache", default_cache().stats)
+run.watch("charts", chart_cache_stats)
+
+# Load the models as flat memory-mapped arrays (once per server process, shared
+# by every session and rerun); scikit-learn itself is never imported. Predictions
+# go through a cache shared by all sessions, keyed by the input row and model version.
+# Both predictions come from one pass over the input row (see ensemble.py); the
+# sweep scores one model at a time.
+with run.stage("load_models"):
+    models = load_ensemble({"fertility": ("fertility", feature_columns),
+                            "regular_cycle": ("regular_cycle", feature_columns)}, cache=True)
+    fertility_model = cached_model('fertility', expected_features=feature_columns)
+    regular_cycle_model = cached_model('regular_cycle', expected_features=feature_columns)
 
 # Set up Streamlit page configuration
 st.set_page_config(
@@ -44,83 +56,115 @@ st.markdown("""
 
 # User Inputs
 st.write("### Please enter your cycle details:")
-cycle_length = st.number_input(
-    "Cycle Length (Days)", 
-    min_value=1, 
-    value=28, 
-    help="Enter the total length of your cycle in days, including the days of menstruation and other phases."
-)
-average_cycle_length = st.number_input(
-    "Average Cycle Length (Days)", 
-    min_value=1, 
-    value=28, 
-    help="Provide the average cycle length based on your past tracked cycles. This helps identify consistency."
-)
-ovulation_day = st.number_input(
-    "Estimated Ovulation Day", 
-    min_value=1, 
-    max_value=31, 
-    value=14, 
-    help="Enter the day of your cycle when ovulation typically occurs. This is usually midway through your cycle."
-)
-luteal_phase_length = st.number_input(
-    "Luteal Phase Length (Days)", 
-    min_value=1, 
-    max_value=18, 
-    value=12, 
-    help="The number of days between ovulation and the start of your next period."
-)
-high_fertility_start = st.number_input(
-    "High Fertility Start (Days)", 
-    min_value=1, 
-    max_value=31, 
-    value=12, 
-    help="Enter the day of your cycle when high fertility typically begins."
-)
-peak_cycle = st.selectbox(
-    "Peak Cycle (Yes=1, No=0)", 
-    [1, 0], 
-    help="Indicate if this cycle has a noticeable peak fertility phase (1 for Yes, 0 for No)."
-)
-body_mass_index = st.number_input(
-    "Body Mass Index (BMI)", 
-    min_value=10.0, 
-    max_value=50.0, 
-    value=22.0, 
-    step=0.1, 
-    help="Your body mass index, a measure of body fat based on height and weight."
-)
-reproductive_status = st.selectbox(
-    "Reproductive Status (Fertile=1, Not Fertile=0)", 
-    [1, 0], 
-    help="Select your current reproductive status: Fertile (1) or Not Fertile (0)."
-)
 
-# Ensure the input data matches the exact feature names
-feature_columns = [
-    "Cycle Length", "Ovulation Day", "Luteal Phase Length", 
-    "Average Cycle Length", "Peak Cycle", "Body Mass Index", 
-    "Reproductive Status", "High Fertility Start"
-]
-
-# Create a DataFrame for predictions
-input_data = pd.DataFrame({
-    "Cycle Length": [cycle_length],
-    "Ovulation Day": [ovulation_day],
-    "Luteal Phase Length": [luteal_phase_length],
-    "Average Cycle Length": [average_cycle_length],
-    "Peak Cycle": [peak_cycle],
-    "Body Mass Index": [body_mass_index],
-    "Reproductive Status": [reproductive_status],
-    "High Fertility Start": [high_fertility_start]
-})[feature_columns]  # Ensure the column order matches exactly
+with run.stage("inputs"):
+    # Returning clients start from the averages of their tracked cycles (see history.py)
+    defaults = {"length": 28, "ovulation": 14, "luteal": 12}
+    client_id = st.text_input(
+        "Client ID (optional)",
+        help="Fill in the averages of the cycles you have already tracked with us."
+    )
+    if client_id:
+        history = default_history()
+        if client_id in history:
+            client_stats = history.client_statistics(client_id)
+            for name in defaults:
+                if not np.isnan(client_stats[f"{name}_mean"]):
+                    defaults[name] = int(round(client_stats[f"{name}_mean"]))
+            forecast = history.client_forecast(client_id)
+            st.write(
+                f"Based on your {forecast['cycles']} tracked cycles, your next period is expected "
+                f"on day {forecast['next_period_day']:.0f} of this cycle"
+                + (f", ovulation around day {forecast['ovulation_day']:.0f} and your fertile window "
+                   f"on days {forecast['fertile_start']:.0f}-{forecast['fertile_end']:.0f}."
+                   if not np.isnan(forecast['ovulation_day']) else ".")
+            )
+        else:
+            st.write("No tracked cycles were found for this Client ID.")
+
+    cycle_length = st.number_input(
+        "Cycle Length (Days)", 
+        min_value=1, 
+        value=defaults["length"], 
+        help="Enter the total length of your cycle in days, including the days of menstruation and other phases."
+    )
+    average_cycle_length = st.number_input(
+        "Average Cycle Length (Days)", 
+        min_value=1, 
+        value=defaults["length"], 
+        help="Provide the average cycle length based on your past tracked cycles. This helps identify consistency."
+    )
+    ovulation_day = st.number_input(
+        "Estimated Ovulation Day", 
+        min_value=1, 
+        max_value=31, 
+        value=min(max(defaults["ovulation"], 1), 31), 
+        help="Enter the day of your cycle when ovulation typically occurs. This is usually midway through your cycle."
+    )
+    luteal_phase_length = st.number_input(
+        "Luteal Phase Length (Days)", 
+        min_value=1, 
+        max_value=18, 
+        value=min(max(defaults["luteal"], 1), 18), 
+        help="The number of days between ovulation and the start of your next period."
+    )
+    high_fertility_start = st.number_input(
+        "High Fertility Start (Days)", 
+        min_value=1, 
+        max_value=31, 
+        value=12, 
+        help="Enter the day of your cycle when high fertility typically begins."
+    )
+    peak_cycle = st.selectbox(
+        "Peak Cycle (Yes=1, No=0)", 
+        [1, 0], 
+        help="Indicate if this cycle has a noticeable peak fertility phase (1 for Yes, 0 for No)."
+    )
+    body_mass_index = st.number_input(
+        "Body Mass Index (BMI)", 
+        min_value=10.0, 
+        max_value=50.0, 
+        value=22.0, 
+        step=0.1, 
+        help="Your body mass index, a measure of body fat based on height and weight."
+    )
+    reproductive_status = st.selectbox(
+        "Reproductive Status (Fertile=1, Not Fertile=0)", 
+        [1, 0], 
+        help="Select your current reproductive status: Fertile (1) or Not Fertile (0)."
+    )
+
+with run.stage("features"):
+    # Create the input row for predictions
+    input_values = {
+        "Cycle Length": cycle_length,
+        "Ovulation Day": ovulation_day,
+        "Luteal Phase Length": luteal_phase_length,
+        "Average Cycle Length": average_cycle_length,
+        "Peak Cycle": peak_cycle,
+        "Body Mass Index": body_mass_index,
+        "Reproductive Status": reproductive_status,
+        "High Fertility Start": high_fertility_start
+    }
+
+# Both models at once, so each button only shows its part
+with run.stage("predict"):
+    input_row = models.ensemble.matrix(input_values)
+    predictions = models.score(input_row)
+
+# Inputs and predictions go to the drift monitor (see drift_monitor.py), once per
+# new input row of a session rather than on every rerun
+with run.stage("drift"):
+    if st.session_state.get("drift_row") != input_row.tobytes():
+        st.session_state["drift_row"] = input_row.tobytes()
+        default_monitor("app_v4").observe(input_row, predictions)
 
 # Dynamic Prediction Feedback
 st.write("### Predictions:")
 
 # Fertility Prediction with Feedback
 if st.button("Get Fertility Prediction"):
-    fertility_prediction = rf_fertility.predict(input_data)[0]
+    fertility_prediction = predictions.predict("fertility")[0]
     fertility_message = "High Fertility" if fertility_prediction == 1 else "Low Fertility"
     fertility_color = "#2A9D8F" if fertility_prediction == 1 else "#A8DADC"
     
@@ -131,17 +175,12 @@ if st.button("Get Fertility Prediction"):
     """, unsafe_allow_html=True)
     
     # Circular Visualization for Fertility
-    fig, ax = plt.subplots(figsize=(3, 3))
-    circle = plt.Circle((0.5, 0.5), 0.4, color=fertility_color, ec="black", lw=3)
-    ax.add_artist(circle)
-    ax.set_xlim(0, 1)
-    ax.set_ylim(0, 1)
-    ax.axis("off")
-    st.pyplot(fig)
+    with run.stage("chart.fertility_gauge"):
+        st.image(fertility_gauge(fertility_color))
 
 # Cycle Regularity Prediction with Feedback
 if st.button("Get Cycle Regularity Prediction"):
-    cycle_regular_status = rf_regular_cycle.predict(input_data)[0]
+    cycle_regular_status = predictions.predict("regular_cycle")[0]
     
     # Flip the interpretation
     irregularity_message = "Regular Cycle" if cycle_regular_status == 1 else "Irregular Cycle"
@@ -154,36 +193,49 @@ if st.button("Get Cycle Regularity Prediction"):
     """, unsafe_allow_html=True)
 
 
-
-# Plot feature importances for both models side by side
-import matplotlib.pyplot as plt
-import numpy as np
-
-# Get feature importances
-fertility_importance = rf_fertility.feature_importances_
-regularity_importance = rf_regular_cycle.feature_importances_
-
-# Features and indices
-indices = np.arange(len(feature_columns))
-
-# Plot
-plt.figure(figsize=(10, 6))
-width = 0.35  # Bar width
-
-# Fertility model importances
-plt.bar(indices - width / 2, fertility_importance, width, label="Fertility Model", color="skyblue", edgecolor="black")
-
-# Cycle regularity model importances
-plt.bar(indices + width / 2, regularity_importance, width, label="Cycle Regularity Model", color="lightgreen", edgecolor="black")
-
-# Add labels and title
-plt.xticks(indices, feature_columns, rotation=45, ha="right")
-plt.ylabel("Importance Score")
-plt.title("Feature Importance in Predictions")
-plt.legend(loc="upper right")
-plt.tight_layout()
-
-st.pyplot(plt)
+# What-if sweep: the prediction over a whole range of one or two inputs, the others
+# held at the values above. Each grid is scored in one batch, and rows already in
+# the prediction cache (from earlier reruns or other sessions) are not scored again.
+st.write("### What-if sweep:")
+if st.toggle("Show how the prediction changes across a range of values"):
+    # Model -> (model, what class 1 means)
+    sweep_models = {
+        "Fertility": (fertility_model, "High Fertility"),
+        "Cycle Regularity": (regular_cycle_model, "Regular Cycle"),
+    }
+    sweep_model = st.selectbox("Model", list(sweep_models))
+    x_feature = st.selectbox("Vary", feature_columns, index=feature_columns.index("Ovulation Day"))
+    y_choices = ["Nothing"] + [name for name in feature_columns if name != x_feature]
+    y_feature = st.selectbox(
+        "Against",
+        y_choices,
+        index=y_choices.index("Luteal Phase Length") if "Luteal Phase Length" in y_choices else 0,
+    )
+    y_feature = None if y_feature == "Nothing" else y_feature
+
+    model, positive = sweep_models[sweep_model]
+    with run.stage("sweep"):
+        result = sweep(model, input_values, x_feature, y_feature)
+    marker = [input_values[x_feature]] + ([input_values[y_feature]] if y_feature else [])
+    with run.stage("chart.sweep"):
+        st.image(sweep_chart(result, marker, title=f"Probability of {positive}"))
+    if y_feature is None:
+        flips = result.flips()[0]
+        if len(flips):
+            st.write(f"The prediction changes at {x_feature} = " + ", ".join(f"{v:g}" for v in flips))
+        else:
+            st.write(f"The prediction does not change over this range of {x_feature}.")
+
+
+# Plot feature importances for both models side by side (rendered once per model version,
+# from the importances recorded in the registry)
+with run.stage("chart.feature_importance"):
+    st.image(feature_importance_chart(
+        [feature_importances('fertility'), feature_importances('regular_cycle')],
+        feature_columns,
+        labels=["Fertility Model", "Cycle Regularity Model"],
+        colors=["skyblue", "lightgreen"],
+    ))
 
 
 # Section for asking questions to Gemini with a nice prompt
@@ -191,11 +243,12 @@ st.write("### Ask Gemini about your cycle:")
 user_question = st.text_input("Ask a question about your cycle", help="Type your question here.")
 
 if user_question:
-    # Use Gemini to generate a response to the user’s question
-    model = genai.GenerativeModel("gemini-1.5-flash")
+    # Use Gemini to generate a response to the user’s question (cached, streamed as it arrives)
     try:
-        response = model.generate_content(user_question)
-        st.write(f"**Gemini's Response:** {response.text}")
+        with run.stage("llm"):
+            answer = get_client().ask(user_question)
+            st.write("**Gemini's Response:**")
+            st.write_stream(answer.stream())
     except Exception as e:
         st.write(f"Error occurred: {e}")
 
@@ -206,9 +259,5 @@ st.markdown("""
     </footer>
 """, unsafe_allow_html=True)
 
-
-
-
-
-
-
+# Debug panel and rerun log (does nothing unless profiling is on)
+run.finish()
@@ -0,0 +1,196 @@
+"""Score whole CSV exports with the fertility and cycle models, without the UI.
+
+The input is read in typed chunks (see ``data_store.py``), so files far larger
+than memory can be scored; a store directory built by data_store.py works as
+input too.
+Each chunk is mapped to the model inputs (see ``features.py``), scored by
+worker processes with the packed forests from the model registry (see
+``registry.py``), all models in one pass (see ``ensemble.py``), and written
+out in input order.
+Only a few chunks are in flight at any time. Blanks are filled with means
+over the whole file, taken in a first pass over the client-level columns,
+so the chunk size never changes a prediction.
+
+Usage::
+
+    python batch_score.py FilteredData.csv predictions.csv
+    python batch_score.py nightly_export.csv predictions.parquet --models v3 --workers 8
+"""
+import argparse
+import importlib.util
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from data_store import iter_chunks
+from ensemble import Ensemble, union_features
+from features import (
+    CLIENT_LEVEL_FEATURES, FEATURE_COLUMNS, FERTILITY_V3_COLUMNS, IRREGULAR_V3_COLUMNS,
+    SOURCE_COLUMNS, feature_frame, fill_missing_values, fill_statistics,
+)
+from registry import REGISTRY_DIR, Registry
+
+# Model sets the apps use: output name -> (registry name, input columns)
+MODEL_SETS = {
+    "v4": {
+        "fertility": ("fertility", FEATURE_COLUMNS),
+        "regular_cycle": ("regular_cycle", FEATURE_COLUMNS),
+    },
+    "v3": {
+        "fertility": ("fertility_v3", FERTILITY_V3_COLUMNS),
+        "irregular": ("irregular", IRREGULAR_V3_COLUMNS),
+    },
+}
+
+# Input columns copied to the output so rows can be matched up again
+ID_COLUMNS = ["ClientID", "CycleNumber", "Cycle Number"]
+
+_worker_ensemble = None
+
+
+def _union_columns(models):
+    return union_features(model_columns for _, model_columns in models.values())
+
+
+def _init_worker(models, registry_root):
+    global _worker_ensemble
+    # The packed forests are memory-mapped, so the workers share one copy
+    registry = Registry(registry_root)
+    _worker_ensemble = Ensemble({
+        name: (registry.load_compiled(model_name, expected_features=model_columns), model_columns)
+        for name, (model_name, model_columns) in models.items()
+    })
+
+
+def _score(models, X):
+    """Probability of class 1 and predicted class for every model."""
+    # X has the columns of _union_columns, the order the ensemble expects
+    result = _worker_ensemble.score(X)
+    return {name: (result.predict(name), result.probability(name)) for name in models}
+
+
+def _output_frame(ids, results):
+    frame = ids.reset_index(drop=True)
+    for name, (prediction, probability) in results.items():
+        frame[f"{name}_prediction"] = prediction
+        frame[f"{name}_probability"] = probability
+    return frame
+
+
+class _Writer:
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.endswith(".parquet")
+        self._parquet_writer = None
+        self._wrote_header = False
+
+    def write(self, frame):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode="a" if self._wrote_header else "w",
+                         header=not self._wrote_header, index=False)
+            self._wrote_header = True
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+
+def _fill_statistics(path, columns, chunksize):
+    """First pass: the means blanks are filled with, over the whole file."""
+    names = [name for name in ["Cycle Length"] + CLIENT_LEVEL_FEATURES if name in columns]
+    if not any(name in columns for name in CLIENT_LEVEL_FEATURES):
+        return None
+    wanted = {"ClientID"} | set(names) | {SOURCE_COLUMNS[name] for name in names}
+    return fill_statistics((feature_frame(chunk, names), chunk["ClientID"])
+                           for chunk in iter_chunks(path, wanted, chunksize)
+                           if "ClientID" in chunk.columns)
+
+
+def _chunks(path, columns, chunksize):
+    # Only parse what the models need; the exports have 80+ columns.
+    # "Ovulation Day (Noisy)" falls back to the plain ovulation day.
+    wanted = set(ID_COLUMNS) | {"Ovulation Day", "EstimatedDayofOvulation"}
+    for name in columns:
+        wanted.update([name, SOURCE_COLUMNS.get(name)])
+
+    # Blanks are filled as in training, or the models see NaN where they were
+    # trained on a client's mean; the means are those of the whole file, so
+    # the chunk size does not change any prediction
+    statistics = _fill_statistics(path, columns, chunksize)
+    state = None
+    for chunk in iter_chunks(path, wanted, chunksize):
+        ids = [name for name in ID_COLUMNS if name in chunk.columns]
+        frame = feature_frame(chunk, columns)
+        if "ClientID" in chunk.columns:
+            frame, state = fill_missing_values(frame, chunk["ClientID"], state, statistics)
+        yield chunk[ids], frame.to_numpy(dtype=np.float32)
+
+
+def score_file(input_path, output_path, models, chunksize=100_000, workers=None,
+               registry_root=REGISTRY_DIR):
+    """Score ``input_path`` with ``models`` and write the results to ``output_path``."""
+    workers = workers or os.cpu_count() or 1
+    columns = _union_columns(models)
+    writer = _Writer(output_path)
+    n_rows = 0
+    try:
+        if workers == 1:
+            _init_worker(models, registry_root)
+            for ids, X in _chunks(input_path, columns, chunksize):
+                writer.write(_output_frame(ids, _score(models, X)))
+                n_rows += len(X)
+            return n_rows
+
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(models, registry_root)) as pool:
+            pending = deque()
+            for ids, X in _chunks(input_path, columns, chunksize):
+                pending.append((ids, pool.submit(_score, models, X)))
+                # Bound memory: never hold more than a couple of chunks per worker
+                while len(pending) >= 2 * workers:
+                    ids_done, future = pending.popleft()
+                    writer.write(_output_frame(ids_done, future.result()))
+                    n_rows += len(ids_done)
+            while pending:
+                ids_done, future = pending.popleft()
+                writer.write(_output_frame(ids_done, future.result()))
+                n_rows += len(ids_done)
+        return n_rows
+    finally:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a CSV export with the cycle models")
+    parser.add_argument("input", help="CSV in the FilteredData.csv schema, or a data_store.py store")
+    parser.add_argument("output", help="Output file, .csv or .parquet")
+    parser.add_argument("--models", choices=sorted(MODEL_SETS), default="v4",
+                        help="v4: 8-feature models of app_v4.py, v3: 3-feature models of app_v3.py")
+    parser.add_argument("--registry", default=REGISTRY_DIR, help="Model registry directory")
+    parser.add_argument("--chunksize", type=int, default=100_000, help="Rows per chunk")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes (default: all cores)")
+    args = parser.parse_args()
+    if args.output.endswith(".parquet") and importlib.util.find_spec("pyarrow") is None:
+        parser.error("install pyarrow for .parquet output (pip install pyarrow)")
+
+    start = time.perf_counter()
+    n_rows = score_file(args.input, args.output, MODEL_SETS[args.models],
+                        chunksize=args.chunksize, workers=args.workers,
+                        registry_root=args.registry)
+    elapsed = time.perf_counter() - start
+    print(f"Scored {n_rows} rows in {elapsed:.1f} s ({n_rows / max(elapsed, 1e-9):,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
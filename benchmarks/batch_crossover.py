@@ -0,0 +1,157 @@
+"""Where the packed engine stops beating scikit-learn as batches grow.
+
+The engine (forest_engine.py) walks every (row, tree) pair with NumPy array
+operations, so its cost grows with the batch from a very low start;
+scikit-learn's compiled tree walk has a large fixed cost per call and a
+small one per row. For every model in the registry and every batch size we
+record the median ``predict_proba`` time of
+
+    sklearn     the original forest
+    traversal   the packed engine, never falling back
+    engine      the engine as the registry returns it, which hands batches of
+                ``BATCH_CROSSOVER`` rows or more to the original forest
+
+and ``crossover``, the smallest batch size at which scikit-learn was
+faster. ``BATCH_CROSSOVER`` should sit at or below the crossovers measured
+here. For each model set of batch_score.py the same is recorded for all its
+models: ``sklearn`` scores them one after another, ``traversal`` is the
+joined walk of ``ensemble.Ensemble`` and ``ensemble`` its ``predict_proba``. Rows are sampled, with replacement, from the export as
+batch_score.py reads it.
+
+Usage::
+
+    python benchmarks/batch_crossover.py --output benchmarks/results/batch_crossover.json
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import sys
+import warnings
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from suite import _timings  # noqa: E402
+
+SIZES = [1, 10, 100, 200, 500, 1000, 2000, 5000, 20000, 100000]
+DATA = "FilteredData.csv"
+
+
+def sample_rows(features, n_rows, path=DATA, seed=0):
+    from batch_score import _chunks
+
+    X = np.concatenate([X for _, X in _chunks(path, features, 100_000)])
+    return X[np.random.default_rng(seed).integers(0, len(X), n_rows)]
+
+
+def _repeats(n_rows, budget=200_000):
+    return int(min(50, max(3, budget // n_rows)))
+
+
+def bench(registry_root="models", sizes=SIZES):
+    from forest_engine import BATCH_CROSSOVER
+    from registry import Registry
+
+    registry = Registry(registry_root)
+    results = {"batch_crossover": BATCH_CROSSOVER, "cpus": os.cpu_count(),
+               "machine": platform.machine(), "models": {}}
+    for name in registry.names():
+        entry = registry.resolve(name)
+        model = registry.load_model(name)
+        engine = registry.load_compiled(name)
+        traversal = copy.copy(engine)
+        traversal.fallback = None
+        X_all = sample_rows(entry["features"], max(sizes))
+        timings = {}
+        for n_rows in sizes:
+            X = X_all[:n_rows]
+            repeats = _repeats(n_rows)
+            row = {}
+            with warnings.catch_warnings():
+                # The forests were fitted on frames; plain arrays score the same
+                warnings.simplefilter("ignore")
+                for label, scorer in (("sklearn", model), ("traversal", traversal), ("engine", engine)):
+                    row[f"{label}_ms"] = float(np.median(
+                        _timings(lambda: scorer.predict_proba(X), repeats)))
+            timings[str(n_rows)] = row
+        slower = [n for n in sizes if timings[str(n)]["sklearn_ms"] < timings[str(n)]["traversal_ms"]]
+        results["models"][name] = {"trees": engine.n_trees, "crossover": min(slower) if slower else None,
+                                   "timings": timings}
+    results["ensembles"] = bench_ensembles(registry, sizes)
+    return results
+
+
+def bench_ensembles(registry, sizes=SIZES):
+    from batch_score import MODEL_SETS, _union_columns
+    from ensemble import Ensemble
+
+    results = {}
+    for set_name, models in MODEL_SETS.items():
+        features = _union_columns(models)
+        ensemble = Ensemble({name: (registry.load_compiled(model_name), columns)
+                             for name, (model_name, columns) in models.items()})
+        forests = [(registry.load_model(model_name), ensemble._feature_index[name])
+                   for name, (model_name, _) in models.items()]
+        X_all = sample_rows(features, max(sizes))
+
+        def sklearn(X):
+            return [model.predict_proba(X[:, index]) for model, index in forests]
+
+        def traversal(X):
+            ensemble._proba(X, np.empty((len(X), len(ensemble.classes))))
+
+        timings = {}
+        for n_rows in sizes:
+            X = X_all[:n_rows]
+            repeats = _repeats(n_rows)
+            row = {}
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                for label, scorer in (("sklearn", sklearn), ("traversal", traversal),
+                                      ("ensemble", ensemble.predict_proba)):
+                    row[f"{label}_ms"] = float(np.median(_timings(lambda: scorer(X), repeats)))
+            timings[str(n_rows)] = row
+        slower = [n for n in sizes if timings[str(n)]["sklearn_ms"] < timings[str(n)]["traversal_ms"]]
+        results[set_name] = {"models": list(models), "crossover": min(slower) if slower else None,
+                             "timings": timings}
+    return results
+
+
+def _print_timings(title, result, last):
+    print(f"\n{title}: crossover at {result['crossover']} rows")
+    print(f"{'rows':>8} {'sklearn':>10} {'traversal':>10} {last:>10}  (ms)")
+    for n_rows, row in result["timings"].items():
+        print(f"{n_rows:>8} {row['sklearn_ms']:>10.2f} {row['traversal_ms']:>10.2f} "
+              f"{row[f'{last}_ms']:>10.2f}")
+
+
+def print_results(results):
+    print(f"BATCH_CROSSOVER = {results['batch_crossover']} rows")
+    for name, result in results["models"].items():
+        _print_timings(f"{name} ({result['trees']} trees)", result, "engine")
+    for name, result in results.get("ensembles", {}).items():
+        _print_timings(f"{name} ensemble ({', '.join(result['models'])})", result, "ensemble")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the engine and scikit-learn by batch size")
+    parser.add_argument("--sizes", type=int, nargs="*", default=SIZES, help="Batch sizes")
+    parser.add_argument("--output", help="Write the results here as JSON")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    results = bench(sizes=args.sizes)
+    print_results(results)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=1)
+            file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Cold-start cost of the Streamlit apps: import time and time to first page.
+
+Each app is run once per fresh Python process, the way a new replica serves
+its first session: Streamlit is already imported, then the script runs for
+the first time. We record
+
+    first_page_seconds   wall time of that first script run
+    imports_ms           ``-X importtime`` cumulative time of the top-level
+                         packages the run imported (Streamlit excluded)
+
+and keep the median over ``--runs`` processes. Results are written as JSON;
+``--compare`` prints them next to an earlier results file.
+
+Usage::
+
+    python benchmarks/import_time.py --output benchmarks/results/import_time.json
+    python benchmarks/import_time.py --compare benchmarks/results/import_time.json
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPS = ["app.py", "app_v2.py", "app_v3.py", "app_v4.py"]
+
+# Streamlit is imported before the marker; only the app's own imports follow it
+_CHILD = """
+import sys, time, warnings
+warnings.simplefilter("ignore")
+from streamlit.testing.v1 import AppTest
+sys.stderr.write("::ready::\\n")
+sys.stderr.flush()
+start = time.perf_counter()
+at = AppTest.from_file({path!r}, default_timeout=120).run()
+print("::first_page::", time.perf_counter() - start, flush=True)
+print("::exceptions::", len(at.exception), flush=True)
+"""
+
+_IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def _top_level_imports(stderr):
+    """Cumulative microseconds of each top-level package in ``-X importtime`` output."""
+    totals = {}
+    for line in stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        # importtime indents nested imports by two spaces per level
+        if indent <= 1:
+            package = name.split(".")[0]
+            totals[package] = totals.get(package, 0) + cumulative
+    return totals
+
+
+def run_once(app):
+    env = dict(os.environ, GEMINI_BACKEND="fake")
+    env.setdefault("GEMINI_API_KEY", "fake")
+    code = _CHILD.format(path=os.path.join(ROOT, app))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    imports = _top_level_imports(result.stderr.split("::ready::", 1)[1])
+    first_page = float(re.search(r"::first_page:: (\S+)", result.stdout).group(1))
+    exceptions = int(re.search(r"::exceptions:: (\d+)", result.stdout).group(1))
+    return first_page, imports, exceptions
+
+
+def measure(apps=APPS, runs=3):
+    results = {}
+    for app in apps:
+        pages, import_runs, exceptions = [], [], 0
+        for _ in range(runs):
+            first_page, imports, errors = run_once(app)
+            pages.append(first_page)
+            import_runs.append(imports)
+            exceptions = max(exceptions, errors)
+        packages = sorted({name for imports in import_runs for name in imports})
+        imports_ms = {
+            name: statistics.median(imports.get(name, 0) for imports in import_runs) / 1000
+            for name in packages
+        }
+        results[app] = {
+            "first_page_seconds": statistics.median(pages),
+            "imports_ms": dict(sorted(imports_ms.items(), key=lambda item: -item[1])),
+            "exceptions": exceptions,
+        }
+    return {"python": sys.version.split()[0], "runs": runs, "apps": results}
+
+
+def _print(results, baseline=None):
+    for app, result in results["apps"].items():
+        before = (baseline or {}).get("apps", {}).get(app)
+        line = f"{app:<10} first page {result['first_page_seconds']:.2f} s"
+        if before:
+            line += f" (was {before['first_page_seconds']:.2f} s)"
+        if result["exceptions"]:
+            line += f"  [{result['exceptions']} exceptions]"
+        print(line)
+        for name, ms in list(result["imports_ms"].items())[:8]:
+            was = ""
+            if before:
+                was = f" (was {before['imports_ms'].get(name, 0):.0f})"
+            print(f"    {name:<24} {ms:8.0f} ms{was}")
+        if before:
+            gone = [name for name in before["imports_ms"] if name not in result["imports_ms"]]
+            if gone:
+                print(f"    no longer imported: {', '.join(gone)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app import time and first page time")
+    parser.add_argument("apps", nargs="*", default=APPS)
+    parser.add_argument("--runs", type=int, default=3, help="Fresh processes per app")
+    parser.add_argument("--output", help="Write the results here as JSON")
+    parser.add_argument("--compare", help="Earlier results to print next to these")
+    args = parser.parse_args()
+
+    results = measure(args.apps, args.runs)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    _print(results, baseline)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=1)
+            file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
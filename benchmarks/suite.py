@@ -0,0 +1,331 @@
+"""Benchmarks of the prediction and rendering hot paths.
+
+For every model in the registry (see registry.py) we record
+
+    load_seconds, rss_mb       reading the artifact in a fresh process, for the
+                               scikit-learn forest and for the packed engine
+    predict_ms, predict_proba_ms
+                               one row at a time, median and p95, on rows of
+                               preprocessed_data.csv
+    batch_ms                   every sample row in one call
+
+for scikit-learn, the compiled engine and the prediction cache (warm). For
+each model set of batch_score.py the same latencies are taken for all its
+models scored one after another (``separate``) and in one pass by an
+``ensemble.Ensemble`` (``ensemble``). Each
+chart in charts.py is rendered without its cache (``render_ms``), and each
+app runs headless under Streamlit's AppTest with Gemini faked: the first
+script run, a rerun, every button and a question (``*_seconds``). Apps run
+in their own process, so imports from one do not speed up the next.
+
+Every number is lower-is-better. Results are written as JSON; ``--compare``
+prints each number next to a baseline with its ratio, marks the ones more
+than ``--tolerance`` slower, and with ``--fail`` exits non-zero when there
+are any.
+
+Usage::
+
+    python benchmarks/suite.py --output benchmarks/results/suite.json
+    python benchmarks/suite.py --compare benchmarks/results/suite.json --fail
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import warnings
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+APPS = ["app.py", "app_v2.py", "app_v3.py", "app_v4.py"]
+DATA = "preprocessed_data.csv"
+
+_LOAD_CHILD = """
+import json, os, sys, time, warnings
+warnings.simplefilter("ignore")
+sys.path.insert(0, {root!r})
+import numpy, joblib
+import sklearn.ensemble
+try:
+    import psutil
+    rss = psutil.Process().memory_info
+except ImportError:  # psutil is optional; memory is then not reported
+    rss = None
+before = rss().rss if rss else 0
+start = time.perf_counter()
+if {kind!r} == "engine":
+    from forest_engine import PackedForest
+    artifact = PackedForest.load({path!r})
+    # Touch every array, as a first prediction over the whole forest would
+    sum(int(array.sum()) for array in (artifact.feature, artifact.left, artifact.right))
+else:
+    import model_loader
+    artifact = model_loader._read_artifact({path!r})
+seconds = time.perf_counter() - start
+result = {{"load_seconds": seconds}}
+if rss:
+    result["rss_mb"] = (rss().rss - before) / 2**20
+print(json.dumps(result))
+"""
+
+_APP_CHILD = """
+import json, sys, time, warnings
+warnings.simplefilter("ignore")
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file({path!r}, default_timeout=120)
+timings = {{}}
+start = time.perf_counter()
+at.run()
+timings["first_run_seconds"] = time.perf_counter() - start
+reruns = []
+for _ in range({runs}):
+    start = time.perf_counter()
+    at.run()
+    reruns.append(time.perf_counter() - start)
+timings["rerun_seconds"] = sorted(reruns)[len(reruns) // 2]
+for i, button in enumerate(at.button):
+    start = time.perf_counter()
+    at.button[i].click().run()
+    timings[f"button_{{i}}_seconds"] = time.perf_counter() - start
+questions = [box for box in at.text_input if "question" in box.label.lower()]
+if questions:
+    start = time.perf_counter()
+    questions[0].input("How long is a normal cycle?").run()
+    timings["question_seconds"] = time.perf_counter() - start
+timings["exceptions"] = len(at.exception)
+print("::timings::", json.dumps(timings))
+"""
+
+
+def _child_env():
+    env = dict(os.environ, GEMINI_BACKEND="fake")
+    env.setdefault("GEMINI_API_KEY", "fake")
+    return env
+
+
+def _run_child(code):
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=_child_env(),
+                            capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+def _timings(function, repeats):
+    timings = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings[i] = time.perf_counter() - start
+    return timings * 1000
+
+
+def _latency(predict, X, rows):
+    single = np.empty(min(rows, len(X)))
+    for i, row in enumerate(X[:len(single)]):
+        start = time.perf_counter()
+        predict(row[None, :])
+        single[i] = time.perf_counter() - start
+    single *= 1000
+    return {"median_ms": float(np.median(single)), "p95_ms": float(np.percentile(single, 95))}
+
+
+def sample_rows(features, path=DATA):
+    """Rows of ``path`` with every one of ``features``, as the apps would send them."""
+    from data_store import load_table
+    from features import feature_frame, fill_client_values
+
+    table = load_table(path)
+    frame = feature_frame(table, features)
+    frame, _ = fill_client_values(frame, table["ClientID"].to_numpy())
+    return frame.dropna().to_numpy(dtype=np.float64)
+
+
+def bench_models(registry_root="models", rows=200, repeats=5):
+    from model_loader import load_model
+    from prediction_cache import PredictionCache, cached_model
+    from registry import Registry
+
+    registry = Registry(registry_root)
+    results = {}
+    for name in registry.names():
+        entry = registry.resolve(name)
+        X = sample_rows(entry["features"])
+        result = {"rows": len(X)}
+        for kind in ("model", "engine"):
+            path = os.path.abspath(registry.object_path(entry["object"], kind))
+            code = _LOAD_CHILD.format(root=ROOT, kind=kind, path=path)
+            result[f"{kind}_load"] = json.loads(_run_child(code))
+
+        model = load_model(registry.object_path(entry["object"]))
+        engine = registry.load_compiled(name)
+        cached = cached_model(name, registry=registry, cache=PredictionCache(), precompute=False)
+        cached.predict_proba(X)  # warm: every sample row is in the cache
+        for label, scorer in (("sklearn", model), ("engine", engine), ("cached", cached)):
+            with warnings.catch_warnings():
+                # The forests were fitted on frames; plain arrays are fine here
+                warnings.simplefilter("ignore")
+                result[label] = {
+                    "predict": _latency(scorer.predict, X, rows),
+                    "predict_proba": _latency(scorer.predict_proba, X, rows),
+                    "batch_ms": float(np.median(_timings(lambda: scorer.predict_proba(X), repeats))),
+                }
+        results[name] = result
+    return results
+
+
+def bench_ensembles(registry_root="models", rows=200, repeats=5):
+    from batch_score import MODEL_SETS, _union_columns
+    from ensemble import Ensemble
+    from registry import Registry
+
+    registry = Registry(registry_root)
+    results = {}
+    for set_name, models in MODEL_SETS.items():
+        columns = _union_columns(models)
+        X = sample_rows(columns)
+        engines = {name: (registry.load_compiled(model_name), model_columns)
+                   for name, (model_name, model_columns) in models.items()}
+        ensemble = Ensemble(engines)
+        indices = [[columns.index(c) for c in model_columns] for _, model_columns in engines.values()]
+
+        def separate(X):
+            return [engine.predict_proba(X[:, index])
+                    for (engine, _), index in zip(engines.values(), indices)]
+
+        result = {"rows": len(X)}
+        for label, scorer in (("separate", separate), ("ensemble", ensemble.predict_proba)):
+            result[label] = {
+                "predict_proba": _latency(scorer, X, rows),
+                "batch_ms": float(np.median(_timings(lambda: scorer(X), repeats))),
+            }
+        results[set_name] = result
+    return results
+
+
+def bench_charts(repeats=5):
+    import charts
+    from features import FEATURE_COLUMNS
+    from registry import feature_importances, load_compiled
+    from sweep import sweep
+
+    values = {"Cycle Length": 28, "Ovulation Day": 14, "Luteal Phase Length": 12,
+              "Average Cycle Length": 28, "Peak Cycle": 1, "Body Mass Index": 22.0,
+              "Reproductive Status": 1, "High Fertility Start": 12}
+    engine = load_compiled("fertility")
+    heatmap = sweep(engine, values, "Ovulation Day", "Luteal Phase Length")
+    line = sweep(engine, values, "Ovulation Day")
+    importances = [feature_importances("fertility"), feature_importances("regular_cycle")]
+
+    # The uncached renderers, so every repeat draws the chart again
+    renders = {
+        "fertility_gauge": lambda: charts._render_fertility_gauge("#2A9D8F", "png"),
+        "feature_importance": lambda: charts._render_feature_importance(
+            importances, FEATURE_COLUMNS, ["Fertility Model", "Cycle Regularity Model"],
+            ["skyblue", "lightgreen"], "png"),
+        "fertility_pie": lambda: charts._render_fertility_pie(True, "png"),
+        "prediction_counts": lambda: charts._render_prediction_counts("png"),
+        "sweep_heatmap": lambda: charts._render_sweep(heatmap, (14.0, 12.0), "", "png"),
+        "sweep_line": lambda: charts._render_sweep(line, (14.0,), "", "png"),
+    }
+    results = {}
+    for name, render in renders.items():
+        first = _timings(render, 1)[0]  # includes importing matplotlib, once
+        timings = _timings(render, repeats)
+        results[name] = {"first_render_ms": float(first), "render_ms": float(np.median(timings))}
+    return results
+
+
+def bench_apps(apps=APPS, runs=3):
+    results = {}
+    for app in apps:
+        code = _APP_CHILD.format(path=os.path.join(ROOT, app), runs=runs)
+        output = _run_child(code)
+        results[app] = json.loads(output.split("::timings::", 1)[1])
+    return results
+
+
+def run(apps=APPS, rows=200, repeats=5, runs=3):
+    import sklearn
+
+    return {
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "sklearn": sklearn.__version__,
+        "models": bench_models(rows=rows, repeats=repeats),
+        "ensembles": bench_ensembles(rows=rows, repeats=repeats),
+        "charts": bench_charts(repeats),
+        "apps": bench_apps(apps, runs),
+    }
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(results, baseline, tolerance=0.25):
+    """Print every number next to the baseline; returns the ones that got slower."""
+    current, before = _flatten(results), _flatten(baseline)
+    slower = []
+    for path, value in current.items():
+        if path.endswith(".rows") or path.endswith(".exceptions"):
+            line = f"{path:<52} {value:>10}"
+            if path in before and before[path] != value:
+                line += f"  (was {before[path]})"
+            print(line)
+            continue
+        if path not in before:
+            print(f"{path:<52} {value:>10.3f}  (new)")
+            continue
+        ratio = value / before[path] if before[path] else float("inf")
+        mark = ""
+        if ratio > 1 + tolerance:
+            mark = "  SLOWER"
+            slower.append(path)
+        print(f"{path:<52} {value:>10.3f}  was {before[path]:>10.3f}  x{ratio:.2f}{mark}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark model loading, scoring, charts and apps")
+    parser.add_argument("--apps", nargs="*", default=APPS)
+    parser.add_argument("--rows", type=int, default=200, help="Rows scored one at a time")
+    parser.add_argument("--repeats", type=int, default=5, help="Repeats of batch and chart timings")
+    parser.add_argument("--runs", type=int, default=3, help="Reruns of each app")
+    parser.add_argument("--output", help="Write the results here as JSON")
+    parser.add_argument("--compare", help="Baseline results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Mark numbers more than this fraction above the baseline")
+    parser.add_argument("--fail", action="store_true", help="Exit 1 if any number is marked")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    results = run(args.apps, args.rows, args.repeats, args.runs)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=1)
+            file.write("\n")
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    slower = compare(results, baseline, args.tolerance)
+    if slower:
+        print(f"\n{len(slower)} numbers more than {args.tolerance:.0%} above the baseline")
+        if args.fail:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
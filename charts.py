@@ -0,0 +1,189 @@
+"""Rendered charts for the apps, cached per process.
+
+The app script runs again on every widget change, but the charts only change
+when the models or the colors do. Each chart is rendered once, with the
+object-oriented ``Figure`` API (no pyplot global state, so nothing piles up
+in a long-running server), and the image bytes are kept in a small LRU
+cache keyed by the plotted values and colors. Show them with ``st.image``.
+
+matplotlib is imported on the first render, not with this module. The
+fertility gauge is a plain circle and is drawn with Pillow (which Streamlit
+loads anyway), so pages that only show the gauge never import matplotlib.
+"""
+import io
+import threading
+from collections import OrderedDict
+
+# Rendered images kept per process
+MAX_CACHED_CHARTS = 64
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _cached(key, render):
+    with _lock:
+        image = _cache.get(key)
+        if image is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return image
+        _stats["misses"] += 1
+
+    # Rendering happens outside the lock; two sessions may race to render
+    # the same chart, which is harmless
+    image = render()
+    with _lock:
+        _cache[key] = image
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_CACHED_CHARTS:
+            _cache.popitem(last=False)
+    return image
+
+
+def _to_bytes(fig, fmt):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    FigureCanvasAgg(fig)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt, dpi=200, bbox_inches="tight")
+    # Drop the artists now instead of waiting for the garbage collector
+    fig.clear()
+    return buffer.getvalue()
+
+
+def _render_fertility_gauge(color, fmt, size=504, scale=4):
+    from PIL import Image, ImageDraw
+
+    # Same geometry as the matplotlib version it replaces: a 372 px circle
+    # with a 3 pt black edge at 200 dpi. Drawn large and scaled down, so
+    # the edge is antialiased.
+    big = size * scale
+    margin = (size - 372) // 2 * scale
+    image = Image.new("RGB", (big, big), "white")
+    ImageDraw.Draw(image).ellipse(
+        (margin, margin, big - margin, big - margin), fill=color, outline="black", width=8 * scale
+    )
+    image = image.resize((size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def fertility_gauge(color, fmt="png"):
+    """The colored circle shown next to a fertility prediction."""
+    return _cached(("fertility_gauge", color, fmt), lambda: _render_fertility_gauge(color, fmt))
+
+
+def _render_feature_importance(importances, feature_names, labels, colors, fmt):
+    import numpy as np
+    from matplotlib.figure import Figure
+
+    indices = np.arange(len(feature_names))
+    width = 0.7 / len(importances)  # Bar width
+
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    for i, (values, label, color) in enumerate(zip(importances, labels, colors)):
+        offset = (i - (len(importances) - 1) / 2) * width
+        ax.bar(indices + offset, values, width, label=label, color=color, edgecolor="black")
+
+    ax.set_xticks(indices, feature_names, rotation=45, ha="right")
+    ax.set_ylabel("Importance Score")
+    ax.set_title("Feature Importance in Predictions")
+    ax.legend(loc="upper right")
+    fig.tight_layout()
+    return _to_bytes(fig, fmt)
+
+
+def feature_importance_chart(importances, feature_names, labels, colors, fmt="png"):
+    """Side-by-side bars of the feature importances of several models.
+
+    ``importances`` holds one sequence per model, for example from
+    ``registry.feature_importances``.
+    """
+    importances = tuple(tuple(float(v) for v in values) for values in importances)
+    key = ("feature_importance", importances, tuple(feature_names), tuple(labels),
+           tuple(colors), fmt)
+    return _cached(key, lambda: _render_feature_importance(
+        importances, feature_names, labels, colors, fmt
+    ))
+
+
+def _render_fertility_pie(high, fmt):
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    ax = fig.add_subplot()
+    ax.pie([1 if high else 0, 0 if high else 1], labels=["High Fertility", "Low Fertility"],
+           autopct="%1.1f%%", startangle=90, colors=["#4CAF50", "#FF5733"])
+    ax.axis("equal")  # Equal aspect ratio ensures that pie is drawn as a circle.
+    return _to_bytes(fig, fmt)
+
+
+def fertility_pie(high, fmt="png"):
+    """The pie chart app.py shows for its rule-based fertility prediction."""
+    return _cached(("fertility_pie", bool(high), fmt), lambda: _render_fertility_pie(bool(high), fmt))
+
+
+def _render_prediction_counts(fmt):
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    ax = fig.add_subplot()
+    ax.bar(["Regular Cycle", "Irregular Cycle"], [255, 30], color=["#FF5733", "#4CAF50"])
+    ax.set_title("Prediction Counts")
+    return _to_bytes(fig, fmt)
+
+
+def prediction_counts_chart(fmt="png"):
+    """The bar chart app.py shows under its cycle prediction."""
+    return _cached(("prediction_counts", fmt), lambda: _render_prediction_counts(fmt))
+
+
+def _render_sweep(result, marker, title, fmt):
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 5))
+    ax = fig.add_subplot()
+    if result.y_feature is None:
+        ax.step(result.x_values, result.probability[0], where="mid", color="#2A9D8F")
+        ax.axhline(0.5, color="grey", linestyle="--", linewidth=1)
+        ax.set_ylim(0, 1)
+        ax.set_ylabel("Probability")
+        if marker is not None:
+            ax.axvline(marker[0], color="black", linewidth=1)
+    else:
+        # Cells are centered on the swept values
+        mesh = ax.pcolormesh(result.x_values, result.y_values, result.probability,
+                             vmin=0, vmax=1, cmap="viridis", shading="nearest")
+        fig.colorbar(mesh, ax=ax, label="Probability")
+        # Outline where the prediction flips, when it does
+        if result.probability.min() < 0.5 < result.probability.max() and min(result.probability.shape) > 1:
+            ax.contour(result.x_values, result.y_values, result.probability, levels=[0.5],
+                       colors="white", linewidths=1)
+        ax.set_ylabel(result.y_feature)
+        if marker is not None:
+            ax.plot(*marker, marker="x", color="red", markersize=10, markeredgewidth=2)
+    ax.set_xlabel(result.x_feature)
+    ax.set_title(title)
+    fig.tight_layout()
+    return _to_bytes(fig, fmt)
+
+
+def sweep_chart(result, marker=None, title="", fmt="png"):
+    """A what-if sweep (see sweep.py): a heatmap for two features, a step plot for one.
+
+    ``marker`` is the user's own ``(x, y)`` (or ``(x,)``) point.
+    """
+    marker = None if marker is None else tuple(float(v) for v in marker)
+    key = ("sweep", result.x_feature, result.y_feature, result.x_values.tobytes(),
+           None if result.y_values is None else result.y_values.tobytes(),
+           result.probability.tobytes(), marker, title, fmt)
+    return _cached(key, lambda: _render_sweep(result, marker, title, fmt))
+
+
+def chart_cache_stats():
+    with _lock:
+        return dict(_stats, entries=len(_cache))
@@ -0,0 +1,233 @@
+"""Fertile windows, cycle phases and the training labels, for arrays of cycles.
+
+The labels and windows used to be worked out in several places: the
+notebook and pipeline.py built Irregular and Fertility with masks over the
+whole frame, app.py decided "High Fertility" for one ovulation day with an
+``if``, and history.py placed the fertile window around a forecast
+ovulation. Everything here takes and returns NumPy arrays (a scalar works
+as an array of one), so training, batch scoring and the apps share one
+definition and label a whole export as cheaply as one cycle.
+
+    fertility_label        ovulation on days 12-16 (the notebook's Fertility)
+    irregular_label        outside 20-40 days, or more than ``sigma`` standard
+                           deviations from the mean length (Irregular)
+    client_irregular_label the same, with each client's own mean and standard
+                           deviation, for clients with enough cycles
+    ovulation_day          the recorded ovulation day, or the cycle length
+                           minus the luteal phase
+    fertile_window         first day of high fertility (FirstDayofHigh) when
+                           it was recorded, otherwise 5 days before ovulation,
+                           up to the day after ovulation
+    phases                 menses, follicular, fertile and luteal day ranges
+
+Missing values are NaN and propagate to the days that depend on them; a
+label of a cycle with an unknown length or ovulation day is 0.
+
+Usage::
+
+    python cycle_analytics.py --data FilteredData.csv --output cycles.csv --client-sigma
+"""
+import argparse
+
+import numpy as np
+
+# The notebook's label rules
+FERTILE_DAYS = (12, 16)
+MIN_LENGTH, MAX_LENGTH = 20, 40
+SIGMA = 1.5
+
+# Days of the fertile window before and after ovulation, when the first day
+# of high fertility was not recorded
+FERTILE_DAYS_BEFORE = 5
+FERTILE_DAYS_AFTER = 1
+
+# Clients with fewer cycles than this are judged against everyone's lengths
+MIN_CLIENT_CYCLES = 3
+
+# Phase code -> name, see ``phase_on``
+PHASES = np.array(["menses", "follicular", "fertile", "luteal", "unknown"])
+
+
+def _array(values):
+    return np.asarray(values, dtype=np.float64)
+
+
+def fertility_label(ovulation_day, fertile_days=FERTILE_DAYS):
+    """1 where ovulation falls on ``fertile_days`` (inclusive), else 0."""
+    ovulation_day = _array(ovulation_day)
+    return ((ovulation_day >= fertile_days[0]) & (ovulation_day <= fertile_days[1])).astype(np.int64)
+
+
+def fertility_status(ovulation_day, fertile_days=FERTILE_DAYS):
+    """"High Fertility" or "Low Fertility" for every ovulation day."""
+    return np.where(fertility_label(ovulation_day, fertile_days) == 1,
+                    "High Fertility", "Low Fertility")
+
+
+def _moments(length):
+    known = length[~np.isnan(length)]
+    return known.mean(), known.std(ddof=1)
+
+
+def _irregular(length, mean, std, sigma, min_length, max_length):
+    return ((length < min_length) | (length > max_length)
+            | (np.abs(length - mean) > sigma * std)).astype(np.int64)
+
+
+def irregular_label(length, sigma=SIGMA, min_length=MIN_LENGTH, max_length=MAX_LENGTH,
+                    mean=None, std=None):
+    """1 for cycles outside ``min_length``-``max_length`` days or more than ``sigma``
+    standard deviations from the mean length.
+
+    ``mean`` and ``std`` default to those of ``length`` (the sample standard
+    deviation, as pandas computes it).
+    """
+    length = _array(length)
+    if mean is None:
+        mean, std = _moments(length)
+    return _irregular(length, mean, std, sigma, min_length, max_length)
+
+
+def client_length_stats(clients, length):
+    """Count, mean and sample standard deviation of each row's client's cycle lengths.
+
+    Every array has one entry per row; unknown lengths are left out.
+    """
+    length = _array(length)
+    _, client = np.unique(np.asarray(clients), return_inverse=True)
+    client = client.ravel()
+    known = ~np.isnan(length)
+    count = np.bincount(client[known], minlength=client.max() + 1 if len(client) else 0)
+    total = np.bincount(client[known], length[known], minlength=len(count))
+    mean = np.divide(total, count, out=np.full(len(count), np.nan), where=count > 0)
+    deviation = np.where(known, length - mean[client], 0.0)
+    m2 = np.bincount(client, deviation ** 2, minlength=len(count))
+    std = np.sqrt(np.divide(m2, count - 1, out=np.full(len(count), np.nan), where=count > 1))
+    return count[client], mean[client], std[client]
+
+
+def client_irregular_label(clients, length, sigma=SIGMA, min_length=MIN_LENGTH,
+                           max_length=MAX_LENGTH, min_cycles=MIN_CLIENT_CYCLES,
+                           mean=None, std=None):
+    """``irregular_label`` with each client's own mean and standard deviation.
+
+    A client's usual length is what counts: 34 days is regular for someone
+    whose cycles are all 33-35 days, and 28 days is not for someone who
+    always has 24. Clients with fewer than ``min_cycles`` known lengths are
+    judged against ``mean`` and ``std`` (by default those of all cycles).
+    """
+    length = _array(length)
+    if mean is None:
+        mean, std = _moments(length)
+    count, client_mean, client_std = client_length_stats(clients, length)
+    own = count >= min_cycles
+    return _irregular(length, np.where(own, client_mean, mean), np.where(own, client_std, std),
+                      sigma, min_length, max_length)
+
+
+def ovulation_day(length, ovulation=None, luteal=None):
+    """The recorded ovulation day, or one luteal phase before the end of the
+    cycle where it is missing (in the exports the two agree for 99% of cycles)."""
+    length = _array(length)
+    day = np.full(length.shape, np.nan) if ovulation is None else _array(ovulation)
+    if luteal is not None:
+        day = np.where(np.isnan(day), length - _array(luteal), day)
+    return day
+
+
+def fertile_window(ovulation, first_high=None, days_before=FERTILE_DAYS_BEFORE,
+                   days_after=FERTILE_DAYS_AFTER):
+    """First and last fertile day of every cycle."""
+    ovulation = _array(ovulation)
+    start = ovulation - days_before
+    if first_high is not None:
+        first_high = _array(first_high)
+        # A first high day after ovulation is a recording error
+        recorded = ~np.isnan(first_high) & ~(first_high > ovulation)
+        start = np.where(recorded, first_high, start)
+    return start, ovulation + days_after
+
+
+def phases(length, ovulation=None, luteal=None, first_high=None, menses=None):
+    """The day ranges of each phase of every cycle (day 1 is the first day of the period).
+
+    ``ovulation``, ``luteal``, ``first_high`` and ``menses`` are the recorded
+    EstimatedDayofOvulation, LengthofLutealPhase, FirstDayofHigh and
+    LengthofMenses; any of them may be missing.
+    """
+    length = _array(length)
+    day = ovulation_day(length, ovulation, luteal)
+    fertile_start, fertile_end = fertile_window(day, first_high)
+    menses_end = np.full(length.shape, np.nan) if menses is None else _array(menses)
+    return {
+        "length": length,
+        "menses_end": menses_end,
+        # Follicular days run from the end of menses until the fertile window
+        "follicular_start": menses_end + 1,
+        "fertile_start": fertile_start,
+        "ovulation_day": day,
+        "fertile_end": fertile_end,
+        "luteal_start": fertile_end + 1,
+        "luteal_length": length - day,
+    }
+
+
+def phase_on(day, bounds):
+    """Index into ``PHASES`` of the phase each cycle is in on cycle day ``day``."""
+    day = _array(day)
+    menses = day <= bounds["menses_end"]
+    fertile = (day >= bounds["fertile_start"]) & (day <= bounds["fertile_end"])
+    before = day < bounds["fertile_start"]
+    after = (day > bounds["fertile_end"]) & (day <= bounds["length"])
+    # Menses wins over a fertile window that overlaps it
+    return np.select([menses, fertile, before, after], [0, 2, 1, 3], default=4)
+
+
+def label_cycles(table, sigma=SIGMA, per_client=False):
+    """Phases and labels of every cycle of an export (a ``data_store.load_table`` frame)."""
+    import pandas as pd
+
+    def column(name):
+        return pd.to_numeric(table[name], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+
+    length = column("LengthofCycle")
+    frame = pd.DataFrame(phases(length, column("EstimatedDayofOvulation"),
+                                column("LengthofLutealPhase"), column("FirstDayofHigh"),
+                                column("LengthofMenses")), index=table.index)
+    frame = frame.drop(columns="length")
+    if per_client:
+        frame["Irregular"] = client_irregular_label(table["ClientID"].to_numpy(), length, sigma)
+    else:
+        frame["Irregular"] = irregular_label(length, sigma)
+    frame["Fertility"] = fertility_label(frame["ovulation_day"].to_numpy())
+    frame.insert(0, "CycleNumber", table["CycleNumber"].to_numpy())
+    frame.insert(0, "ClientID", table["ClientID"].to_numpy())
+    return frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Label every cycle of an export and find its phases")
+    parser.add_argument("--data", default="FilteredData.csv", help="CSV export or data_store.py store")
+    parser.add_argument("--output", help="Write the table here (CSV) instead of a summary")
+    parser.add_argument("--sigma", type=float, default=SIGMA,
+                        help="Standard deviations from the mean length that count as irregular")
+    parser.add_argument("--client-sigma", action="store_true",
+                        help="Judge cycle lengths against each client's own mean and spread")
+    args = parser.parse_args()
+
+    from data_store import load_table
+
+    table = load_table(args.data)
+    table = table[table["LengthofCycle"].notna()]
+    cycles = label_cycles(table, args.sigma, args.client_sigma)
+    if args.output:
+        cycles.to_csv(args.output, index=False)
+        print(f"Wrote {len(cycles)} cycles to {args.output}")
+        return
+    print(f"{len(cycles)} cycles of {cycles['ClientID'].nunique()} clients")
+    print(f"Irregular: {cycles['Irregular'].mean():.1%}, Fertility: {cycles['Fertility'].mean():.1%}")
+    print(cycles.drop(columns=["ClientID", "CycleNumber"]).describe().round(1).to_string())
+
+
+if __name__ == "__main__":
+    main()
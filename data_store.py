@@ -0,0 +1,386 @@
+"""Typed, columnar copies of the CSV exports, parsed once and memory-mapped.
+
+FilteredData.csv and preprocessed_data.csv pad missing values with a single
+space, so a plain ``pd.read_csv`` leaves most of the 80 columns as text and
+every reader has to clean them up again. ``build_store`` parses a CSV once
+against the explicit ``SCHEMA`` below and writes one ``.npy`` file per column
+(plus a missing-value mask), next to a ``schema.json``. ``load_table`` then
+memory-maps those files and wraps them in nullable pandas arrays without
+copying, rebuilding the store first if the CSV changed.
+
+Usage::
+
+    python data_store.py FilteredData.csv preprocessed_data.csv
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+STORE_ROOT = ".store"
+FORMAT_VERSION = 1
+
+# Every column of the exports and its type. Missing values are allowed
+# everywhere; text columns are stored dictionary-encoded.
+SCHEMA = {
+    "ClientID": "string",
+    "CycleNumber": "Int16",
+    "Group": "Int16",
+    "CycleWithPeakorNot": "Int16",
+    "ReproductiveCategory": "Int16",
+    "LengthofCycle": "Int16",
+    "MeanCycleLength": "Float64",
+    "EstimatedDayofOvulation": "Int16",
+    "LengthofLutealPhase": "Int16",
+    "FirstDayofHigh": "Int16",
+    "TotalNumberofHighDays": "Int16",
+    "TotalHighPostPeak": "Int16",
+    "TotalNumberofPeakDays": "Int16",
+    "TotalDaysofFertility": "Int16",
+    "TotalFertilityFormula": "Int16",
+    "LengthofMenses": "Int16",
+    "MeanMensesLength": "Float64",
+    "MensesScoreDayOne": "Int16",
+    "MensesScoreDayTwo": "Int16",
+    "MensesScoreDayThree": "Int16",
+    "MensesScoreDayFour": "Int16",
+    "MensesScoreDayFive": "Int16",
+    "MensesScoreDaySix": "Int16",
+    "MensesScoreDaySeven": "Int16",
+    "MensesScoreDayEight": "Int16",
+    "MensesScoreDayNine": "Int16",
+    "MensesScoreDayTen": "Int16",
+    "MensesScoreDay11": "Int16",
+    "MensesScoreDay12": "Int16",
+    "MensesScoreDay13": "Int16",
+    "MensesScoreDay14": "Int16",
+    "MensesScoreDay15": "Int16",
+    "TotalMensesScore": "Int16",
+    "MeanBleedingIntensity": "Float64",
+    "NumberofDaysofIntercourse": "Int16",
+    "IntercourseInFertileWindow": "Int16",
+    "UnusualBleeding": "Int16",
+    "PhasesBleeding": "Int16",
+    "IntercourseDuringUnusBleed": "Int16",
+    "Age": "Int16",
+    "AgeM": "Int16",
+    "Maristatus": "Int16",
+    "MaristatusM": "Int16",
+    "Yearsmarried": "Int16",
+    "Wedding": "Int32",
+    "Religion": "Int16",
+    "ReligionM": "Int16",
+    "Ethnicity": "Int16",
+    "EthnicityM": "Int16",
+    "Schoolyears": "Int16",
+    "SchoolyearsM": "Int16",
+    "OccupationM": "Int16",
+    "IncomeM": "Int16",
+    "Height": "Int16",
+    "Weight": "Int16",
+    "Reprocate": "Int16",
+    "Numberpreg": "Int16",
+    "Livingkids": "Int16",
+    "Miscarriages": "Int16",
+    "Abortions": "Int16",
+    "Medvits": "Int16",
+    "Medvitexplain": "string",
+    "Gynosurgeries": "string",
+    "LivingkidsM": "Int16",
+    "Boys": "Int16",
+    "Girls": "Int16",
+    "MedvitsM": "Int16",
+    "MedvitexplainM": "string",
+    "Urosurgeries": "string",
+    "Breastfeeding": "Int16",
+    "Method": "Int16",
+    "Prevmethod": "Int16",
+    "Methoddate": "Int32",
+    "Whychart": "Int16",
+    "Nextpreg": "Int16",
+    "NextpregM": "Int16",
+    "Spousesame": "Int16",
+    "SpousesameM": "Int16",
+    "Timeattemptpreg": "Int16",
+    "BMI": "Float64",
+    # Added by the notebook in preprocessed_data.csv
+    "Cycle Length": "Int16",
+    "Cycle Number": "Int16",
+    "Ovulation Day": "Float64",
+    "Irregular": "Int16",
+    "Fertility": "Int16",
+    "Ovulation Day (Noisy)": "Float64",
+}
+
+# The exports pad missing values with a single space
+NA_VALUES = [" ", ""]
+
+_NUMPY_TYPES = {"Int16": np.int16, "Int32": np.int32, "Float64": np.float64, "string": np.int32}
+
+
+class SchemaError(ValueError):
+    """Raised when a CSV does not match the schema."""
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_info(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def store_path(csv_path, root=STORE_ROOT):
+    """The store directory of ``csv_path``: its name, plus a hash of its absolute
+    path so that exports with the same name in different directories do not
+    share a store."""
+    location = os.path.realpath(csv_path)
+    name = os.path.splitext(os.path.basename(location))[0]
+    return os.path.join(root, f"{name}-{hashlib.sha256(location.encode()).hexdigest()[:12]}")
+
+
+def _check_columns(columns, schema):
+    unknown = [name for name in columns if name not in schema]
+    if unknown:
+        raise SchemaError(f"Columns not in the schema: {', '.join(unknown)}")
+
+
+def read_csv_chunks(path, columns=None, chunksize=100_000, schema=SCHEMA):
+    """Parse a CSV export in typed chunks (nullable pandas dtypes).
+
+    Only the ``columns`` present in the file are read (all of them if None).
+    """
+    header = list(pd.read_csv(path, nrows=0).columns)
+    usecols = header if columns is None else [name for name in header if name in columns]
+    _check_columns(usecols, schema)
+    dtypes = {name: schema[name] for name in usecols}
+    try:
+        yield from pd.read_csv(path, usecols=usecols, dtype=dtypes, na_values=NA_VALUES,
+                               keep_default_na=False, chunksize=chunksize)
+    except (ValueError, TypeError) as e:
+        raise SchemaError(f"{path} does not match the schema: {e}") from e
+
+
+def read_appended(path, offset=0, columns=None, schema=SCHEMA):
+    """Typed rows of a CSV export after byte ``offset``, and the offset after them.
+
+    Offset 0 reads every row. Only whole lines are read, so a file that is
+    being appended to is read up to its last newline; pass the returned
+    offset next time to read just the rows added since.
+    """
+    with open(path, "rb") as file:
+        header = list(pd.read_csv(io.BytesIO(file.readline()), nrows=0).columns)
+        start = max(offset, file.tell())
+        file.seek(start)
+        data = file.read()
+    data = data[:data.rfind(b"\n") + 1]
+    usecols = header if columns is None else [name for name in header if name in columns]
+    _check_columns(usecols, schema)
+    dtypes = {name: schema[name] for name in usecols}
+    if not data:
+        return pd.DataFrame({name: pd.Series(dtype=dtypes[name]) for name in usecols}), start
+    try:
+        frame = pd.read_csv(io.BytesIO(data), header=None, names=header, usecols=usecols, dtype=dtypes,
+                            na_values=NA_VALUES, keep_default_na=False)
+    except (ValueError, TypeError) as e:
+        raise SchemaError(f"{path} does not match the schema: {e}") from e
+    return frame[usecols], start + len(data)
+
+
+class _ColumnWriter:
+    """Appends a column chunk by chunk, then writes it out as .npy files."""
+
+    def __init__(self, directory, index, dtype):
+        self.dtype = dtype
+        self.values_path = os.path.join(directory, f"{index}.values.npy")
+        self.mask_path = os.path.join(directory, f"{index}.mask.npy")
+        self._values = tempfile.TemporaryFile(dir=directory)
+        self._mask = tempfile.TemporaryFile(dir=directory)
+        self.length = 0
+        self.categories = {} if dtype == "string" else None
+
+    def append(self, series):
+        mask = series.isna().to_numpy()
+        if self.categories is not None:
+            # Encode per chunk, then map the chunk's codes onto the file-wide ones
+            local, uniques = pd.factorize(series)
+            mapping = np.array(
+                [self.categories.setdefault(text, len(self.categories)) for text in uniques] + [-1],
+                dtype=np.int32,
+            )
+            values = mapping[local]  # local code -1 (missing) picks the trailing -1
+        else:
+            values = series.to_numpy(dtype=_NUMPY_TYPES[self.dtype],
+                                     na_value=np.nan if self.dtype == "Float64" else 0)
+        self._values.write(values.tobytes())
+        self._mask.write(mask.tobytes())
+        self.length += len(series)
+
+    def _finish(self, raw, path, dtype):
+        header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                  "fortran_order": False, "shape": (self.length,)}
+        raw.seek(0)
+        with open(path, "wb") as out:
+            np.lib.format.write_array_header_1_0(out, header)
+            shutil.copyfileobj(raw, out)
+        raw.close()
+
+    def finish(self):
+        self._finish(self._values, self.values_path, _NUMPY_TYPES[self.dtype])
+        self._finish(self._mask, self.mask_path, np.bool_)
+
+
+def build_store(csv_path, root=STORE_ROOT, chunksize=100_000, schema=SCHEMA):
+    """Parse ``csv_path`` once into a columnar store and return its directory."""
+    directory = store_path(csv_path, root)
+    os.makedirs(root, exist_ok=True)
+    # A directory of its own, so builds of the same store running at once do
+    # not write into each other
+    building = tempfile.mkdtemp(prefix=os.path.basename(directory) + ".building-", dir=root)
+    # mkdtemp makes it private; the store is as readable as any other directory
+    os.chmod(building, 0o755)
+    try:
+        _write_store(csv_path, building, chunksize, schema)
+    except BaseException:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+
+    # Swap the finished store in, so readers never see a half-written one
+    shutil.rmtree(directory, ignore_errors=True)
+    try:
+        os.replace(building, directory)
+    except OSError:
+        # Another build swapped its store in first; readers check it against the CSV
+        shutil.rmtree(building, ignore_errors=True)
+    return directory
+
+
+def _write_store(csv_path, building, chunksize, schema):
+    writers = None
+    for chunk in read_csv_chunks(csv_path, chunksize=chunksize, schema=schema):
+        if writers is None:
+            writers = [_ColumnWriter(building, i, schema[name]) for i, name in enumerate(chunk.columns)]
+            columns = list(chunk.columns)
+        for writer, name in zip(writers, columns):
+            writer.append(chunk[name])
+    if writers is None:
+        raise SchemaError(f"{csv_path} has no rows")
+
+    for writer in writers:
+        writer.finish()
+    manifest = {
+        "format": FORMAT_VERSION,
+        "source": dict(_source_info(csv_path), sha256=_file_digest(csv_path)),
+        "rows": writers[0].length,
+        "columns": [
+            {"name": name, "dtype": writer.dtype, "file": i,
+             "categories": None if writer.categories is None else list(writer.categories)}
+            for i, (name, writer) in enumerate(zip(columns, writers))
+        ],
+    }
+    with open(os.path.join(building, "schema.json"), "w") as file:
+        json.dump(manifest, file, indent=1)
+
+
+def _read_manifest(directory):
+    with open(os.path.join(directory, "schema.json")) as file:
+        return json.load(file)
+
+
+def _is_current(directory, csv_path):
+    try:
+        manifest = _read_manifest(directory)
+    except (OSError, ValueError):
+        return False
+    if manifest.get("format") != FORMAT_VERSION:
+        return False
+    source = manifest["source"]
+    info = _source_info(csv_path)
+    if info == {"size": source["size"], "mtime_ns": source["mtime_ns"]}:
+        return True
+    # Touched but maybe not changed: compare the content
+    return info["size"] == source["size"] and _file_digest(csv_path) == source["sha256"]
+
+
+def _column_array(directory, column):
+    # Copy-on-write maps: callers may modify the frame without touching the files
+    values = np.load(os.path.join(directory, f"{column['file']}.values.npy"), mmap_mode="c")
+    mask = np.load(os.path.join(directory, f"{column['file']}.mask.npy"), mmap_mode="c")
+    dtype = column["dtype"]
+    if dtype == "string":
+        return pd.Categorical.from_codes(values, categories=column["categories"])
+    if dtype == "Float64":
+        return pd.arrays.FloatingArray(values, mask)
+    return pd.arrays.IntegerArray(values, mask)
+
+
+def open_store(directory, columns=None):
+    """The stored table as a DataFrame of nullable, memory-mapped columns."""
+    manifest = _read_manifest(directory)
+    stored = {column["name"]: column for column in manifest["columns"]}
+    names = list(stored) if columns is None else list(columns)
+    missing = [name for name in names if name not in stored]
+    if missing:
+        raise KeyError(f"Columns not in {directory}: {', '.join(missing)}")
+    return pd.DataFrame({name: _column_array(directory, stored[name]) for name in names},
+                        copy=False)
+
+
+def load_table(csv_path, columns=None, root=STORE_ROOT):
+    """Typed contents of a CSV export, read from (and if needed built into) the store."""
+    directory = store_path(csv_path, root)
+    if not _is_current(directory, csv_path):
+        build_store(csv_path, root)
+    return open_store(directory, columns)
+
+
+def source_digest(csv_path, root=STORE_ROOT):
+    """sha256 of a CSV export's content, as recorded in (and if needed built into) the store."""
+    directory = store_path(csv_path, root)
+    if not _is_current(directory, csv_path):
+        build_store(csv_path, root)
+    return _read_manifest(directory)["source"]["sha256"]
+
+
+def iter_chunks(path, columns=None, chunksize=100_000):
+    """Typed chunks of a CSV export or of an existing store directory.
+
+    Like ``read_csv_chunks``, only the ``columns`` present are returned.
+    """
+    if os.path.isdir(path):
+        if columns is not None:
+            stored = [column["name"] for column in _read_manifest(path)["columns"]]
+            columns = [name for name in stored if name in columns]
+        table = open_store(path, columns)
+        for start in range(0, len(table), chunksize):
+            yield table.iloc[start:start + chunksize]
+    else:
+        yield from read_csv_chunks(path, columns, chunksize)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the columnar store for CSV exports")
+    parser.add_argument("csv", nargs="+", help="CSV files in the FilteredData.csv schema")
+    parser.add_argument("--root", default=STORE_ROOT, help="Directory holding the stores")
+    parser.add_argument("--chunksize", type=int, default=100_000, help="Rows parsed at a time")
+    args = parser.parse_args()
+
+    for path in args.csv:
+        directory = build_store(path, args.root, args.chunksize)
+        manifest = _read_manifest(directory)
+        print(f"{path}: {manifest['rows']} rows, {len(manifest['columns'])} columns -> {directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,511 @@
+"""Drift and data-quality monitor for the live model inputs and predictions.
+
+Every input feature is kept as a fixed-bin histogram (whole days get one bin
+each, other features 64 equal bins over the training range, plus a bin below
+and one above it) together with its count, mean and variance, and every
+model's predictions as counts per class. That is a few kilobytes however
+many rows go by. ``report`` compares them with the same sketches of the
+training data (``python drift_monitor.py reference`` writes those to
+``models/drift_reference_v4.json``):
+
+    psi            population stability index over bins holding at least 5%
+                   of the training rows (0.1 worth a look, 0.25 a shift)
+    ks             largest difference between the two cumulative histograms
+    out_of_range   share of rows outside the values seen in training
+    invalid        share outside ``VALID_RANGES``, e.g. the notebook's
+                   20-40 day cycles
+
+Scoring code only hands its rows over: ``observe`` keeps a reference to the
+batch, and the batches are added to the histograms in bulk every few
+seconds or few thousand rows, so the scoring path pays about a microsecond.
+
+    monitor = default_monitor("app_v4")
+    monitor.observe(X, result)      # X in FEATURE_COLUMNS order, an EnsembleResult
+    monitor.report()
+
+app_v4.py saves its sketches to ``.drift/app_v4.json`` (``python
+drift_monitor.py report`` prints them); prediction_server.py adds the report
+to ``GET /metrics``. ``python drift_monitor.py check export.csv`` runs a
+whole export through the models and reports it against training.
+"""
+import argparse
+import atexit
+import json
+import math
+import os
+import threading
+import time
+import warnings
+from collections import deque
+
+import numpy as np
+
+from cycle_analytics import MAX_LENGTH, MIN_LENGTH
+
+REFERENCE_PATH = os.path.join("models", "drift_reference_v4.json")
+STATE_DIR = ".drift"
+
+# Bump when the sketches saved by ``save`` change meaning
+FORMAT_VERSION = 1
+
+EQUAL_BINS = 64
+MAX_DAY_BINS = 128
+# Neighbouring bins are pooled for the PSI until they hold this share of the training rows
+PSI_MIN_SHARE = 0.05
+# Shares are floored at this, so a bin empty on one side does not divide by zero
+PSI_FLOOR = 1e-4
+PSI_WARN, PSI_ALERT = 0.1, 0.25
+# Fewer rows than this are reported but not judged
+MIN_ROWS = 100
+
+# Inputs the models were never meant to see, whatever the training data held
+VALID_RANGES = {
+    "Cycle Length": (MIN_LENGTH, MAX_LENGTH),
+    "Ovulation Day": (1, 31),
+    "Luteal Phase Length": (1, 18),
+    "Body Mass Index": (10.0, 50.0),
+}
+
+# Pending rows are added to the histograms after this many rows or seconds
+FLUSH_ROWS = 4096
+FLUSH_SECONDS = 5.0
+SAVE_SECONDS = 60.0
+
+# Rows per chunk when a whole export is sketched; the reference and ``check``
+# read in the same chunks, so the blanks are filled the same way
+CHUNKSIZE = 100_000
+
+
+def _edges(values):
+    """Bin edges for a feature, from its training values."""
+    values = values[~np.isnan(values)]
+    low, high = float(values.min()), float(values.max())
+    if np.array_equal(values, np.round(values)):
+        # Whole numbers: one bin per value, centred on it
+        width = max(1, math.ceil((high - low + 1) / MAX_DAY_BINS))
+        return np.arange(low - 0.5, high + 0.5 + width, width)
+    return np.linspace(low, np.nextafter(high, np.inf), EQUAL_BINS + 1)
+
+
+def _status(psi, rows):
+    if rows < MIN_ROWS:
+        return "too few rows"
+    return "shift" if psi >= PSI_ALERT else "watch" if psi >= PSI_WARN else "ok"
+
+
+def psi(expected, actual):
+    """Population stability index of two count vectors over the same bins."""
+    expected = np.maximum(expected / max(expected.sum(), 1), PSI_FLOOR)
+    actual = np.maximum(actual / max(actual.sum(), 1), PSI_FLOOR)
+    return float(((actual - expected) * np.log(actual / expected)).sum())
+
+
+class Sketch:
+    """Histogram, moments and missing count of one feature.
+
+    ``counts[0]`` holds the values below ``edges[0]``, ``counts[-1]`` those
+    from ``edges[-1]`` on, and ``counts[k]`` those in ``[edges[k-1], edges[k])``.
+    """
+
+    def __init__(self, edges, counts=None, missing=0, count=0, mean=0.0, m2=0.0):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = (np.zeros(len(self.edges) + 1, dtype=np.int64) if counts is None
+                       else np.asarray(counts, dtype=np.int64))
+        self.missing = int(missing)
+        self.count, self.mean, self.m2 = int(count), float(mean), float(m2)
+
+    def add(self, values):
+        nan = np.isnan(values)
+        if nan.any():
+            self.missing += int(nan.sum())
+            values = values[~nan]
+        if not len(values):
+            return
+        self.counts += np.bincount(np.searchsorted(self.edges, values, side="right"),
+                                   minlength=len(self.counts))
+        # Moments of the batch merged into the running ones (Chan et al.)
+        n, mean = len(values), float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        total = self.count + n
+        delta = mean - self.mean
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.mean += delta * n / total
+        self.count = total
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else float("nan")
+
+    def quantile(self, q):
+        """``q`` quantile, interpolated inside its bin (rows outside the edges count at them)."""
+        if not self.count:
+            return float("nan")
+        cumulative = np.cumsum(self.counts)
+        target = q * self.count
+        k = int(np.searchsorted(cumulative, target))
+        if k == 0 or k == len(self.counts) - 1:
+            return float(self.edges[min(k, len(self.edges) - 1)])
+        before = cumulative[k - 1]
+        share = (target - before) / self.counts[k] if self.counts[k] else 0.0
+        low, high = self.edges[k - 1], self.edges[k]
+        return float(low + share * (high - low))
+
+    def psi_groups(self):
+        """Bin -> group, pooling neighbouring in-range bins of a training sketch."""
+        groups = np.zeros(len(self.counts), dtype=np.intp)
+        group, held = 1, 0
+        for k in range(1, len(self.counts) - 1):
+            if held >= PSI_MIN_SHARE * self.count:
+                group, held = group + 1, 0
+            groups[k] = group
+            held += self.counts[k]
+        if held < PSI_MIN_SHARE * self.count and group > 1:
+            # The last bins join the group before them
+            groups[groups == group] = group - 1
+            group -= 1
+        groups[-1] = group + 1
+        return groups
+
+    def to_dict(self):
+        return {"edges": self.edges.tolist(), "counts": self.counts.tolist(),
+                "missing": self.missing, "count": self.count, "mean": self.mean, "m2": self.m2}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class _Disabled:
+    enabled = False
+
+    def observe(self, X, predictions=None):
+        pass
+
+    def report(self):
+        return None
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+DISABLED = _Disabled()
+
+
+class DriftMonitor:
+    """Sketches of the live inputs and predictions, compared with a training reference."""
+
+    enabled = True
+
+    def __init__(self, reference, save_path=None):
+        self.reference = reference
+        self.features = list(reference["features"])
+        self.models = {name: model["classes"] for name, model in reference["models"].items()}
+        self._reference_sketches = {name: Sketch.from_dict(data)
+                                    for name, data in reference["features"].items()}
+        self._groups = {name: sketch.psi_groups() for name, sketch in self._reference_sketches.items()}
+        self.save_path = save_path
+        self._lock = threading.Lock()
+        # Guards the pending row count and the flush flag only, so ``observe``
+        # never waits for a flush that is adding to the histograms
+        self._queue_lock = threading.Lock()
+        self._pending = deque()
+        self._pending_rows = 0
+        self._flushed = self._saved = time.monotonic()
+        self._flushing = False
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.rows = 0
+            self.sketches = {name: Sketch(sketch.edges)
+                             for name, sketch in self._reference_sketches.items()}
+            self.invalid = {name: 0 for name in self.features if name in VALID_RANGES}
+            self.classes = {name: np.zeros(len(classes), dtype=np.int64)
+                            for name, classes in self.models.items()}
+            self._pending.clear()
+            with self._queue_lock:
+                self._pending_rows = 0
+
+    def observe(self, X, predictions=None):
+        """Queue a batch: ``X`` a 2D array in ``features`` order, ``predictions`` an
+        ``EnsembleResult`` or a dict of model name -> predicted classes."""
+        self._pending.append((X, predictions))
+        with self._queue_lock:
+            self._pending_rows += len(X)
+            start = ((self._pending_rows >= FLUSH_ROWS
+                      or time.monotonic() - self._flushed >= FLUSH_SECONDS) and not self._flushing)
+            if start:
+                self._flushing = True
+        if start:
+            # Off the caller's thread, so no request waits for the histograms
+            threading.Thread(target=self._flush_in_background, daemon=True).start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            with self._queue_lock:
+                self._flushing = False
+
+    def flush(self):
+        with self._lock:
+            with self._queue_lock:
+                self._pending_rows = 0
+            # popleft is atomic, so batches observed meanwhile wait for the next flush
+            batches = [self._pending.popleft() for _ in range(len(self._pending))]
+            self._flushed = time.monotonic()
+            if batches:
+                self._add(batches)
+        if self.save_path and time.monotonic() - self._saved >= SAVE_SECONDS:
+            self.save(self.save_path)
+
+    def _add(self, batches):
+        X = np.concatenate([X for X, _ in batches]).astype(np.float64, copy=False)
+        self.rows += len(X)
+        for j, name in enumerate(self.features):
+            self.sketches[name].add(X[:, j])
+            if name in self.invalid:
+                low, high = VALID_RANGES[name]
+                self.invalid[name] += int(((X[:, j] < low) | (X[:, j] > high)).sum())
+        scored = [predictions for _, predictions in batches if predictions is not None]
+        if not scored:
+            return
+        for name, classes in self.models.items():
+            classes = np.asarray(classes)
+            if all(hasattr(predictions, "proba") for predictions in scored):
+                # EnsembleResults: one argmax over all the batches
+                proba = np.concatenate([predictions.proba[name] for predictions in scored])
+                predicted = classes.take(np.argmax(proba, axis=1))
+            else:
+                predicted = np.concatenate([predictions.predict(name) if hasattr(predictions, "predict")
+                                            else predictions[name] for predictions in scored])
+            self.classes[name] += (predicted[:, None] == classes).sum(axis=0)
+
+    def report(self):
+        """PSI, KS, range checks and summary statistics per feature and model."""
+        self.flush()
+        with self._lock:
+            features = {}
+            for name in self.features:
+                sketch, reference = self.sketches[name], self._reference_sketches[name]
+                groups = self._groups[name]
+                live_cdf = np.cumsum(sketch.counts) / max(sketch.count, 1)
+                reference_cdf = np.cumsum(reference.counts) / max(reference.count, 1)
+                drift = psi(np.bincount(groups, reference.counts), np.bincount(groups, sketch.counts))
+                features[name] = {
+                    "count": sketch.count,
+                    "missing": sketch.missing / self.rows if self.rows else 0.0,
+                    "out_of_range": (sketch.counts[0] + sketch.counts[-1]) / max(sketch.count, 1),
+                    "mean": sketch.mean if sketch.count else float("nan"),
+                    "std": sketch.std,
+                    "p05": sketch.quantile(0.05),
+                    "p50": sketch.quantile(0.5),
+                    "p95": sketch.quantile(0.95),
+                    "reference_mean": reference.mean,
+                    "reference_std": reference.std,
+                    "psi": drift,
+                    "ks": float(np.abs(live_cdf - reference_cdf).max()) if sketch.count else 0.0,
+                    "status": _status(drift, sketch.count),
+                }
+                if name in self.invalid:
+                    features[name]["invalid"] = self.invalid[name] / max(sketch.count, 1)
+            predictions = {}
+            for name, classes in self.models.items():
+                counts = self.classes[name]
+                reference_rates = np.asarray(self.reference["models"][name]["rates"])
+                drift = psi(reference_rates, counts.astype(np.float64))
+                total = max(int(counts.sum()), 1)
+                predictions[name] = {
+                    "rates": {str(c): n / total for c, n in zip(classes, counts.tolist())},
+                    "reference_rates": {str(c): r for c, r in zip(classes, reference_rates.tolist())},
+                    "psi": drift,
+                    "status": _status(drift, int(counts.sum())),
+                }
+            return {"rows": self.rows, "features": features, "predictions": predictions}
+
+    def close(self):
+        """Add the pending rows and save, if there is somewhere to save to."""
+        self.flush()
+        if self.save_path:
+            self.save(self.save_path)
+
+    def save(self, path):
+        """Write the live sketches as JSON (atomically), to report on or resume from."""
+        self._saved = time.monotonic()
+        with self._lock:
+            state = {
+                "format": FORMAT_VERSION, "rows": self.rows, "saved": time.time(),
+                "features": {name: sketch.to_dict() for name, sketch in self.sketches.items()},
+                "invalid": self.invalid,
+                "classes": {name: counts.tolist() for name, counts in self.classes.items()},
+            }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(state, file)
+        os.replace(temporary, path)
+
+    def restore(self, path):
+        """Continue from sketches saved by ``save``; returns False if they do not fit."""
+        with open(path) as file:
+            state = json.load(file)
+        sketches = {name: Sketch.from_dict(data) for name, data in state["features"].items()}
+        if (state.get("format") != FORMAT_VERSION or list(sketches) != self.features
+                or any(not np.array_equal(sketches[name].edges, self.sketches[name].edges)
+                       for name in self.features)
+                or set(state["classes"]) != set(self.models)):
+            return False
+        with self._lock:
+            self.rows = state["rows"]
+            self.sketches = sketches
+            self.invalid.update(state["invalid"])
+            self.classes = {name: np.asarray(counts, dtype=np.int64)
+                            for name, counts in state["classes"].items()}
+        return True
+
+
+def load_reference(path=REFERENCE_PATH):
+    with open(path) as file:
+        return json.load(file)
+
+
+def export_features(source, features, chunksize=CHUNKSIZE):
+    """Chunks of the ``features`` matrix of an export, filled as the scoring path fills it."""
+    from batch_score import _chunks
+
+    for _, X in _chunks(source, features, chunksize):
+        yield X
+
+
+def build_reference(source="FilteredData.csv", models=None, registry=None):
+    """Sketches of the training export as the models score it (see
+    ``export_features``) and the class rates of ``models`` (a batch_score.py
+    model set) on it."""
+    from batch_score import MODEL_SETS, _union_columns
+    from data_store import source_digest
+    from ensemble import load_ensemble
+
+    models = models or MODEL_SETS["v4"]
+    features = _union_columns(models)
+    X = np.concatenate(list(export_features(source, features))).astype(np.float64)
+
+    ensemble = load_ensemble(models, registry=registry)
+    result = ensemble.score(X)
+    sketches = {}
+    for j, name in enumerate(features):
+        sketch = Sketch(_edges(X[:, j]))
+        sketch.add(X[:, j])
+        sketches[name] = sketch.to_dict()
+    reference_models = {}
+    for name, (model_name, _) in models.items():
+        classes = ensemble.model_classes[name]
+        predicted = result.predict(name)
+        reference_models[name] = {
+            "registry": model_name,
+            "classes": classes.tolist(),
+            "rates": [float((predicted == c).mean()) for c in classes],
+        }
+    return {"source": os.path.basename(source), "source_digest": source_digest(source),
+            "rows": len(X), "features": sketches, "models": reference_models}
+
+
+_monitors = {}
+_monitors_lock = threading.Lock()
+
+
+def default_monitor(name, reference_path=REFERENCE_PATH):
+    """The process-wide monitor ``name``, saved to ``.drift/<name>.json``.
+
+    Sketches saved there by an earlier process are picked up again, and they
+    are saved every minute and when the process exits. Without a
+    reference file the monitor does nothing (``DISABLED``).
+    """
+    monitor = _monitors.get(name)
+    if monitor is None:
+        with _monitors_lock:
+            monitor = _monitors.get(name)
+            if monitor is None:
+                try:
+                    reference = load_reference(reference_path)
+                except OSError:
+                    monitor = DISABLED
+                else:
+                    path = os.path.join(STATE_DIR, f"{name}.json")
+                    monitor = DriftMonitor(reference, save_path=path)
+                    if os.path.exists(path):
+                        try:
+                            restored = monitor.restore(path)
+                        except (OSError, ValueError, KeyError, TypeError) as error:
+                            # A truncated or hand-edited file must not stop the app
+                            warnings.warn(f"Ignoring the drift sketches in {path}: {error}")
+                        else:
+                            if not restored:
+                                warnings.warn(f"Ignoring the drift sketches in {path}: "
+                                              "they do not match the reference")
+                    atexit.register(monitor.close)
+                _monitors[name] = monitor
+    return monitor
+
+
+def print_report(report):
+    print(f"{report['rows']} rows")
+    print(f"{'Feature':<24} {'PSI':>6} {'KS':>6} {'Mean':>8} {'Train':>8} "
+          f"{'Missing':>8} {'Outside':>8} {'Invalid':>8}  Status")
+    for name, row in report["features"].items():
+        invalid = f"{row['invalid']:>8.1%}" if "invalid" in row else f"{'':>8}"
+        print(f"{name:<24} {row['psi']:>6.3f} {row['ks']:>6.3f} {row['mean']:>8.2f} "
+              f"{row['reference_mean']:>8.2f} {row['missing']:>8.1%} {row['out_of_range']:>8.1%} "
+              f"{invalid}  {row['status']}")
+    for name, row in report["predictions"].items():
+        rates = ", ".join(f"{c}: {rate:.1%} (train {row['reference_rates'][c]:.1%})"
+                          for c, rate in row["rates"].items())
+        print(f"{name:<24} {row['psi']:>6.3f}  {rates}  {row['status']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare model inputs and predictions with training")
+    parser.add_argument("--reference", default=REFERENCE_PATH, help="Training sketches (JSON)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+    builder = commands.add_parser("reference", help="Sketch the training data")
+    builder.add_argument("--data", default="FilteredData.csv", help="CSV export the models were trained on")
+    reporter = commands.add_parser("report", help="Report on sketches saved by an app")
+    reporter.add_argument("--state", default=os.path.join(STATE_DIR, "app_v4.json"))
+    checker = commands.add_parser("check", help="Run an export through the models and report on it")
+    checker.add_argument("input", help="CSV in the FilteredData.csv schema, or a data_store.py store")
+    checker.add_argument("--chunksize", type=int, default=CHUNKSIZE, help="Rows per chunk")
+    args = parser.parse_args()
+
+    if args.command == "reference":
+        reference = build_reference(args.data)
+        os.makedirs(os.path.dirname(args.reference) or ".", exist_ok=True)
+        with open(args.reference, "w") as file:
+            json.dump(reference, file, indent=1)
+            file.write("\n")
+        print(f"Wrote sketches of {reference['rows']} training rows to {args.reference}")
+        return
+
+    monitor = DriftMonitor(load_reference(args.reference))
+    if args.command == "report":
+        if not monitor.restore(args.state):
+            parser.error(f"{args.state} does not match {args.reference}")
+    else:
+        from batch_score import MODEL_SETS
+        from ensemble import load_ensemble
+
+        models = {name: MODEL_SETS["v4"][name] for name in monitor.models}
+        ensemble = load_ensemble(models)
+        for X in export_features(args.input, monitor.features, args.chunksize):
+            monitor.observe(X, ensemble.score(X))
+    report = monitor.report()
+    if args.json:
+        print(json.dumps(report, indent=1))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
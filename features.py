@@ -0,0 +1,149 @@
+"""Feature schemas shared by the apps, the scoring tools and training.
+
+The app inputs have friendly names ("Cycle Length") while the exported data
+uses the original column names ("LengthofCycle"). ``feature_frame`` turns a
+frame in either schema into the exact columns a model was trained on.
+
+pandas is imported only by the functions that need it, so the apps can read
+the column lists without paying for the import.
+"""
+import numpy as np
+
+# Inputs of the fertility and cycle regularity models used by app_v4.py,
+# in training order
+FEATURE_COLUMNS = [
+    "Cycle Length", "Ovulation Day", "Luteal Phase Length",
+    "Average Cycle Length", "Peak Cycle", "Body Mass Index",
+    "Reproductive Status", "High Fertility Start"
+]
+
+# Inputs of the two models used by app_v3.py
+FERTILITY_V3_COLUMNS = ["Cycle Number", "Cycle Length", "Ovulation Day (Noisy)"]
+IRREGULAR_V3_COLUMNS = ["Cycle Number", "Cycle Length", "Ovulation Day"]
+
+# App feature name -> column in FilteredData.csv / preprocessed_data.csv
+SOURCE_COLUMNS = {
+    "Cycle Number": "CycleNumber",
+    "Cycle Length": "LengthofCycle",
+    "Average Cycle Length": "MeanCycleLength",
+    "Ovulation Day": "EstimatedDayofOvulation",
+    "Luteal Phase Length": "LengthofLutealPhase",
+    "High Fertility Start": "FirstDayofHigh",
+    "Peak Cycle": "CycleWithPeakorNot",
+    "Body Mass Index": "BMI",
+    "Reproductive Status": "ReproductiveCategory",
+}
+
+
+def _column(data, name):
+    if name in data.columns:
+        values = data[name]
+    elif SOURCE_COLUMNS.get(name) in data.columns:
+        values = data[SOURCE_COLUMNS[name]]
+    elif name == "Ovulation Day (Noisy)" and "Ovulation Day" in data.columns:
+        # Scoring real rows, there is no noise to add
+        values = data["Ovulation Day"]
+    elif name == "Ovulation Day (Noisy)" and "EstimatedDayofOvulation" in data.columns:
+        values = data["EstimatedDayofOvulation"]
+    else:
+        raise KeyError(f"No column for feature {name!r}")
+    import pandas as pd
+
+    return pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def feature_frame(data, columns=FEATURE_COLUMNS):
+    """Return ``data`` as a float frame with exactly ``columns``, in order.
+
+    ``data`` may use the app names or the export names; values that are not
+    numbers (the exports pad missing values with a single space) become NaN.
+    """
+    import pandas as pd
+
+    return pd.DataFrame({name: _column(data, name) for name in columns}, index=data.index)
+
+
+# Client-level values are only filled in on a client's first cycle in the
+# exports; later cycles leave them blank
+CLIENT_LEVEL_FEATURES = ["Average Cycle Length", "Body Mass Index"]
+
+
+def fill_client_values(frame, clients, last_seen=None):
+    """Carry client-level features forward to each client's later cycles.
+
+    ``clients`` holds the ClientID of every row of ``frame``. ``last_seen`` is
+    what an earlier chunk of the same file knew about each client (a frame
+    indexed by ClientID); the updated version is returned next to the frame,
+    so the values also carry across chunk boundaries.
+    """
+    columns = [name for name in CLIENT_LEVEL_FEATURES if name in frame.columns]
+    if not columns:
+        return frame, last_seen
+
+    keys = np.asarray(clients)
+    filled = frame[columns].groupby(keys).ffill()
+    if last_seen is not None and len(last_seen):
+        # Rows before a client's first value in this chunk come from earlier chunks
+        filled = filled.fillna(last_seen.reindex(keys).set_axis(frame.index))
+    frame[columns] = filled
+
+    latest = filled.groupby(keys).last()
+    last_seen = latest if last_seen is None else latest.combine_first(last_seen)
+    return frame, last_seen
+
+
+def fill_missing_values(frame, clients, state=None, statistics=None):
+    """Fill the blanks of ``frame`` the way the training data is filled.
+
+    Client-level values are carried forward first (``fill_client_values``).
+    Clients who never reported their mean cycle length get the mean of their
+    own cycle lengths, and a missing BMI becomes the mean of all known ones,
+    as in the notebook. ``state`` holds what earlier chunks of the same file
+    contributed (``None`` for the first chunk); the updated state is returned
+    next to the frame.
+
+    Without ``statistics`` the means are those of the rows seen so far, so
+    one call on a whole file fills exactly what ``pipeline.load_cycles``
+    trains on. Chunks of a file should pass the ``fill_statistics`` of the
+    whole file instead: its means are then applied unchanged, and every
+    chunk size fills the same values.
+    """
+    import pandas as pd
+
+    if state is None:
+        state = {"last_seen": None, "lengths": None, "bmi": (0, 0.0)}
+    keys = np.asarray(clients)
+    frame, last_seen = fill_client_values(frame, keys, state["last_seen"])
+
+    lengths = state["lengths"]
+    if "Average Cycle Length" in frame.columns and "Cycle Length" in frame.columns:
+        length = frame["Cycle Length"]
+        batch = pd.DataFrame({"count": length.notna().groupby(keys).sum(),
+                              "sum": length.groupby(keys).sum()})
+        lengths = batch if lengths is None else batch.add(lengths, fill_value=0)
+        known = lengths if statistics is None else statistics["lengths"]
+        own = known.reindex(keys)
+        own_mean = (own["sum"] / own["count"]).to_numpy()
+        frame["Average Cycle Length"] = frame["Average Cycle Length"].fillna(
+            pd.Series(own_mean, index=frame.index))
+
+    bmi = state["bmi"]
+    if "Body Mass Index" in frame.columns:
+        values = frame["Body Mass Index"].to_numpy()
+        known = ~np.isnan(values)
+        # Summed with the blanks as zeros, like pandas' mean
+        bmi = (bmi[0] + int(known.sum()), bmi[1] + float(np.where(known, values, 0.0).sum()))
+        count, total = bmi if statistics is None else statistics["bmi"]
+        if count:
+            frame["Body Mass Index"] = frame["Body Mass Index"].fillna(total / count)
+
+    return frame, {"last_seen": last_seen, "lengths": lengths, "bmi": bmi}
+
+
+def fill_statistics(chunks):
+    """The ``statistics`` of a whole file for ``fill_missing_values``, from its
+    ``(frame, clients)`` chunks: the first of two passes over the file."""
+    state = None
+    for frame, clients in chunks:
+        _, state = fill_missing_values(frame, clients, state)
+    return state
@@ -0,0 +1,522 @@
+"""Flat, array-backed inference for the trained random forests.
+
+scikit-learn validates its input, converts DataFrames and walks each tree
+object separately on every ``predict`` call. That overhead dominates when we
+score one row of eight features. ``CompiledForest`` copies every tree of a
+fitted forest into a handful of contiguous NumPy arrays and scores all trees
+(and any number of rows) with vectorized array operations.
+
+Results match ``predict`` / ``predict_proba`` of the original forest exactly:
+inputs are rounded to float32 like scikit-learn does, missing values follow
+the same branch, and per-tree probabilities are summed in the same order.
+
+``PackedForest`` is the same forest in as little space as it takes without
+changing a prediction, saved as one file that ``PackedForest.load`` maps
+into memory with a single ``mmap`` (no unpickling), so every process serving
+a model shares one copy of its pages. See the class for what is packed.
+
+The NumPy traversal pays per (row, tree) pair, while scikit-learn's compiled
+tree walk pays mostly per call: from a few hundred rows on the original
+forest is faster (``benchmarks/batch_crossover.py``). An engine with a
+``fallback`` hands batches of ``BATCH_CROSSOVER`` rows or more to it; the
+probabilities are the same either way.
+
+Usage::
+
+    python forest_engine.py fertility --data preprocessed_data.csv
+    python forest_engine.py fertility_v3 --pack fertility_v3.forest
+"""
+import argparse
+import json
+import struct
+import time
+
+import numpy as np
+
+# (row, tree) pairs scored per block, so the index arrays stay cache sized
+_BLOCK_PAIRS = 1 << 16
+
+# Rows per call from which the original forest scores faster than the
+# engine, see benchmarks/batch_crossover.py
+BATCH_CROSSOVER = 400
+
+# Bump when the file written by ``PackedForest.save`` changes meaning
+FORMAT_VERSION = 2
+
+# A packed file is MAGIC, the length of the JSON header (uint32), the header,
+# then every array in _ARRAYS, each starting on an _ALIGN byte boundary
+MAGIC = b"PFOREST\n"
+_ALIGN = 64
+_ARRAYS = ("feature", "threshold", "left", "right", "missing_left", "value", "roots", "classes")
+
+
+class CompiledForest:
+    """All trees of a fitted forest classifier as flat node arrays.
+
+    Node ``i`` sends a row to ``left[i]`` when ``X[feature[i]] <= threshold[i]``
+    (or when the value is missing and ``missing_left[i]`` is set) and to
+    ``right[i]`` otherwise. Leaves point back at themselves. ``value[i]`` holds
+    the class probabilities of leaf ``i`` and ``roots[t]`` is the root node of
+    tree ``t``.
+
+    ``fallback``, when set, is a callable returning the original estimator
+    (or None when it cannot be had); ``predict_proba`` hands it batches of
+    ``BATCH_CROSSOVER`` rows or more.
+    """
+
+    fallback = None
+
+    def __init__(self, feature, threshold, left, right, missing_left, value, roots,
+                 max_depth, classes, feature_names=None, n_features=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes = classes
+        self.feature_names = None if feature_names is None else list(feature_names)
+        if n_features is None:
+            n_features = len(feature_names) if feature_names is not None else int(feature.max()) + 1
+        self.n_features = int(n_features)
+        self.is_leaf = left == np.arange(len(left))
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Compile a fitted ``RandomForestClassifier`` (or a single tree)."""
+        estimators = getattr(model, "estimators_", None)
+        if estimators is None:
+            estimators = [model]
+        if getattr(model, "n_outputs_", 1) != 1:
+            raise ValueError("Only single-output classifiers can be compiled")
+
+        n_nodes = sum(est.tree_.node_count for est in estimators)
+        n_classes = len(model.classes_)
+        # Index arrays use the platform index type, so NumPy does not convert
+        # them on every gather
+        feature = np.zeros(n_nodes, dtype=np.intp)
+        threshold = np.zeros(n_nodes, dtype=np.float64)
+        left = np.zeros(n_nodes, dtype=np.intp)
+        right = np.zeros(n_nodes, dtype=np.intp)
+        missing_left = np.zeros(n_nodes, dtype=bool)
+        value = np.zeros((n_nodes, n_classes), dtype=np.float64)
+        roots = np.zeros(len(estimators), dtype=np.intp)
+
+        offset = 0
+        max_depth = 0
+        for t, est in enumerate(estimators):
+            tree = est.tree_
+            count = tree.node_count
+            nodes = slice(offset, offset + count)
+            own = np.arange(offset, offset + count, dtype=np.intp)
+            is_leaf = tree.children_left == -1
+
+            feature[nodes] = np.where(is_leaf, 0, tree.feature)
+            threshold[nodes] = np.where(is_leaf, 0.0, tree.threshold)
+            left[nodes] = np.where(is_leaf, own, tree.children_left + offset)
+            right[nodes] = np.where(is_leaf, own, tree.children_right + offset)
+            missing_left[nodes] = np.asarray(tree.missing_go_to_left, dtype=bool) & ~is_leaf
+            # tree_.predict returns these rows as they are stored
+            value[nodes] = tree.value[:, 0, :n_classes]
+
+            roots[t] = offset
+            max_depth = max(max_depth, tree.max_depth)
+            offset += count
+
+        return cls(
+            feature, threshold, left, right, missing_left, value, roots, max_depth,
+            classes=np.asarray(model.classes_),
+            feature_names=getattr(model, "feature_names_in_", None),
+            # Not every feature has to appear in a split
+            n_features=getattr(model, "n_features_in_", None),
+        )
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def nbytes(self):
+        return sum(
+            array.nbytes for array in (
+                self.feature, self.threshold, self.left, self.right,
+                self.missing_left, self.value, self.roots,
+            )
+        )
+
+    def _as_array(self, X):
+        if hasattr(X, "columns"):
+            if self.feature_names is not None:
+                X = X[self.feature_names]
+            X = X.to_numpy(dtype=np.float64, na_value=np.nan)
+        # scikit-learn scores float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got {X.shape[1]}")
+        return X
+
+    def _fallback_proba(self, X):
+        estimator = self.fallback()
+        if estimator is None:
+            return None
+        if self.feature_names is not None:
+            import pandas as pd
+
+            # Named columns, as the forest was fitted, so scikit-learn does not warn
+            X = pd.DataFrame(X, columns=self.feature_names, copy=False)
+        return estimator.predict_proba(X)
+
+    def apply(self, X):
+        """Leaf index reached in every tree, shape (n_rows, n_trees)."""
+        return self._apply(self._as_array(X))
+
+    def _apply(self, X):
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        # One entry per (row, tree) pair, row-major
+        nodes = np.tile(self.roots, n_rows)
+        offsets = np.repeat(np.arange(n_rows, dtype=np.int64) * n_features, self.n_trees)
+        check_missing = np.isnan(X).any()
+
+        # Only pairs that have not reached a leaf take another step
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        while active.size:
+            current = nodes[active]
+            x = flat[offsets[active] + self.feature[current]]
+            go_left = x <= self.threshold[current]
+            if check_missing:
+                go_left |= np.isnan(x) & self.missing_left[current]
+            following = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = following
+            active = active[~self.is_leaf[following]]
+        return nodes.reshape(n_rows, self.n_trees)
+
+    def predict_proba(self, X):
+        X = self._as_array(X)
+        if self.fallback is not None and len(X) >= BATCH_CROSSOVER:
+            proba = self._fallback_proba(X)
+            if proba is not None:
+                return proba
+        block = max(1, _BLOCK_PAIRS // self.n_trees)
+        proba = np.empty((X.shape[0], len(self.classes)), dtype=np.float64)
+        for start in range(0, X.shape[0], block):
+            leaves = self._apply(X[start:start + block])
+            # Reducing over the leading (tree) axis adds the trees one at a
+            # time, in order, exactly like scikit-learn accumulates them
+            proba[start:start + block] = np.add.reduce(self.value[leaves.T], axis=0)
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, X):
+        return self.classes.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+
+def _narrowest_uint(largest):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if largest <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def _float32_at_most(threshold):
+    """The largest float32 <= each threshold.
+
+    For a float32 ``x``, ``x <= result`` exactly when ``x <= threshold``, so
+    the rounding never changes which way an input goes.
+    """
+    rounded = np.asarray(threshold, dtype=np.float64).astype(np.float32)
+    above = rounded.astype(np.float64) > threshold
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+class PackedForest(CompiledForest):
+    """A ``CompiledForest`` in the fewest bytes that give the same predictions.
+
+    Nodes ``0 .. n_internal - 1`` are splits. Node ``n_internal + k`` is a
+    leaf with the class probabilities ``value[k]``; leaves with the same
+    probabilities are one node. Splits with the same feature, threshold,
+    missing-value branch and children are stored once, so trees share their
+    common subtrees; a split whose children are the same node is dropped, and
+    so is one whose outcome an ancestor already decided (for every input,
+    missing values included). Thresholds are float32, rounded down (see
+    ``_float32_at_most``), and features and node ids use the narrowest
+    unsigned type that holds them.
+    """
+
+    def __init__(self, feature, threshold, left, right, missing_left, value, roots,
+                 max_depth, classes, feature_names=None, n_features=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes = classes
+        self.feature_names = None if feature_names is None else list(feature_names)
+        self.n_features = int(n_features)
+        self.n_internal = len(feature)
+
+    @classmethod
+    def from_sklearn(cls, model, value_dtype=np.float64):
+        return cls.from_forest(CompiledForest.from_sklearn(model), value_dtype)
+
+    @classmethod
+    def from_forest(cls, forest, value_dtype=np.float64):
+        """Pack a ``CompiledForest``.
+
+        With ``value_dtype=np.float32`` the leaf probabilities are rounded
+        too, which can change predictions; float64 keeps them exact.
+        """
+        is_leaf = forest.is_leaf.tolist()
+        leaves = np.flatnonzero(forest.is_leaf)
+        value, leaf_row = np.unique(np.asarray(forest.value[leaves], dtype=value_dtype),
+                                    axis=0, return_inverse=True)
+        leaf_of = dict(zip(leaves.tolist(), leaf_row.ravel().tolist()))
+        feature = forest.feature.tolist()
+        threshold = _float32_at_most(forest.threshold).tolist()
+        left, right = forest.left.tolist(), forest.right.tolist()
+        missing_left = forest.missing_left.tolist()
+
+        splits = {}  # (feature, threshold, missing_left, left, right) -> split id
+        # Children are packed before their parent; leaves are numbered -1 - row
+        # until the number of splits is known
+        def pack(node, low, high):
+            # low[f] < x[f] <= high[f] for every non-missing input reaching node
+            if is_leaf[node]:
+                return -1 - leaf_of[node]
+            f, t, nan_left = feature[node], threshold[node], missing_left[node]
+            if high[f] <= t and nan_left:
+                return pack(left[node], low, high)
+            if low[f] >= t and not nan_left:
+                return pack(right[node], low, high)
+            packed_left = pack(left[node], low, high[:f] + (min(high[f], t),) + high[f + 1:])
+            packed_right = pack(right[node], low[:f] + (max(low[f], t),) + low[f + 1:], high)
+            if packed_left == packed_right:
+                return packed_left
+            key = (f, t, nan_left, packed_left, packed_right)
+            split = splits.get(key)
+            if split is None:
+                split = splits[key] = len(splits)
+            return split
+
+        unbounded = (float("-inf"),) * forest.n_features, (float("inf"),) * forest.n_features
+        roots = [pack(int(root), *unbounded) for root in forest.roots]
+
+        n_internal = len(splits)
+        largest = n_internal + len(value) - 1
+        node_type = _narrowest_uint(largest)
+        rows = np.array(list(splits), dtype=np.float64).reshape(-1, 5)
+
+        def node_ids(packed):
+            packed = np.asarray(packed, dtype=np.int64)
+            return np.where(packed < 0, n_internal - 1 - packed, packed).astype(node_type)
+
+        return cls(
+            feature=rows[:, 0].astype(_narrowest_uint(max(forest.n_features - 1, 0))),
+            threshold=rows[:, 1].astype(np.float32),
+            left=node_ids(rows[:, 3]),
+            right=node_ids(rows[:, 4]),
+            missing_left=rows[:, 2].astype(bool),
+            value=value,
+            roots=node_ids(roots),
+            max_depth=forest.max_depth,
+            classes=forest.classes,
+            feature_names=forest.feature_names,
+            n_features=forest.n_features,
+        )
+
+    @property
+    def n_nodes(self):
+        return self.n_internal + len(self.value)
+
+    def _apply(self, X):
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        nodes = np.tile(self.roots.astype(np.intp), n_rows)
+        offsets = np.repeat(np.arange(n_rows, dtype=np.int64) * n_features, self.n_trees)
+        check_missing = np.isnan(X).any()
+
+        # Leaves are the ids from n_internal on, so no lookup tells them apart
+        active = np.flatnonzero(nodes < self.n_internal)
+        while active.size:
+            current = nodes[active]
+            x = flat[offsets[active] + self.feature[current]]
+            go_left = x <= self.threshold[current]
+            if check_missing:
+                go_left |= np.isnan(x) & self.missing_left[current]
+            following = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = following
+            active = active[following < self.n_internal]
+        return nodes.reshape(n_rows, self.n_trees)
+
+    def predict_proba(self, X):
+        X = self._as_array(X)
+        if self.fallback is not None and len(X) >= BATCH_CROSSOVER:
+            proba = self._fallback_proba(X)
+            if proba is not None:
+                return proba
+        block = max(1, _BLOCK_PAIRS // self.n_trees)
+        proba = np.empty((X.shape[0], len(self.classes)), dtype=np.float64)
+        for start in range(0, X.shape[0], block):
+            leaves = self._apply(X[start:start + block]) - self.n_internal
+            # Same order of additions as CompiledForest, so the sums are identical
+            proba[start:start + block] = np.add.reduce(self.value[leaves.T], axis=0,
+                                                       dtype=np.float64)
+        proba /= self.n_trees
+        return proba
+
+    def save(self, path):
+        arrays = {name: np.ascontiguousarray(getattr(self, name)) for name in _ARRAYS}
+        if arrays["classes"].dtype.hasobject:
+            raise ValueError("Only numeric classes can be saved")
+        layout, offset = {}, 0
+        for name, array in arrays.items():
+            offset = _aligned(offset)
+            layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset += array.nbytes
+        header = json.dumps({
+            "format": FORMAT_VERSION, "max_depth": self.max_depth, "n_features": self.n_features,
+            "feature_names": self.feature_names, "arrays": layout,
+        }).encode()
+        start = _aligned(len(MAGIC) + 4 + len(header))
+        with open(path, "wb") as file:
+            file.write(MAGIC + struct.pack("<I", len(header)) + header)
+            for name, array in arrays.items():
+                file.write(b"\0" * (start + layout[name]["offset"] - file.tell()))
+                file.write(array.tobytes())
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Read a forest written by ``save``, as views of one memory map (or one read)."""
+        if mmap_mode is None:
+            buffer = np.fromfile(path, dtype=np.uint8)
+        else:
+            # Plain ndarray views of the map: indexing a np.memmap is much slower
+            buffer = np.asarray(np.memmap(path, dtype=np.uint8, mode=mmap_mode))
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a packed forest")
+        length, = struct.unpack("<I", bytes(buffer[len(MAGIC):len(MAGIC) + 4]))
+        header = json.loads(bytes(buffer[len(MAGIC) + 4:len(MAGIC) + 4 + length]))
+        if header.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{path} has packed forest format {header.get('format')}, "
+                             f"expected {FORMAT_VERSION}")
+        start = _aligned(len(MAGIC) + 4 + length)
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            begin = start + spec["offset"]
+            size = int(np.prod(spec["shape"])) * dtype.itemsize
+            arrays[name] = buffer[begin:begin + size].view(dtype).reshape(spec["shape"])
+        return cls(**arrays, max_depth=header["max_depth"],
+                   feature_names=header["feature_names"], n_features=header["n_features"])
+
+
+def compare_with_sklearn(model, compiled, X):
+    """Number of differing predictions and largest probability difference."""
+    expected = model.predict_proba(X)
+    actual = compiled.predict_proba(X)
+    mismatches = int((model.predict(X) != compiled.predict(X)).sum())
+    return mismatches, float(np.abs(expected - actual).max())
+
+
+def _time_per_call(func, X, repeat):
+    func(X)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(X)
+    return (time.perf_counter() - start) / repeat
+
+
+def _pack_report(model, compiled, X, y, args):
+    import os
+    import pickle
+
+    value_dtype = np.float32 if args.float32_values else np.float64
+    packed = PackedForest.from_forest(compiled, value_dtype)
+    path = args.pack or os.devnull
+    packed.save(path)
+    if args.pack:
+        packed = PackedForest.load(path)
+        print(f"packed file: {os.path.getsize(path) / 1024:.0f} KiB -> {path}")
+    print(f"nodes: {len(compiled.feature)} -> {packed.n_internal} splits + {len(packed.value)} leaves; "
+          f"pickle {len(pickle.dumps(model)) / 1024:.0f} KiB, compiled {compiled.nbytes / 1024:.0f} KiB, "
+          f"packed {packed.nbytes / 1024:.0f} KiB")
+    mismatches, max_diff = compare_with_sklearn(model, packed, X)
+    print(f"packed: {mismatches} differing predictions, max |proba diff| {max_diff:.3g}")
+    if y is not None:
+        known = ~np.isnan(y)
+        original = float((model.predict(X[known]) == y[known]).mean())
+        accuracy = float((packed.predict(X[known]) == y[known]).mean())
+        print(f"accuracy on {int(known.sum())} labelled rows: original {original:.4f}, "
+              f"packed {accuracy:.4f} (delta {accuracy - original:+.4f})")
+
+
+def _labels(name, table):
+    """The training target of registry model ``name`` in ``table``, if it has one."""
+    from pipeline import MODELS
+
+    target = MODELS.get(name, {}).get("target")
+    if target == "Regular" and "Regular" not in table and "Irregular" in table:
+        # preprocessed_data.csv keeps the irregularity label only
+        return 1 - table["Irregular"].to_numpy(dtype=np.float64, na_value=np.nan)
+    if target not in table:
+        return None
+    return table[target].to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time a compiled forest")
+    parser.add_argument("model", help="Registry name, or a model file (.joblib or .pkl)")
+    parser.add_argument("--data", default="preprocessed_data.csv", help="CSV to score")
+    parser.add_argument("--repeat", type=int, default=200, help="Calls per timing")
+    parser.add_argument("--pack", metavar="OUTPUT", help="Also write the packed forest here "
+                        "and report its size and accuracy against the original")
+    parser.add_argument("--float32-values", action="store_true",
+                        help="Store packed leaf probabilities as float32 (may change predictions)")
+    args = parser.parse_args()
+
+    from data_store import load_table
+    from features import feature_frame
+    import os
+
+    import model_loader
+    import registry
+
+    if os.path.isfile(args.model):
+        model = model_loader.load_model(args.model)
+    else:
+        model = registry.load_model(args.model)
+    compiled = CompiledForest.from_sklearn(model)
+    table = load_table(args.data)
+    X = feature_frame(table, list(model.feature_names_in_))
+
+    mismatches, max_diff = compare_with_sklearn(model, compiled, X)
+    print(f"{len(X)} rows: {mismatches} differing predictions, max |proba diff| {max_diff:.3g}")
+
+    row = X.iloc[:1]
+    row_array = row.to_numpy()
+    print(f"single row: sklearn {_time_per_call(model.predict, row, args.repeat) * 1e6:.0f} us, "
+          f"compiled {_time_per_call(compiled.predict, row_array, args.repeat) * 1e6:.0f} us")
+    array = X.to_numpy()
+    repeat = max(1, args.repeat // 20)
+    print(f"{len(X)} rows: sklearn {_time_per_call(model.predict, X, repeat) * 1e3:.2f} ms, "
+          f"compiled {_time_per_call(compiled.predict, array, repeat) * 1e3:.2f} ms")
+    print(f"compiled arrays: {compiled.nbytes / 1024:.0f} KiB")
+    if args.pack or args.float32_values:
+        y = None if os.path.isfile(args.model) else _labels(args.model, table)
+        _pack_report(model, compiled, X, y, args)
+
+
+if __name__ == "__main__":
+    main()
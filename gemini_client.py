@@ -0,0 +1,216 @@
+"""Shared, cached and streaming access to Gemini for the apps.
+
+One ``GeminiClient`` per process (see ``get_client``) owns the API
+configuration and the model objects, so they are not rebuilt on every rerun.
+Questions run on a small thread pool and their answers stream back chunk by
+chunk. Finished answers are kept in a TTL + LRU cache keyed by the
+normalized question and model, and a question that is already being answered
+joins the request in flight instead of sending a second one.
+
+Because the request runs on the pool, a Streamlit rerun that interrupts the
+stream does not cancel it: the answer lands in the cache and the next rerun
+shows it immediately.
+
+Set ``GEMINI_BACKEND=fake`` to answer locally without network access (for
+tests and CI).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MODEL = "gemini-1.5-flash"
+
+
+def normalize_question(question):
+    """Questions that differ only in case or spacing share a cache entry."""
+    return " ".join(question.split()).casefold()
+
+
+class GeminiBackend:
+    """Sends prompts to the Gemini API through google.generativeai."""
+
+    def __init__(self, api_key=None):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key or os.environ["GEMINI_API_KEY"])
+        self._genai = genai
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model(self, name):
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                model = self._models[name] = self._genai.GenerativeModel(name)
+            return model
+
+    def stream(self, model, prompt):
+        for chunk in self._model(model).generate_content(prompt, stream=True):
+            yield chunk.text
+
+
+class FakeBackend:
+    """Answers every prompt locally, word by word, without network access."""
+
+    def __init__(self, answer=None, delay=0.0):
+        self.answer = answer
+        self.delay = delay
+        self.calls = 0
+
+    def stream(self, model, prompt):
+        self.calls += 1
+        answer = self.answer or f"Here's advice based on your question '{prompt}' - Stay consistent with cycle tracking."
+        for word in answer.split(" "):
+            if self.delay:
+                time.sleep(self.delay)
+            yield word + " "
+
+
+class Answer:
+    """An answer that may still be arriving; several readers can stream it."""
+
+    def __init__(self):
+        self._chunks = []
+        self._done = False
+        self._error = None
+        self._condition = threading.Condition()
+
+    @classmethod
+    def completed(cls, text):
+        answer = cls()
+        answer._chunks.append(text)
+        answer._done = True
+        return answer
+
+    @property
+    def done(self):
+        return self._done
+
+    def _append(self, chunk):
+        with self._condition:
+            self._chunks.append(chunk)
+            self._condition.notify_all()
+
+    def _finish(self, error=None):
+        with self._condition:
+            self._done = True
+            self._error = error
+            self._condition.notify_all()
+
+    def stream(self, timeout=None):
+        """Yield the answer's chunks as they arrive, from the beginning."""
+        position = 0
+        while True:
+            with self._condition:
+                while position >= len(self._chunks) and not self._done:
+                    if not self._condition.wait(timeout):
+                        raise TimeoutError("No answer from Gemini in time")
+                chunks = self._chunks[position:]
+                finished = self._done and position + len(chunks) == len(self._chunks)
+                error = self._error
+            yield from chunks
+            position += len(chunks)
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+    def result(self, timeout=None):
+        return "".join(self.stream(timeout))
+
+
+class AnswerCache:
+    """At most ``maxsize`` answers, each kept for ``ttl`` seconds."""
+
+    def __init__(self, maxsize=256, ttl=3600.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (expires at, text)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, text = entry
+        if expires <= self.clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return text
+
+    def put(self, key, text):
+        self._entries[key] = (self.clock() + self.ttl, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class GeminiClient:
+    def __init__(self, backend, max_workers=4, cache_size=256, ttl=3600.0):
+        self.backend = backend
+        self.cache = AnswerCache(cache_size, ttl)
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="gemini")
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "cache_hits": 0, "joined_in_flight": 0, "errors": 0}
+
+    def ask(self, question, model=DEFAULT_MODEL):
+        """Start answering ``question`` (or reuse an answer) and return an ``Answer``."""
+        key = (normalize_question(question), model)
+        with self._lock:
+            text = self.cache.get(key)
+            if text is not None:
+                self.stats["cache_hits"] += 1
+                return Answer.completed(text)
+            answer = self._in_flight.get(key)
+            if answer is not None:
+                self.stats["joined_in_flight"] += 1
+                return answer
+            answer = self._in_flight[key] = Answer()
+            self.stats["requests"] += 1
+
+        self._pool.submit(self._run, key, question.strip(), model, answer)
+        return answer
+
+    def _run(self, key, prompt, model, answer):
+        chunks = []
+        try:
+            for chunk in self.backend.stream(model, prompt):
+                chunks.append(chunk)
+                answer._append(chunk)
+        except Exception as e:
+            with self._lock:
+                self.stats["errors"] += 1
+                del self._in_flight[key]
+            answer._finish(e)
+            return
+
+        with self._lock:
+            # Failed answers are not cached, so the next rerun retries them
+            self.cache.put(key, "".join(chunks))
+            del self._in_flight[key]
+        answer._finish()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide client, created on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if os.environ.get("GEMINI_BACKEND") == "fake":
+                    backend = FakeBackend()
+                else:
+                    backend = GeminiBackend()
+                _client = GeminiClient(backend)
+    return _client
@@ -0,0 +1,328 @@
+"""Per-client cycle histories, with running statistics and forecasts.
+
+``CycleHistory`` keeps, for every ClientID, the count, mean and variance of
+the cycle length, ovulation day and luteal phase length (Welford's running
+update), and the last ``window`` cycles in a small ring. Adding a cycle
+updates one client in O(1); nothing ever rescans a client's past cycles.
+Bulk loads go through ``update``, which folds a whole chunk of cycles in at
+once (the chunk's own statistics merged with Chan's formula), so a large
+export is indexed in a single streaming pass.
+
+``forecast`` predicts the next period and the ovulation window of every
+client at once from these statistics, with array operations only:
+
+    history = CycleHistory.from_data("FilteredData.csv")
+    history.append("nfp8122", [28, 15, 12])
+    forecast = history.forecast()     # one array per field, one row per client
+
+Cycles must be added in cycle order per client (the exports are). Cycles
+without a ClientID are skipped.
+
+Usage::
+
+    python history.py --data FilteredData.csv --client nfp8122
+    python history.py --output forecasts.csv
+"""
+import argparse
+import os
+import threading
+
+import numpy as np
+
+from cycle_analytics import fertile_window
+
+FORMAT_VERSION = 1
+
+# Statistic name -> column of FilteredData.csv
+METRICS = {
+    "length": "LengthofCycle",
+    "ovulation": "EstimatedDayofOvulation",
+    "luteal": "LengthofLutealPhase",
+}
+
+# Cycles in the recent window
+WINDOW = 6
+
+
+# The per-client arrays, all indexed by the client's row
+_ARRAYS = ("count", "mean", "m2", "recent", "cycles")
+
+
+def _is_blank(client):
+    """True for a missing ClientID: None, NaN, pd.NA or blank text."""
+    if isinstance(client, str):
+        return not client.strip()
+    try:
+        return client is None or bool(client != client)
+    except TypeError:
+        # pd.NA compares as NA, which has no truth value
+        return True
+
+
+def _statistics(clients, count, mean, m2, recent, cycles):
+    stats = {"client": np.array(clients, dtype=object), "cycles": cycles.copy()}
+    variance = np.divide(m2, count - 1, out=np.full(m2.shape, np.nan), where=count > 1)
+    recent_count = (~np.isnan(recent)).sum(axis=1)
+    recent_mean = np.divide(np.nansum(recent, axis=1), recent_count,
+                            out=np.full(mean.shape, np.nan), where=recent_count > 0)
+    for j, name in enumerate(METRICS):
+        stats[f"{name}_count"] = count[:, j].copy()
+        stats[f"{name}_mean"] = np.where(count[:, j] > 0, mean[:, j], np.nan)
+        stats[f"{name}_std"] = np.sqrt(variance[:, j])
+        stats[f"{name}_recent_mean"] = recent_mean[:, j]
+    return stats
+
+
+def _forecast(stats, last_start=None):
+    """Days are counted from the first day of the client's latest period (day 1).
+
+    The next cycle is expected to last the mean of the recent window;
+    ovulation falls one mean luteal phase before its end, the luteal phase
+    being the most stable part of the cycle, or on the mean ovulation day
+    when no luteal phase was recorded.
+    """
+    length = np.where(np.isnan(stats["length_recent_mean"]),
+                      stats["length_mean"], stats["length_recent_mean"])
+    ovulation = np.round(np.where(np.isnan(stats["luteal_mean"]),
+                                  stats["ovulation_mean"], length - stats["luteal_mean"]))
+    fertile_start, fertile_end = fertile_window(ovulation)
+    forecast = {
+        "client": stats["client"],
+        "cycles": stats["cycles"],
+        "next_period_day": np.round(length) + 1,
+        "length_std": stats["length_std"],
+        "ovulation_day": ovulation,
+        "fertile_start": fertile_start,
+        "fertile_end": fertile_end,
+    }
+    if last_start is not None:
+        start = np.asarray(last_start, dtype="datetime64[D]")
+        for name in ("next_period_day", "ovulation_day", "fertile_start", "fertile_end"):
+            # Unknown days (NaN) become NaT
+            date = name[:-4] if name.endswith("_day") else name
+            forecast[f"{date}_date"] = start + (forecast[name] - 1).astype("timedelta64[D]")
+    return forecast
+
+
+class CycleHistory:
+    def __init__(self, window=WINDOW, capacity=1024):
+        self.window = window
+        self._slots = {}  # ClientID -> row of the arrays below
+        self._clients = []
+        self._lock = threading.Lock()
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        n_metrics = len(METRICS)
+        old = getattr(self, "count", None)
+        # One row per client, see _ARRAYS
+        arrays = {
+            "count": np.zeros((capacity, n_metrics), dtype=np.int64),
+            "mean": np.zeros((capacity, n_metrics)),
+            "m2": np.zeros((capacity, n_metrics)),
+            "recent": np.full((capacity, self.window, n_metrics), np.nan),
+            "cycles": np.zeros(capacity, dtype=np.int64),
+        }
+        if old is not None:
+            for name, array in arrays.items():
+                array[:len(self._clients)] = getattr(self, name)[:len(self._clients)]
+        for name, array in arrays.items():
+            setattr(self, name, array)
+
+    def _slot(self, client):
+        row = self._slots.get(client)
+        if row is None:
+            row = len(self._clients)
+            if row == len(self.cycles):
+                # Doubling keeps adding clients amortized O(1)
+                self._allocate(2 * len(self.cycles))
+            self._slots[client] = row
+            self._clients.append(client)
+        return row
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __contains__(self, client):
+        return client in self._slots
+
+    @property
+    def clients(self):
+        return np.array(self._clients, dtype=object)
+
+    def append(self, client, values):
+        """Add one cycle: ``values`` in ``METRICS`` order, NaN where unknown.
+
+        A cycle without a ClientID belongs to no one and is skipped.
+        """
+        if _is_blank(client):
+            return
+        values = np.asarray(values, dtype=np.float64)
+        known = ~np.isnan(values)
+        with self._lock:
+            row = self._slot(client)
+            count = self.count[row] + known
+            delta = np.where(known, values - self.mean[row], 0.0)
+            mean = self.mean[row] + np.divide(delta, count, out=np.zeros_like(delta), where=known)
+            self.m2[row] += np.where(known, delta * (values - mean), 0.0)
+            self.mean[row], self.count[row] = mean, count
+            self.recent[row, self.cycles[row] % self.window] = values
+            self.cycles[row] += 1
+
+    def update(self, clients, values):
+        """Add many cycles at once, as if each row were passed to ``append`` in order."""
+        clients = np.asarray(clients, dtype=object)
+        values = np.asarray(values, dtype=np.float64).reshape(len(clients), len(METRICS))
+        # Like append, skip cycles without a ClientID (np.unique cannot sort them in)
+        known = np.array([not _is_blank(client) for client in clients], dtype=bool)
+        if not known.all():
+            clients, values = clients[known], values[known]
+        if not len(values):
+            return
+        unique, inverse = np.unique(clients, return_inverse=True)
+        with self._lock:
+            rows = np.array([self._slot(client) for client in unique], dtype=np.int64)
+
+            # Statistics of this batch per client...
+            known = ~np.isnan(values)
+            filled = np.where(known, values, 0.0)
+            n_b = np.stack([np.bincount(inverse, known[:, j], len(unique))
+                            for j in range(len(METRICS))], axis=1)
+            sums = np.stack([np.bincount(inverse, filled[:, j], len(unique))
+                             for j in range(len(METRICS))], axis=1)
+            mean_b = np.divide(sums, n_b, out=np.zeros_like(sums), where=n_b > 0)
+            deviation = np.where(known, values - mean_b[inverse], 0.0)
+            m2_b = np.stack([np.bincount(inverse, deviation[:, j] ** 2, len(unique))
+                             for j in range(len(METRICS))], axis=1)
+
+            # ...merged into the running ones (Chan et al.)
+            n_a, mean_a = self.count[rows], self.mean[rows]
+            n = n_a + n_b
+            delta = mean_b - mean_a
+            share = np.divide(n_b, n, out=np.zeros_like(mean_b), where=n > 0)
+            self.mean[rows] = mean_a + delta * share
+            self.m2[rows] += m2_b + delta ** 2 * n_a * share
+            self.count[rows] = n
+
+            # The last ``window`` cycles of each client go into its ring
+            order = np.argsort(inverse, kind="stable")
+            per_client = np.bincount(inverse, minlength=len(unique))
+            starts = np.cumsum(per_client) - per_client
+            nth = np.empty(len(values), dtype=np.int64)
+            nth[order] = np.arange(len(values)) - np.repeat(starts, per_client)
+            keep = nth >= per_client[inverse] - self.window
+            target = rows[inverse[keep]]
+            self.recent[target, (self.cycles[target] + nth[keep]) % self.window] = values[keep]
+            self.cycles[rows] += per_client
+
+    def statistics(self):
+        """Per-client statistics, one array per field in ``clients`` order."""
+        with self._lock:
+            return _statistics(self.clients, *(getattr(self, name)[:len(self._clients)]
+                                               for name in _ARRAYS))
+
+    def client_statistics(self, client):
+        """``statistics`` of one client, as scalars."""
+        with self._lock:
+            row = self._slots[client]
+            stats = _statistics([client], *(getattr(self, name)[row:row + 1] for name in _ARRAYS))
+        return {name: values[0] for name, values in stats.items()}
+
+    def forecast(self, last_start=None):
+        """Next period and ovulation window of every client (see ``_forecast``).
+
+        ``last_start`` (a ``datetime64`` per client, or one for all) adds
+        calendar dates.
+        """
+        return _forecast(self.statistics(), last_start)
+
+    def client_forecast(self, client, last_start=None):
+        """``forecast`` of one client, as scalars."""
+        with self._lock:
+            row = self._slots[client]
+            stats = _statistics([client], *(getattr(self, name)[row:row + 1] for name in _ARRAYS))
+        return {name: values[0] for name, values in _forecast(stats, last_start).items()}
+
+    def save(self, path):
+        n = len(self._clients)
+        with self._lock:
+            arrays = {name: getattr(self, name)[:n] for name in _ARRAYS}
+            np.savez(path, format=FORMAT_VERSION, window=self.window,
+                     clients=np.array(self._clients, dtype=str), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data["format"]) != FORMAT_VERSION:
+                raise ValueError(f"{path} has format {int(data['format'])}, expected {FORMAT_VERSION}")
+            clients = [str(client) for client in data["clients"]]
+            history = cls(int(data["window"]), capacity=max(len(clients), 1))
+            history._clients = clients
+            history._slots = {client: row for row, client in enumerate(clients)}
+            for name in _ARRAYS:
+                getattr(history, name)[:len(clients)] = data[name]
+        return history
+
+    @classmethod
+    def from_data(cls, path, window=WINDOW, chunksize=100_000):
+        """Index a CSV export (read through its typed store, see data_store.py) in one pass."""
+        from data_store import iter_chunks, load_table, store_path
+
+        if not os.path.isdir(path):
+            # Builds the store when it is missing or older than the CSV
+            load_table(path, ["ClientID"])
+            path = store_path(path)
+        history = cls(window)
+        for chunk in iter_chunks(path, ["ClientID"] + list(METRICS.values()), chunksize):
+            values = np.column_stack([
+                chunk[column].to_numpy(dtype=np.float64, na_value=np.nan)
+                for column in METRICS.values()
+            ])
+            history.update(chunk["ClientID"].to_numpy(dtype=object), values)
+        return history
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_history(path="FilteredData.csv"):
+    """The history of ``path``, built on first use and shared by the process."""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = CycleHistory.from_data(path)
+    return _default
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-client cycle statistics and forecasts")
+    parser.add_argument("--data", default="FilteredData.csv")
+    parser.add_argument("--client", action="append", help="Only show these clients")
+    parser.add_argument("--window", type=int, default=WINDOW, help="Cycles in the recent window")
+    parser.add_argument("--output", help="Write the forecasts of every client to this CSV")
+    args = parser.parse_args()
+
+    history = CycleHistory.from_data(args.data, args.window)
+    forecast = history.forecast()
+    if args.output:
+        import pandas as pd
+
+        pd.DataFrame(forecast).to_csv(args.output, index=False)
+        print(f"{len(history)} clients -> {args.output}")
+        return
+
+    rows = range(len(history))
+    if args.client:
+        wanted = set(args.client)
+        rows = [i for i, client in enumerate(forecast["client"]) if client in wanted]
+    for i in rows:
+        print(f"{forecast['client'][i]:<10} {forecast['cycles'][i]:>3} cycles  "
+              f"next period day {forecast['next_period_day'][i]:>4.0f} "
+              f"(sd {forecast['length_std'][i]:.1f})  ovulation day {forecast['ovulation_day'][i]:>4.0f}  "
+              f"fertile days {forecast['fertile_start'][i]:.0f}-{forecast['fertile_end'][i]:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Opt-in timing of the stages of a Streamlit rerun.
+
+Off by default. Turn it on with ``APP_PROFILE=1`` or by opening the app with
+``?profile=1``; each rerun then records
+
+    stages      wall time and allocated memory blocks of every named stage
+                (input parsing, feature rows, the predictions of all models,
+                each chart, the Gemini call)
+    counters    what the watched caches did during the rerun (hits, misses)
+
+appends it as one JSON line to ``APP_PROFILE_LOG`` (``.profiles/reruns.jsonl``)
+and shows it in a debug panel at the end of the page. ``?profile=cprofile`` or
+``?profile=tracemalloc`` also dumps a cProfile or tracemalloc snapshot of one
+rerun to ``.profiles/`` and then falls back to ``?profile=1``. Both profilers
+are process-wide, so only one session profiles at a time; a rerun that asks
+while another one is profiling is only timed, and the next rerun tries again.
+
+    run = start_rerun("app_v4")
+    with run.stage("predict"):
+        ...
+    run.finish()
+
+When it is off, ``start_rerun`` returns a shared object whose methods do
+nothing, so the stages cost one method call and an empty ``with`` each.
+"""
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import weakref
+
+PROFILE_DIR = ".profiles"
+MODES = ("1", "cprofile", "tracemalloc")
+
+# Held by the rerun that has cProfile or tracemalloc running
+_profiler_lock = threading.Lock()
+
+
+class _Disabled:
+    enabled = False
+    _stage = contextlib.nullcontext()
+
+    def stage(self, name):
+        return self._stage
+
+    def count(self, name, value=1):
+        pass
+
+    def watch(self, name, stats, keys=None):
+        pass
+
+    def finish(self):
+        pass
+
+
+DISABLED = _Disabled()
+
+
+class Rerun:
+    enabled = True
+
+    def __init__(self, app, mode="1", log_path=None):
+        self.app = app
+        self.mode = mode
+        self.log_path = log_path or os.environ.get("APP_PROFILE_LOG",
+                                                   os.path.join(PROFILE_DIR, "reruns.jsonl"))
+        self.stages = []
+        self.counters = {}
+        self._watched = {}
+        self._profiler = None
+        self.dump_path = None
+        self.top = None  # the biggest entries of the dump, for the panel
+        self.note = None
+        if mode != "1" and not _profiler_lock.acquire(blocking=False):
+            self.mode = "1"
+            self.note = "Another session is profiling; this rerun was only timed"
+        elif mode == "cprofile":
+            import cProfile
+
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif mode == "tracemalloc":
+            import tracemalloc
+
+            tracemalloc.start()
+        if self.mode != "1":
+            # Also stops profiling if the script fails before ``finish``
+            self._stop = weakref.finalize(self, _stop_profiling, self._profiler)
+        self._start = time.perf_counter()
+        self._blocks = sys.getallocatedblocks()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append({
+                "stage": name,
+                "ms": (time.perf_counter() - start) * 1000,
+                "blocks": sys.getallocatedblocks() - blocks,
+            })
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def watch(self, name, stats, keys=("hits", "misses")):
+        """Report how ``keys`` of ``stats()`` changed during the rerun."""
+        self._watched[name] = (stats, keys, stats())
+
+    def _dump(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        if self._profiler is not None:
+            self._stop()
+            self.dump_path = os.path.join(PROFILE_DIR, f"{self.app}-{stamp}.prof")
+            self._profiler.dump_stats(self.dump_path)
+            self.top = _top_functions(self._profiler)
+        elif self.mode == "tracemalloc":
+            import tracemalloc
+
+            snapshot = tracemalloc.take_snapshot()
+            self._stop()
+            self.dump_path = os.path.join(PROFILE_DIR, f"{self.app}-{stamp}.tracemalloc")
+            snapshot.dump(self.dump_path)
+            self.top = [f"{stat.size / 1024:.1f} KiB  {stat.traceback}"
+                        for stat in snapshot.statistics("lineno")[:10]]
+
+    def record(self):
+        counters = dict(self.counters)
+        for name, (stats, keys, before) in self._watched.items():
+            after = stats()
+            for key in keys:
+                counters[f"{name}.{key}"] = after[key] - before[key]
+        return {
+            "app": self.app,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "total_ms": (time.perf_counter() - self._start) * 1000,
+            "blocks": sys.getallocatedblocks() - self._blocks,
+            "stages": self.stages,
+            "counters": counters,
+            "dump": self.dump_path,
+            "note": self.note,
+        }
+
+    def finish(self):
+        """Log the rerun and show the debug panel; call it last in the script."""
+        if self.mode != "1":
+            self._dump()
+        record = self.record()
+        os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+        with open(self.log_path, "a") as file:
+            file.write(json.dumps(record) + "\n")
+        _panel(record, self.top)
+        if self.mode != "1":
+            # Only one rerun is dumped
+            _set_query_mode("1")
+
+
+def _stop_profiling(profiler):
+    if profiler is not None:
+        profiler.disable()
+    else:
+        import tracemalloc
+
+        tracemalloc.stop()
+    _profiler_lock.release()
+
+
+def _top_functions(profiler, limit=10):
+    import pstats
+
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:limit]
+    return [f"{cumulative * 1000:9.1f} ms  {calls:>6} calls  {file}:{line}({function})"
+            for (file, line, function), (_, calls, _, cumulative, _) in rows]
+
+
+def _panel(record, top=None):
+    import streamlit as st
+
+    with st.expander(f"Debug: rerun took {record['total_ms']:.1f} ms"):
+        lines = ["| Stage | ms | Blocks |", "| --- | ---: | ---: |"]
+        lines += [f"| {stage['stage']} | {stage['ms']:.2f} | {stage['blocks']} |"
+                  for stage in record["stages"]]
+        st.markdown("\n".join(lines))
+        if record["counters"]:
+            st.markdown("\n".join(f"- {name}: {value}"
+                                  for name, value in sorted(record["counters"].items())))
+        if record["note"]:
+            st.write(record["note"])
+        if record["dump"]:
+            st.write(f"Profile written to {record['dump']}")
+            st.code("\n".join(top or []))
+
+
+def _query_mode():
+    try:
+        import streamlit as st
+
+        return st.query_params.get("profile")
+    except Exception:  # no script run context, for example in a plain import
+        return None
+
+
+def _set_query_mode(mode):
+    import streamlit as st
+
+    st.query_params["profile"] = mode
+
+
+def start_rerun(app):
+    """A ``Rerun`` when profiling is on for this rerun, otherwise ``DISABLED``."""
+    mode = _query_mode() or os.environ.get("APP_PROFILE")
+    if mode not in MODES:
+        return DISABLED
+    return Rerun(app, mode)
@@ -0,0 +1,118 @@
+"""Load test for prediction_server.py.
+
+Sends prediction requests from many threads for a fixed time and reports the
+client-side latency and throughput next to the server's own /metrics.
+
+Usage::
+
+    python load_test.py --start-server --concurrency 32 --duration 10
+    python load_test.py --url http://127.0.0.1:8000 --concurrency 32
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from features import FEATURE_COLUMNS
+
+
+def random_instances(n, seed=0):
+    """Inputs spread over the ranges the app allows."""
+    rng = np.random.default_rng(seed)
+    values = {
+        "Cycle Length": rng.integers(20, 41, n),
+        "Ovulation Day": rng.integers(1, 32, n),
+        "Luteal Phase Length": rng.integers(1, 19, n),
+        "Average Cycle Length": rng.integers(20, 41, n),
+        "Peak Cycle": rng.integers(0, 2, n),
+        "Body Mass Index": np.round(rng.uniform(10.0, 50.0, n), 1),
+        "Reproductive Status": rng.integers(0, 2, n),
+        "High Fertility Start": rng.integers(1, 32, n),
+    }
+    return [{name: values[name][i].item() for name in FEATURE_COLUMNS} for i in range(n)]
+
+
+def _post(url, payload):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.load(response)
+
+
+def run(url, concurrency, duration, seed=0):
+    instances = random_instances(1000, seed)
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    stop_at = time.monotonic() + duration
+
+    def worker(index):
+        i = index
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            try:
+                _post(f"{url}/predict", instances[i % len(instances)])
+            except (urllib.error.URLError, OSError):
+                errors[index] += 1
+                continue
+            latencies[index].append(time.perf_counter() - start)
+            i += concurrency
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    all_latencies = np.concatenate([np.array(l) for l in latencies]) if any(latencies) else np.array([])
+    report = {"requests": len(all_latencies), "errors": sum(errors),
+              "throughput_rps": len(all_latencies) / elapsed}
+    if len(all_latencies):
+        p50, p99 = np.percentile(all_latencies, [50, 99]) * 1000
+        report.update(latency_p50_ms=p50, latency_p99_ms=p99)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the prediction service")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=16, help="Client threads")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run")
+    parser.add_argument("--start-server", action="store_true",
+                        help="Start a server on a free local port for the test")
+    parser.add_argument("--registry", default="models", help="Model registry for --start-server")
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    url = args.url
+    server = None
+    if args.start_server:
+        from prediction_server import make_server
+
+        server = make_server("127.0.0.1", 0, args.registry, args.max_batch,
+                             args.max_wait_ms / 1000)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}"
+
+    try:
+        client = run(url, args.concurrency, args.duration)
+        with urllib.request.urlopen(f"{url}/metrics", timeout=30) as response:
+            server_stats = json.load(response)["latency"]
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    print("client:", json.dumps(client, indent=2))
+    print("server:", json.dumps(server_stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""Load the trained models once per process and share them.
+
+Streamlit re-runs the whole app script on every widget change, but modules
+imported by the script stay in ``sys.modules``. Anything cached here is
+therefore loaded once per server process and shared by every session and
+rerun, instead of being unpickled again on each keystroke.
+
+A cached model is reloaded only when its file changes on disk (modification
+time or size). Models are shared between sessions, so callers must treat them
+as read-only: predicting is fine, refitting or changing parameters is not.
+"""
+import hashlib
+import os
+import pickle
+import threading
+import time
+import warnings
+import weakref
+
+
+class ModelLoadError(Exception):
+    """Raised when a model file cannot be loaded or fails validation."""
+
+
+class LoadedModel:
+    """A model together with what we know about loading it."""
+
+    def __init__(self, path, model, mtime_ns, size, load_seconds, memory_bytes,
+                 rss_delta_bytes, load_warnings):
+        self.path = path
+        self.model = model
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.load_seconds = load_seconds
+        self.memory_bytes = memory_bytes
+        self.rss_delta_bytes = rss_delta_bytes
+        self.load_warnings = load_warnings
+        self.loaded_at = time.time()
+        self.compiled = None
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "file_bytes": self.size,
+            "load_seconds": self.load_seconds,
+            "memory_bytes": self.memory_bytes,
+            "compiled_bytes": None if self.compiled is None else self.compiled.nbytes,
+            "rss_delta_bytes": self.rss_delta_bytes,
+            "n_features": getattr(self.model, "n_features_in_", None),
+            "n_estimators": len(getattr(self.model, "estimators_", [])),
+            "warnings": list(self.load_warnings),
+            "loaded_at": self.loaded_at,
+        }
+
+
+_lock = threading.Lock()
+_models = {}  # absolute path -> LoadedModel
+
+
+def _rss():
+    try:
+        import psutil
+    except ImportError:  # psutil is optional, it only improves the memory numbers
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def _read_artifact(path):
+    # The .pkl files were written with plain pickle, everything else with joblib
+    if path.endswith(".pkl"):
+        with open(path, "rb") as file:
+            return pickle.load(file)
+    # joblib is only imported when a model file is actually read
+    from joblib import load
+
+    return load(path)
+
+
+def model_memory_bytes(model):
+    """Bytes held by the tree arrays of a fitted forest or tree."""
+    from sklearn.tree._tree import NODE_DTYPE
+
+    trees = getattr(model, "estimators_", None)
+    if trees is None:
+        trees = [model]
+    total = 0
+    for tree in trees:
+        tree_ = getattr(tree, "tree_", None)
+        if tree_ is None:
+            continue
+        total += tree_.node_count * NODE_DTYPE.itemsize + tree_.value.nbytes
+    return total
+
+
+_fingerprints = weakref.WeakKeyDictionary()
+
+
+def model_fingerprint(model):
+    """Content hash of a fitted forest: identical models give identical hashes.
+
+    Only what the model computes with is hashed (tree structure, leaf values,
+    classes and feature names), so the same forest saved with pickle and with
+    joblib, or by different library versions, gets the same fingerprint.
+    """
+    try:
+        return _fingerprints[model]
+    except (KeyError, TypeError):
+        pass
+
+    digest = hashlib.sha256()
+    digest.update(repr([str(c) for c in model.classes_]).encode())
+    digest.update(repr(list(getattr(model, "feature_names_in_", []))).encode())
+    for tree in getattr(model, "estimators_", [model]):
+        tree_ = tree.tree_
+        for array in (tree_.children_left, tree_.children_right, tree_.feature,
+                      tree_.threshold, tree_.value):
+            digest.update(array.tobytes())
+    fingerprint = digest.hexdigest()
+    try:
+        _fingerprints[model] = fingerprint
+    except TypeError:
+        pass
+    return fingerprint
+
+
+def _validate(model, path, expected_features):
+    for attr in ("predict", "predict_proba", "classes_", "n_features_in_"):
+        if not hasattr(model, attr):
+            raise ModelLoadError(f"{path} is not a fitted classifier (missing {attr})")
+
+    names = getattr(model, "feature_names_in_", None)
+    if names is not None and len(names) != model.n_features_in_:
+        raise ModelLoadError(f"{path} has inconsistent feature names")
+
+    if expected_features is not None:
+        expected = list(expected_features)
+        if names is None:
+            if model.n_features_in_ != len(expected):
+                raise ModelLoadError(
+                    f"{path} expects {model.n_features_in_} features, got {len(expected)}"
+                )
+        elif list(names) != expected:
+            raise ModelLoadError(
+                f"{path} was trained on {list(names)}, not {expected}"
+            )
+
+
+def _load(path, expected_features):
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        raise ModelLoadError(f"Cannot read model file {path}: {e}") from e
+
+    rss_before = _rss()
+    start = time.perf_counter()
+    with warnings.catch_warnings(record=True) as caught:
+        # Keep the InconsistentVersionWarning and friends, they are worth reporting
+        warnings.simplefilter("always")
+        try:
+            model = _read_artifact(path)
+        except Exception as e:
+            raise ModelLoadError(f"Cannot load model file {path}: {e}") from e
+    load_seconds = time.perf_counter() - start
+    rss_after = _rss()
+
+    _validate(model, path, expected_features)
+
+    return LoadedModel(
+        path=path,
+        model=model,
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        load_seconds=load_seconds,
+        memory_bytes=model_memory_bytes(model),
+        rss_delta_bytes=None if rss_before is None else rss_after - rss_before,
+        # One warning per tree is common, keep each distinct message once
+        load_warnings=list(dict.fromkeys(str(w.message) for w in caught)),
+    )
+
+
+def _is_current(entry, path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        # The file went away; keep serving the copy we already have
+        return True
+    return entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size
+
+
+def load_model(path, expected_features=None):
+    """Return the model stored at ``path``, loading it at most once per process.
+
+    The model is reloaded when the file changes on disk. If
+    ``expected_features`` is given, the model must have been trained on exactly
+    those columns, in that order.
+    """
+    path = os.path.abspath(path)
+
+    entry = _models.get(path)
+    if entry is None or not _is_current(entry, path):
+        with _lock:
+            # Another session may have loaded it while we waited for the lock
+            entry = _models.get(path)
+            if entry is None or not _is_current(entry, path):
+                entry = _load(path, expected_features)
+                _models[path] = entry
+
+    if expected_features is not None:
+        _validate(entry.model, path, expected_features)
+    return entry.model
+
+
+def load_compiled(path, expected_features=None):
+    """Like ``load_model``, but return the forest compiled for fast scoring.
+
+    The compiled forest is built once per loaded model and rebuilt when the
+    file changes on disk.
+    """
+    load_model(path, expected_features)
+    entry = _models[os.path.abspath(path)]
+    if entry.compiled is None:
+        from forest_engine import CompiledForest
+
+        with _lock:
+            if entry.compiled is None:
+                compiled = CompiledForest.from_sklearn(entry.model)
+                compiled.fallback = lambda: entry.model
+                entry.compiled = compiled
+    return entry.compiled
+
+
+def model_stats():
+    """Load time and memory for every model loaded by this process."""
+    return [entry.stats() for entry in list(_models.values())]
+
+
+def clear_models():
+    """Forget every cached model, so the next call to load_model reloads it."""
+    with _lock:
+        _models.clear()
@@ -0,0 +1,291 @@
+"""Preprocessing and training for the shipped models, outside the notebook.
+
+The steps from Final_Project.ipynb run as separate stages:
+
+    cycles   the cycle columns from the typed store (see data_store.py), with
+             client-level values carried forward and the rows without a cycle
+             length, cycle number or ovulation day dropped
+    labels   Irregular (outside 20-40 days or more than 1.5 standard
+             deviations from the mean length, or with --client-sigma from
+             the client's own mean length), Regular and Fertility
+             (ovulation on days 12-16); see cycle_analytics.py
+    noise    Ovulation Day (Noisy), the ovulation day plus seeded normal noise
+    train    one random forest per entry in ``MODELS``, with SMOTE where the
+             notebook used it
+
+Every random step takes the same ``seed``, so two runs give the same models.
+Each stage's result is cached under ``.cache/pipeline``, keyed by a hash of
+the source data, the stage's parameters and the keys of the stages it reads
+from. Changing the noise scale retrains the fertility models only; changing
+a model's settings retrains that model only.
+
+The trained models are published to the model registry (see registry.py)
+with their metrics and the hash of the data they were trained on; a model
+identical to the latest published version is not added again.
+
+Usage::
+
+    python pipeline.py
+    python pipeline.py --models irregular --n-estimators 200 --out-dir build
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import joblib
+import numpy as np
+
+from cycle_analytics import (FERTILE_DAYS, MAX_LENGTH, MIN_LENGTH, SIGMA, client_irregular_label,
+                             fertility_label, irregular_label)
+from data_store import load_table, source_digest
+from features import (FEATURE_COLUMNS, FERTILITY_V3_COLUMNS, IRREGULAR_V3_COLUMNS,
+                      SOURCE_COLUMNS, feature_frame, fill_missing_values)
+from registry import REGISTRY_DIR, Registry
+
+CACHE_DIR = os.path.join(".cache", "pipeline")
+
+# Bump when a stage's code changes in a way that changes its output
+STAGE_VERSIONS = {"cycles": 1, "labels": 1, "noise": 1, "train": 1}
+
+# Every feature any of the models reads, before noise is added
+CYCLE_COLUMNS = ["Cycle Number", "Cycle Length", "Ovulation Day"] + [
+    name for name in FEATURE_COLUMNS if name not in ("Cycle Length", "Ovulation Day")
+]
+
+# Registry name -> features, target column and whether the training split
+# is balanced with SMOTE first
+MODELS = {
+    "fertility_v3": {"columns": FERTILITY_V3_COLUMNS, "target": "Fertility", "smote": False},
+    "irregular": {"columns": IRREGULAR_V3_COLUMNS, "target": "Irregular", "smote": True},
+    "fertility": {"columns": FEATURE_COLUMNS, "target": "Fertility", "smote": False},
+    # app_v4.py reads 1 from this model as a regular cycle
+    "regular_cycle": {"columns": FEATURE_COLUMNS, "target": "Regular", "smote": True},
+}
+
+
+def load_cycles(source, min_length=None, max_length=None):
+    """One row per usable cycle, with the features under their app names.
+
+    The notebook trained the shipped models on every cycle (outliers
+    included); pass ``min_length``/``max_length`` for its 20-40 day filter.
+    """
+    table = load_table(source, ["ClientID"] + [SOURCE_COLUMNS[name] for name in CYCLE_COLUMNS])
+    cycles = feature_frame(table, CYCLE_COLUMNS)
+    cycles, _ = fill_missing_values(cycles, table["ClientID"].to_numpy())
+
+    length = cycles["Cycle Length"].to_numpy()
+    keep = ~np.isnan(cycles[["Cycle Length", "Cycle Number", "Ovulation Day"]].to_numpy()).any(axis=1)
+    if min_length is not None:
+        keep &= length >= min_length
+    if max_length is not None:
+        keep &= length <= max_length
+
+    # The index keeps each cycle's row number in the source
+    cycles.insert(0, "ClientID", table["ClientID"].to_numpy())
+    return cycles[keep]
+
+
+def add_labels(cycles, sigma=SIGMA, min_length=MIN_LENGTH, max_length=MAX_LENGTH,
+               fertile_days=FERTILE_DAYS, mean=None, std=None, per_client=False):
+    """Add the Irregular, Regular and Fertility targets (in place).
+
+    ``mean`` and ``std`` of the cycle length default to those of ``cycles``.
+    With ``per_client`` each client's lengths are judged against the client's
+    own mean and spread (see ``cycle_analytics.client_irregular_label``).
+    """
+    length = cycles["Cycle Length"].to_numpy()
+    if per_client:
+        irregular = client_irregular_label(cycles["ClientID"].to_numpy(), length, sigma,
+                                           min_length, max_length, mean=mean, std=std)
+    else:
+        irregular = irregular_label(length, sigma, min_length, max_length, mean, std)
+    cycles["Irregular"] = irregular
+    cycles["Regular"] = 1 - irregular
+    cycles["Fertility"] = fertility_label(cycles["Ovulation Day"].to_numpy(), fertile_days)
+    return cycles
+
+
+def add_noise(cycles, scale=2.0, seed=42):
+    """Add Ovulation Day (Noisy), clipped at zero (in place)."""
+    rng = np.random.default_rng(seed)
+    noisy = cycles["Ovulation Day"].to_numpy() + rng.normal(0.0, scale, len(cycles))
+    cycles["Ovulation Day (Noisy)"] = np.maximum(noisy, 0.0)
+    return cycles
+
+
+def train_model(cycles, columns, target, smote=False, seed=42, test_size=0.2, **forest_params):
+    """Fit a random forest the way the notebook did; return it with test metrics.
+
+    Rows missing one of ``columns`` are left out.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.metrics import accuracy_score, precision_recall_fscore_support
+    from sklearn.model_selection import train_test_split
+
+    rows = cycles.dropna(subset=columns)
+    X_train, X_test, y_train, y_test = train_test_split(
+        rows[columns], rows[target], test_size=test_size, random_state=seed
+    )
+    if smote:
+        from imblearn.over_sampling import SMOTE
+
+        X_train, y_train = SMOTE(random_state=seed).fit_resample(X_train, y_train)
+
+    start = time.perf_counter()
+    model = RandomForestClassifier(random_state=seed, **forest_params)
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    predicted = model.predict(X_test)
+    precision, recall, f1, _ = precision_recall_fscore_support(
+        y_test, predicted, average="binary", zero_division=0
+    )
+    metrics = {
+        "accuracy": float(accuracy_score(y_test, predicted)),
+        "precision": float(precision), "recall": float(recall), "f1": float(f1),
+        "train_rows": int(len(X_train)), "test_rows": int(len(X_test)),
+        "fit_seconds": fit_seconds,
+    }
+    return model, metrics
+
+
+class StageCache:
+    """Stage results on disk, keyed by what they were computed from."""
+
+    def __init__(self, directory=CACHE_DIR, enabled=True):
+        self.directory = directory
+        self.enabled = enabled
+        self.log = []  # (stage, key, "hit" / "miss")
+
+    @staticmethod
+    def key(stage, params, upstream=()):
+        payload = json.dumps(
+            {"stage": stage, "version": STAGE_VERSIONS[stage.split(":")[0]],
+             "params": params, "upstream": list(upstream)},
+            sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+    def run(self, stage, params, upstream, compute):
+        """Return ``(key, result)``, computing the result only when not cached."""
+        key = self.key(stage, params, upstream)
+        path = os.path.join(self.directory, f"{stage.replace(':', '-')}-{key}.joblib")
+        if self.enabled and os.path.exists(path):
+            self.log.append((stage, key, "hit"))
+            return key, joblib.load(path)
+
+        result = compute()
+        self.log.append((stage, key, "miss"))
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            temporary = f"{path}.{os.getpid()}.tmp"
+            joblib.dump(result, temporary)
+            os.replace(temporary, path)
+        return key, result
+
+
+def run(source="FilteredData.csv", models=tuple(MODELS), seed=42, noise_scale=2.0,
+        sigma=1.5, min_length=None, max_length=None, test_size=0.2,
+        forest_params=None, cache=None, client_sigma=False):
+    """Run the stages and return ``(cycles, {model name: (model, metrics)})``."""
+    import sklearn
+
+    cache = cache if cache is not None else StageCache()
+    forest_params = forest_params or {}
+
+    cycles_key, cycles = cache.run(
+        "cycles", {"source": source_digest(source), "min_length": min_length, "max_length": max_length},
+        (), lambda: load_cycles(source, min_length, max_length),
+    )
+    labels_key, cycles = cache.run(
+        "labels", {"sigma": sigma, "per_client": client_sigma}, (cycles_key,),
+        lambda: add_labels(cycles, sigma, per_client=client_sigma),
+    )
+    noise_key, cycles = cache.run(
+        "noise", {"scale": noise_scale, "seed": seed}, (labels_key,),
+        lambda: add_noise(cycles, noise_scale, seed),
+    )
+
+    trained = {}
+    for name in models:
+        spec = MODELS[name]
+        # Only the fertility_v3 model reads the noisy column
+        upstream = noise_key if "Ovulation Day (Noisy)" in spec["columns"] else labels_key
+        params = {"columns": spec["columns"], "target": spec["target"], "smote": spec["smote"],
+                  "seed": seed, "test_size": test_size, "forest": forest_params,
+                  "sklearn": sklearn.__version__}
+        _, trained[name] = cache.run(
+            f"train:{name}", params, (upstream,),
+            lambda spec=spec: train_model(cycles, spec["columns"], spec["target"], spec["smote"],
+                                          seed, test_size, **forest_params),
+        )
+    return cycles, trained
+
+
+def write_preprocessed(source, cycles, path):
+    """The notebook's preprocessed_data.csv: the kept source rows plus the new columns."""
+    table = load_table(source).iloc[cycles.index.to_numpy()].reset_index(drop=True)
+    for name in ["Cycle Length", "Cycle Number"]:
+        table[name] = cycles[name].to_numpy(dtype=np.int64)
+    for name in ["Ovulation Day", "Irregular", "Fertility", "Ovulation Day (Noisy)"]:
+        table[name] = cycles[name].to_numpy()
+    table.to_csv(path, index=False, na_rep=" ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocess the cycle data and train the models")
+    parser.add_argument("--data", default="FilteredData.csv", help="CSV export to train on")
+    parser.add_argument("--registry", default=REGISTRY_DIR, help="Registry to publish to")
+    parser.add_argument("--no-publish", action="store_true", help="Train without publishing")
+    parser.add_argument("--out-dir", help="Also write <name>.joblib files (and --write-data) here")
+    parser.add_argument("--models", nargs="+", choices=list(MODELS), default=list(MODELS))
+    parser.add_argument("--seed", type=int, default=42, help="Seed for every random step")
+    parser.add_argument("--noise-scale", type=float, default=2.0,
+                        help="Standard deviation of the ovulation day noise")
+    parser.add_argument("--sigma", type=float, default=1.5,
+                        help="Standard deviations from the mean length that count as irregular")
+    parser.add_argument("--client-sigma", action="store_true",
+                        help="Judge each cycle length against the client's own mean and spread")
+    parser.add_argument("--min-length", type=float, help="Drop shorter cycles before training")
+    parser.add_argument("--max-length", type=float, help="Drop longer cycles before training")
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--max-depth", type=int)
+    parser.add_argument("--write-data", action="store_true",
+                        help="Also write preprocessed_data.csv to --out-dir")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute every stage")
+    args = parser.parse_args()
+
+    cache = StageCache(enabled=not args.no_cache)
+    forest_params = {"n_estimators": args.n_estimators}
+    if args.max_depth is not None:
+        forest_params["max_depth"] = args.max_depth
+    cycles, trained = run(args.data, args.models, args.seed, args.noise_scale, args.sigma,
+                          args.min_length, args.max_length, forest_params=forest_params,
+                          cache=cache, client_sigma=args.client_sigma)
+
+    for stage, key, status in cache.log:
+        print(f"{stage:<22} {key}  {status}")
+
+    registry = Registry(args.registry)
+    data_sha256 = source_digest(args.data)
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    for name, (model, metrics) in trained.items():
+        published = ""
+        if not args.no_publish:
+            entry = registry.publish(model, name, data_sha256=data_sha256, metrics=metrics,
+                                     source="pipeline.py")
+            published = f" -> {name} v{entry['version']}"
+        if args.out_dir:
+            joblib.dump(model, os.path.join(args.out_dir, f"{name}.joblib"))
+        print(f"{name}: accuracy {metrics['accuracy']:.3f}, f1 {metrics['f1']:.3f} "
+              f"({metrics['train_rows']} train / {metrics['test_rows']} test rows){published}")
+
+    if args.write_data and args.out_dir:
+        write_preprocessed(args.data, cycles, os.path.join(args.out_dir, "preprocessed_data.csv"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Predictions shared across sessions, keyed by model version and input row.
+
+The app inputs are whole days, flags and a one-decimal BMI, so the same rows
+come up again and again across users. Each row is rounded to that
+resolution (``DECIMALS``) and looked up together with the model version (its
+registry object hash) in one bounded LRU cache shared by the process. Only
+the rows not in the cache go to the forest, in one batch.
+
+    fertility = cached_model("fertility", expected_features=FEATURE_COLUMNS)
+    fertility.predict(input_data)
+
+With ``PREDICTION_CACHE_PRECOMPUTE=1`` the rows of ``PRECOMPUTE_REGION``
+(around the apps' default inputs) are scored once per model version when the
+model is first asked for, so most first predictions are already cached.
+``PREDICTION_CACHE_SIZE`` sets the number of rows kept.
+"""
+import itertools
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+MAX_ENTRIES = 100_000
+
+# Decimals kept per feature; every other input is a whole number
+DECIMALS = {"Body Mass Index": 1}
+
+# Values scored ahead of time, per feature; models with a feature not listed
+# here are not precomputed
+PRECOMPUTE_REGION = {
+    "Cycle Number": range(1, 21),
+    "Cycle Length": range(26, 31),
+    "Average Cycle Length": range(26, 31),
+    "Ovulation Day": range(13, 16),
+    "Ovulation Day (Noisy)": range(10, 21),
+    "Luteal Phase Length": range(11, 14),
+    "High Fertility Start": range(11, 14),
+    "Peak Cycle": [0, 1],
+    "Reproductive Status": [0, 1],
+    "Body Mass Index": [20.0, 21.0, 22.0, 23.0, 24.0],
+}
+
+
+def quantize(X, feature_names):
+    """``X`` rounded to the input resolution of each feature."""
+    X = np.array(X, dtype=np.float64, ndmin=2)
+    decimals = [DECIMALS.get(name, 0) for name in feature_names]
+    for places in set(decimals):
+        columns = [j for j, d in enumerate(decimals) if d == places]
+        X[:, columns] = np.round(X[:, columns], places)
+    # -0.0 and 0.0 are the same input
+    return X + 0.0
+
+
+class PredictionCache:
+    def __init__(self, maxsize=MAX_ENTRIES):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # (version, row bytes) -> probabilities bytes
+        self._lock = threading.Lock()
+        self._precomputed = set()
+        self.hits = 0
+        self.misses = 0
+
+    def predict_proba(self, engine, version, X, feature_names):
+        """Class probabilities of the rows of ``X`` (rounded, see ``quantize``)."""
+        X = quantize(X, feature_names)
+        keys = [(version, row.tobytes()) for row in X]
+        proba = np.empty((len(keys), len(engine.classes)))
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                known = self._entries.get(key)
+                if known is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    proba[i] = np.frombuffer(known)
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            scored = engine.predict_proba(X[missing])
+            proba[missing] = scored
+            self._store([keys[i] for i in missing], scored)
+        return proba
+
+    def _store(self, keys, proba):
+        with self._lock:
+            for key, row in zip(keys, proba):
+                self._entries[key] = row.tobytes()
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def precompute(self, engine, version, feature_names, region=PRECOMPUTE_REGION):
+        """Score every row of ``region`` once; returns the number of rows added."""
+        if any(name not in region for name in feature_names):
+            return 0
+        with self._lock:
+            if (version, tuple(feature_names)) in self._precomputed:
+                return 0
+            self._precomputed.add((version, tuple(feature_names)))
+        X = quantize(list(itertools.product(*(region[name] for name in feature_names))),
+                     feature_names)
+        # Stored first, so the user's own rows stay the most recently used
+        self._store([(version, row.tobytes()) for row in X], engine.predict_proba(X))
+        return len(X)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._precomputed.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries), "maxsize": self.maxsize,
+                    "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else None}
+
+
+class CachedModel:
+    """A compiled registry model whose predictions go through a ``PredictionCache``."""
+
+    def __init__(self, name, engine, version, feature_names, cache):
+        self.name = name
+        self.engine = engine
+        self.version = version
+        self.feature_names = list(feature_names)
+        self.cache = cache
+
+    @property
+    def classes(self):
+        return self.engine.classes
+
+    def predict_proba(self, X):
+        return self.cache.predict_proba(self.engine, self.version, X, self.feature_names)
+
+    def predict(self, X):
+        return self.classes.take(np.argmax(self.predict_proba(X), axis=1))
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_cache():
+    """The cache shared by the process, sized by ``$PREDICTION_CACHE_SIZE``."""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = PredictionCache(int(os.environ.get("PREDICTION_CACHE_SIZE", MAX_ENTRIES)))
+    return _default
+
+
+def cached_model(name, version=None, expected_features=None, registry=None, cache=None,
+                 precompute=None):
+    """``registry.load_compiled`` behind the shared prediction cache.
+
+    ``precompute`` defaults to ``$PREDICTION_CACHE_PRECOMPUTE``.
+    """
+    from registry import default_registry
+
+    registry = registry or default_registry()
+    cache = cache or default_cache()
+    entry = registry.resolve(name, version)
+    engine = registry.load_compiled(name, entry["version"], expected_features)
+    feature_names = entry["features"] or expected_features
+    if feature_names is None:
+        raise ValueError(f"{name!r} records no feature names; pass expected_features")
+
+    if precompute is None:
+        precompute = os.environ.get("PREDICTION_CACHE_PRECOMPUTE", "") not in ("", "0")
+    if precompute:
+        cache.precompute(engine, entry["object"], feature_names)
+    return CachedModel(name, engine, entry["object"], feature_names, cache)
@@ -0,0 +1,291 @@
+"""Small HTTP/JSON service for the fertility and cycle regularity predictions.
+
+The service uses the same models as app_v4.py (from the model registry, see
+registry.py), without Streamlit, the charts or Gemini. Requests that arrive at the same time are grouped into one
+batch (up to ``--max-batch`` rows, waiting at most ``--max-wait-ms``), so the
+forests score many rows per call instead of one.
+
+Endpoints:
+
+    POST /predict   one feature object, or {"instances": [...]} for several
+    GET  /metrics   latency percentiles, throughput, batch sizes and input drift
+                    against the training data (see drift_monitor.py)
+    GET  /health
+
+Usage::
+
+    python prediction_server.py --port 8000
+    curl -d '{"Cycle Length": 28, "Ovulation Day": 14, "Luteal Phase Length": 12,
+              "Average Cycle Length": 28, "Peak Cycle": 1, "Body Mass Index": 22.0,
+              "Reproductive Status": 1, "High Fertility Start": 12}' localhost:8000/predict
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from drift_monitor import default_monitor
+from ensemble import Ensemble
+from features import FEATURE_COLUMNS
+from model_loader import model_stats
+from registry import REGISTRY_DIR, Registry
+
+# Output name -> (registry name, label for class 0, label for class 1)
+MODELS = {
+    "fertility": ("fertility", "Low Fertility", "High Fertility"),
+    # app_v4.py reads 1 from this model as a regular cycle
+    "regular_cycle": ("regular_cycle", "Irregular Cycle", "Regular Cycle"),
+}
+
+
+class RequestError(Exception):
+    """A client error, answered with HTTP 400."""
+
+
+class LatencyStats:
+    """Latency percentiles and throughput over the most recent requests."""
+
+    def __init__(self, window=10_000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._finished = deque(maxlen=window)
+        self._batch_sizes = deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+
+    def record(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+            self._finished.append(time.monotonic())
+            self.count += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def record_batch(self, size):
+        with self._lock:
+            self._batch_sizes.append(size)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = np.array(self._latencies)
+            finished = np.array(self._finished)
+            batch_sizes = np.array(self._batch_sizes)
+            count, errors = self.count, self.errors
+
+        stats = {"requests": count, "errors": errors}
+        if len(latencies):
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            stats.update(latency_p50_ms=p50, latency_p99_ms=p99)
+        if len(finished) > 1:
+            elapsed = finished[-1] - finished[0]
+            stats["throughput_rps"] = (len(finished) - 1) / elapsed if elapsed > 0 else None
+        if len(batch_sizes):
+            stats.update(batches=len(batch_sizes), mean_batch_size=float(batch_sizes.mean()),
+                         max_batch_size=int(batch_sizes.max()))
+        return stats
+
+
+class MicroBatcher:
+    """Collects rows submitted from many threads and scores them together.
+
+    ``score_batch`` receives a 2-D array and returns one result per row. A
+    batch is scored as soon as it holds ``max_batch`` rows or the first row
+    has waited ``max_wait`` seconds.
+    """
+
+    def __init__(self, score_batch, max_batch=64, max_wait=0.002, stats=None):
+        self.score_batch = score_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.stats = stats
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        future = Future()
+        self._queue.put((row, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if self.stats is not None:
+                self.stats.record_batch(len(batch))
+            try:
+                results = self.score_batch(np.array([row for row, _ in batch], dtype=np.float64))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class Predictor:
+    """Scores feature rows with every model in ``MODELS``."""
+
+    def __init__(self, registry_root=REGISTRY_DIR):
+        self.registry = registry = Registry(registry_root)
+        self.engines = {
+            name: registry.load_compiled(model_name, expected_features=FEATURE_COLUMNS)
+            for name, (model_name, _, _) in MODELS.items()
+        }
+        # Every model in one pass over the batch (see ensemble.py)
+        self.ensemble = Ensemble({name: (engine, FEATURE_COLUMNS)
+                                  for name, engine in self.engines.items()})
+        self.monitor = default_monitor("prediction_server")
+
+    def score_batch(self, X):
+        scored = self.ensemble.score(X)
+        self.monitor.observe(X, scored)
+        per_model = {name: (scored.predict(name), scored.probability(name)) for name in MODELS}
+
+        results = []
+        for i in range(len(X)):
+            result = {}
+            for name, (prediction, probability) in per_model.items():
+                _, low_label, high_label = MODELS[name]
+                result[name] = {
+                    "prediction": int(prediction[i]),
+                    "label": high_label if prediction[i] == 1 else low_label,
+                    "probability": float(probability[i]),
+                }
+            results.append(result)
+        return results
+
+
+def parse_row(instance):
+    if not isinstance(instance, dict):
+        raise RequestError("Each instance must be a JSON object of features")
+    missing = [name for name in FEATURE_COLUMNS if name not in instance]
+    if missing:
+        raise RequestError(f"Missing features: {', '.join(missing)}")
+    try:
+        return [float(instance[name]) for name in FEATURE_COLUMNS]
+    except (TypeError, ValueError) as e:
+        raise RequestError(f"Features must be numbers: {e}") from e
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    # Set on a per-server subclass by make_server
+    batcher = None
+    stats = None
+    registry = None
+    monitor = None
+    timeout_seconds = 10.0
+
+    def log_message(self, format, *args):
+        # Access logs for every request would dominate a load test
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            drift = None if self.monitor is None else self.monitor.report()
+            self._send_json(200, {"latency": self.stats.snapshot(),
+                                  "models": self.registry.stats() + model_stats(),
+                                  "drift": drift})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"null")
+            single = not (isinstance(payload, dict) and "instances" in payload)
+            instances = [payload] if single else payload["instances"]
+            if not isinstance(instances, list):
+                raise RequestError("'instances' must be a list")
+            futures = [self.batcher.submit(parse_row(instance)) for instance in instances]
+            results = [future.result(self.timeout_seconds) for future in futures]
+        except (RequestError, json.JSONDecodeError) as e:
+            self.stats.record_error()
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self.stats.record_error()
+            self._send_json(500, {"error": str(e)})
+            return
+
+        self.stats.record(time.perf_counter() - start)
+        self._send_json(200, results[0] if single else {"predictions": results})
+
+
+class PredictionServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections under concurrent load
+    request_queue_size = 128
+
+
+def make_server(host="127.0.0.1", port=8000, registry_root=REGISTRY_DIR, max_batch=64,
+                max_wait=0.002):
+    """Build a ready-to-serve HTTP server (call ``serve_forever`` on it)."""
+    stats = LatencyStats()
+    predictor = Predictor(registry_root)
+    batcher = MicroBatcher(predictor.score_batch, max_batch=max_batch, max_wait=max_wait,
+                           stats=stats)
+    handler = type("Handler", (PredictionHandler,),
+                   {"batcher": batcher, "stats": stats, "registry": predictor.registry,
+                    "monitor": predictor.monitor})
+    return PredictionServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the cycle models over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--registry", default=REGISTRY_DIR, help="Model registry directory")
+    parser.add_argument("--max-batch", type=int, default=64, help="Most rows scored per batch")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0,
+                        help="Longest a request waits for others to join its batch")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.registry, args.max_batch,
+                         args.max_wait_ms / 1000)
+    print(f"Serving predictions on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
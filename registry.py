@@ -0,0 +1,359 @@
+"""Named, versioned models stored once by content.
+
+Layout::
+
+    models/manifest.json                   names, versions and their metadata
+    models/objects/<hash>.joblib           the fitted scikit-learn forest
+    models/objects/<hash>.forest           the same forest packed for scoring
+                                           (see forest_engine.PackedForest)
+
+``<hash>`` is ``model_loader.model_fingerprint``: it covers the trees, the
+classes and the feature names, so the same forest saved as .pkl, as .joblib
+or by another scikit-learn version is stored once.
+
+Each version records the feature schema, the classes, the feature
+importances, the scikit-learn version it was trained with, the hash of its
+training data and its metrics, when known. The apps ask for a model by name (and optionally version):
+
+    from registry import load_compiled
+    engine = load_compiled("fertility", expected_features=FEATURE_COLUMNS)
+
+Nothing is read until a model is asked for. Packed forests are one
+memory-mapped file each, so scoring never unpickles anything, every process
+serving a model shares its pages, and
+versions whose forests this scikit-learn cannot read are skipped when
+the full model is loaded.
+
+Usage::
+
+    python registry.py list
+    python registry.py import                 # the model files in the repo root
+    python registry.py publish fertility path/to/model.joblib
+    python registry.py pack                   # write missing .forest files
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import warnings
+
+import model_loader
+from model_loader import ModelLoadError, model_fingerprint
+
+REGISTRY_DIR = "models"
+FORMAT_VERSION = 1
+
+
+class RegistryError(ModelLoadError):
+    """Raised when a name or version is not in the registry."""
+
+
+def _node_fields():
+    from sklearn.tree._tree import NODE_DTYPE
+
+    return list(NODE_DTYPE.names)
+
+
+def _sklearn_major():
+    import sklearn
+
+    return sklearn.__version__.split(".")[0]
+
+
+class Registry:
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._engines = {}  # object hash -> PackedForest (CompiledForest if not packed)
+        self._engine_stats = {}  # object hash -> how it was loaded
+        self._manifest = None
+        self._manifest_mtime = None
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, "manifest.json")
+
+    def object_path(self, digest, kind="model"):
+        suffix = ".forest" if kind == "engine" else ".joblib"
+        return os.path.join(self.root, "objects", digest + suffix)
+
+    def _read_manifest(self):
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except OSError:
+            return {"format": FORMAT_VERSION, "models": {}}
+        if mtime != self._manifest_mtime:
+            with open(self.manifest_path) as file:
+                manifest = json.load(file)
+            if manifest.get("format") != FORMAT_VERSION:
+                raise RegistryError(f"{self.manifest_path} has format {manifest.get('format')}, "
+                                    f"expected {FORMAT_VERSION}")
+            self._manifest, self._manifest_mtime = manifest, mtime
+        return self._manifest
+
+    def _write_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        temporary = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(manifest, file, indent=1)
+            file.write("\n")
+        os.replace(temporary, self.manifest_path)
+
+    def names(self):
+        return sorted(self._read_manifest()["models"])
+
+    def versions(self, name):
+        try:
+            return list(self._read_manifest()["models"][name])
+        except KeyError:
+            raise RegistryError(f"No model named {name!r} in {self.root}") from None
+
+    def resolve(self, name, version=None, compatible_only=False):
+        """The manifest entry for ``name`` at ``version`` (the latest when None).
+
+        With ``compatible_only`` the latest version this scikit-learn can
+        unpickle is returned instead.
+        """
+        versions = self.versions(name)
+        if version is not None:
+            for entry in versions:
+                if entry["version"] == version:
+                    return entry
+            raise RegistryError(f"{name!r} has no version {version}")
+        if compatible_only:
+            versions = [entry for entry in versions if self.is_compatible(entry)]
+            if not versions:
+                raise RegistryError(f"No version of {name!r} can be read by this scikit-learn")
+        return versions[-1]
+
+    @staticmethod
+    def is_compatible(entry):
+        """Whether the installed scikit-learn can unpickle the entry's forest."""
+        return (entry["node_fields"] == _node_fields()
+                and entry["pickled_with"].split(".")[0] == _sklearn_major())
+
+    def publish(self, model, name, data_sha256=None, metrics=None, source=None,
+                sklearn_version=None):
+        """Store ``model`` under ``name`` and return its manifest entry.
+
+        Publishing a forest that is already the latest version of ``name``
+        returns that version instead of adding another one.
+        """
+        import joblib
+        import sklearn
+
+        from forest_engine import PackedForest
+
+        digest = model_fingerprint(model)
+        with self._lock:
+            manifest = self._read_manifest()
+            versions = manifest["models"].setdefault(name, [])
+            if versions and versions[-1]["object"] == digest:
+                return versions[-1]
+
+            os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+            for kind, write in (("model", lambda path: joblib.dump(model, path)),
+                                ("engine", lambda path: PackedForest.from_sklearn(model).save(path))):
+                path = self.object_path(digest, kind)
+                if not os.path.exists(path):
+                    temporary = f"{path}.{os.getpid()}.tmp"
+                    write(temporary)
+                    os.replace(temporary, path)
+
+            names = getattr(model, "feature_names_in_", None)
+            entry = {
+                "version": versions[-1]["version"] + 1 if versions else 1,
+                "object": digest,
+                "features": None if names is None else [str(n) for n in names],
+                "n_features": int(model.n_features_in_),
+                "classes": [c.item() if hasattr(c, "item") else c for c in model.classes_],
+                "n_estimators": len(getattr(model, "estimators_", [model])),
+                "feature_importances": [float(v) for v in model.feature_importances_],
+                "sklearn_version": sklearn_version or sklearn.__version__,
+                # The object file is written by this process, not by the trainer
+                "pickled_with": sklearn.__version__,
+                "node_fields": _node_fields(),
+                "data_sha256": data_sha256,
+                "metrics": metrics,
+                "source": source,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            }
+            versions.append(entry)
+            self._write_manifest(manifest)
+            return entry
+
+    def _check_features(self, entry, name, expected_features):
+        if expected_features is not None and entry["features"] is not None \
+                and entry["features"] != list(expected_features):
+            raise RegistryError(f"{name!r} version {entry['version']} was trained on "
+                                f"{entry['features']}, not {list(expected_features)}")
+
+    def load_model(self, name, version=None, expected_features=None):
+        """The scikit-learn forest, loaded once per process (see model_loader)."""
+        entry = self.resolve(name, version, compatible_only=version is None)
+        self._check_features(entry, name, expected_features)
+        return model_loader.load_model(self.object_path(entry["object"]), expected_features)
+
+    def feature_importances(self, name, version=None):
+        """``feature_importances_`` of a version, from the manifest when it has them."""
+        entry = self.resolve(name, version)
+        importances = entry.get("feature_importances")
+        if importances is None:
+            importances = list(self.load_model(name, entry["version"]).feature_importances_)
+        return importances
+
+    def load_compiled(self, name, version=None, expected_features=None):
+        """The packed forest, memory-mapped and shared by the whole process."""
+        entry = self.resolve(name, version)
+        self._check_features(entry, name, expected_features)
+        digest = entry["object"]
+        engine = self._engines.get(digest)
+        if engine is None:
+            from forest_engine import CompiledForest, PackedForest
+
+            with self._lock:
+                engine = self._engines.get(digest)
+                if engine is None:
+                    start = time.perf_counter()
+                    try:
+                        engine = PackedForest.load(self.object_path(digest, "engine"))
+                        mapped = True
+                    except (OSError, ValueError):
+                        # Missing or written by another engine version; `pack` writes it
+                        engine = CompiledForest.from_sklearn(
+                            model_loader.load_model(self.object_path(digest))
+                        )
+                        mapped = False
+                    # Large batches go to the forest itself, loaded on first use
+                    engine.fallback = lambda entry=entry: self._fallback(entry)
+                    self._engines[digest] = engine
+                    self._engine_stats[digest] = {
+                        "name": name, "version": entry["version"], "object": digest,
+                        "load_seconds": time.perf_counter() - start,
+                        "compiled_bytes": engine.nbytes, "memory_mapped": mapped,
+                    }
+        return engine
+
+    def _fallback(self, entry):
+        # Checked when first needed, so loading an engine never imports scikit-learn
+        if not self.is_compatible(entry):
+            return None
+        return model_loader.load_model(self.object_path(entry["object"]))
+
+    def pack(self, force=False):
+        """Write the .forest file of every stored object missing one; returns their hashes."""
+        from forest_engine import PackedForest
+
+        written = []
+        for digest in sorted({entry["object"] for name in self.names()
+                              for entry in self.versions(name)}):
+            path = self.object_path(digest, "engine")
+            if os.path.exists(path) and not force:
+                continue
+            temporary = f"{path}.{os.getpid()}.tmp"
+            PackedForest.from_sklearn(model_loader.load_model(self.object_path(digest))).save(temporary)
+            os.replace(temporary, path)
+            written.append(digest)
+        return written
+
+    def stats(self):
+        """How each compiled forest loaded by this process was read."""
+        return list(self._engine_stats.values())
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_registry():
+    """The registry in ``REGISTRY_DIR`` (or ``$MODEL_REGISTRY``), shared by the process."""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = Registry(os.environ.get("MODEL_REGISTRY", REGISTRY_DIR))
+    return _default
+
+
+def load_model(name, version=None, expected_features=None):
+    return default_registry().load_model(name, version, expected_features)
+
+
+def load_compiled(name, version=None, expected_features=None):
+    return default_registry().load_compiled(name, version, expected_features)
+
+
+def feature_importances(name, version=None):
+    return default_registry().feature_importances(name, version)
+
+
+def _read_with_version(path):
+    """Load a model file and the scikit-learn version that wrote it."""
+    import sklearn
+    from sklearn.exceptions import InconsistentVersionWarning
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        model = model_loader._read_artifact(path)
+    for warning in caught:
+        if issubclass(warning.category, InconsistentVersionWarning):
+            return model, warning.message.original_sklearn_version
+    return model, sklearn.__version__
+
+
+# Registry name -> files in the repo root that hold it
+LEGACY_FILES = {
+    "fertility": ["rf_fertility_model.joblib", "rf_fertility_model.pkl",
+                  "rf_fertility_model_compatible.joblib"],
+    "regular_cycle": ["rf_regular_cycle_model.joblib", "rf_regular_cycle_model.pkl",
+                      "rf_regular_cycle_model_compatible.joblib"],
+    "fertility_v3": ["rf_model_fertility.joblib"],
+    "irregular": ["rf_model_irregular.joblib"],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the model registry")
+    parser.add_argument("--root", default=REGISTRY_DIR, help="Registry directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="Show every name and version")
+    importer = commands.add_parser("import", help="Add model files from a directory")
+    importer.add_argument("--dir", default=".", help="Directory holding the old model files")
+    publisher = commands.add_parser("publish", help="Add one model file")
+    publisher.add_argument("name")
+    publisher.add_argument("path")
+    packer = commands.add_parser("pack", help="Write the packed forest of every stored model")
+    packer.add_argument("--force", action="store_true", help="Rewrite existing .forest files")
+    args = parser.parse_args()
+
+    registry = Registry(args.root)
+    if args.command == "import":
+        for name, files in LEGACY_FILES.items():
+            for file in files:
+                path = os.path.join(args.dir, file)
+                if not os.path.exists(path):
+                    continue
+                model, version = _read_with_version(path)
+                entry = registry.publish(model, name, source=file, sklearn_version=version)
+                print(f"{file} -> {name} v{entry['version']} ({entry['object'][:12]})")
+    elif args.command == "publish":
+        model, version = _read_with_version(args.path)
+        entry = registry.publish(model, args.name, source=os.path.basename(args.path),
+                                 sklearn_version=version)
+        print(f"{args.path} -> {args.name} v{entry['version']} ({entry['object'][:12]})")
+    elif args.command == "pack":
+        for digest in registry.pack(args.force):
+            path = registry.object_path(digest, "engine")
+            print(f"{digest[:12]} -> {path} ({os.path.getsize(path) / 1024:.0f} KiB)")
+
+    for name in registry.names():
+        for entry in registry.versions(name):
+            compatible = "" if registry.is_compatible(entry) else "  (incompatible)"
+            print(f"{name:<14} v{entry['version']:<3} {entry['object'][:12]}  "
+                  f"sklearn {entry['sklearn_version']:<7} {entry['n_estimators']} trees  "
+                  f"{len(entry['features'] or [])} features{compatible}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""Retrain the models on the cycles appended to an export since the last run.
+
+Instead of rerunning the whole pipeline, ``update`` reads only the rows
+added to the CSV since the last run (from the byte offset it stopped at)
+and
+
+    1. carries client values forward and updates the running statistics
+       behind the features and labels: the mean and variance of the cycle
+       length (for the 1.5 standard deviation Irregular label, merged with
+       Chan's formula), each client's mean cycle length and the mean BMI;
+    2. labels the new cycles with the updated statistics and holds back
+       ``test_size`` of them;
+    3. adds ``trees`` trees fitted on the rest (with SMOTE where the pipeline
+       uses it) to a copy of each published forest, through ``warm_start``,
+       and retires the oldest trees beyond ``max_trees``;
+    4. scores the published forest and the candidate on the holdout: the rows
+       just held back plus a fixed-size reservoir sample of those held back
+       by earlier updates, labelled with the current statistics. The
+       candidate is published only when its accuracy and F1 are both within
+       ``tolerance`` of the published forest's.
+
+The statistics, the offset, the carried client values and the holdout
+reservoir are kept in a state file. ``init`` builds it, without training,
+from the rows the published models were trained on:
+
+    python retrain.py init --data FilteredData.csv
+    # ... new cycles are appended to FilteredData.csv ...
+    python retrain.py update --data FilteredData.csv
+
+Labels of earlier cycles are not revised when the statistics move, and a
+client's mean cycle length only covers the cycles seen so far, so the
+models slowly drift from what a full pipeline.py run would train; run the
+pipeline now and then to start over (and ``init`` again).
+"""
+import argparse
+import copy
+import os
+import warnings
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from data_store import read_appended
+from features import SOURCE_COLUMNS, feature_frame, fill_missing_values
+from pipeline import CYCLE_COLUMNS, MODELS, add_labels, add_noise
+from registry import REGISTRY_DIR, Registry
+
+STATE_PATH = os.path.join(".cache", "retrain", "state.joblib")
+FORMAT_VERSION = 2
+
+TREES = 10
+MAX_TREES = 100
+TOLERANCE = 0.01
+
+# Held-back rows kept from earlier updates
+HOLDOUT_SIZE = 5_000
+
+# New training rows a model needs before trees are fitted on them
+MIN_ROWS = 50
+
+# Bytes before the offset that must be unchanged, or the file was rewritten
+_TAIL = 256
+
+
+class SourceChangedError(ValueError):
+    """Raised when the export was rewritten rather than appended to."""
+
+
+def merge_moments(a, b):
+    """``(count, mean, m2)`` of two samples combined (Chan et al.)."""
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    if n == 0:
+        return a
+    delta = mean_b - mean_a
+    return n, mean_a + delta * n_b / n, m2_a + m2_b + delta ** 2 * n_a * n_b / n
+
+
+def _moments(values):
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return 0, 0.0, 0.0
+    mean = float(values.mean())
+    return len(values), mean, float(((values - mean) ** 2).sum())
+
+
+class RetrainState:
+    def __init__(self, source, sigma=1.5, noise_scale=2.0, seed=42):
+        self.format = FORMAT_VERSION
+        self.source = source
+        self.sigma = sigma
+        self.noise_scale = noise_scale
+        self.seed = seed
+        self.offset = 0
+        self.tail = b""
+        self.rows = 0  # source rows read so far
+        self.updates = 0
+        self.length = (0, 0.0, 0.0)  # moments of the labelled cycle lengths
+        self.fill_state = None  # see features.fill_missing_values
+        self.holdout = None
+        self.holdout_seen = 0
+
+    @property
+    def label_stats(self):
+        """Mean and standard deviation of the cycle length, as ``add_labels`` takes them."""
+        n, mean, m2 = self.length
+        return mean, np.sqrt(m2 / (n - 1)) if n > 1 else np.nan
+
+    def _check_source(self):
+        if os.path.getsize(self.source) < self.offset:
+            raise SourceChangedError(f"{self.source} is shorter than when it was last read; "
+                                     "run `retrain.py init` again")
+        with open(self.source, "rb") as file:
+            file.seek(self.offset - len(self.tail))
+            if file.read(len(self.tail)) != self.tail:
+                raise SourceChangedError(f"{self.source} was rewritten, not appended to; "
+                                         "run `retrain.py init` again")
+
+    def read(self):
+        """The cycles appended since the last read, labelled; advances the state."""
+        self._check_source()
+        columns = ["ClientID"] + [SOURCE_COLUMNS[name] for name in CYCLE_COLUMNS]
+        table, end = read_appended(self.source, self.offset, columns)
+        cycles = self._ingest(table)
+        with open(self.source, "rb") as file:
+            file.seek(max(end - _TAIL, 0))
+            self.tail = file.read(end - file.tell())
+        self.offset = end
+        return cycles
+
+    def _ingest(self, table):
+        # The same features as pipeline.load_cycles, from the statistics so far
+        first_row = self.rows
+        clients = table["ClientID"].to_numpy(dtype=object)
+        cycles = feature_frame(table, CYCLE_COLUMNS)
+        cycles, self.fill_state = fill_missing_values(cycles, clients, self.fill_state)
+
+        keep = ~np.isnan(cycles[["Cycle Length", "Cycle Number", "Ovulation Day"]].to_numpy()).any(axis=1)
+        cycles.insert(0, "ClientID", clients)
+        # The index keeps each cycle's row number in the source
+        cycles.index = pd.RangeIndex(first_row, first_row + len(cycles))
+        cycles = cycles[keep]
+        self.rows += len(table)
+
+        self.length = merge_moments(self.length, _moments(cycles["Cycle Length"].to_numpy()))
+        mean, std = self.label_stats
+        add_labels(cycles, self.sigma, mean=mean, std=std)
+        add_noise(cycles, self.noise_scale, [self.seed, first_row])
+        return cycles
+
+    def labelled_holdout(self):
+        """The reservoir of earlier held-back cycles, labelled with the current statistics."""
+        if self.holdout is None or not len(self.holdout):
+            return None
+        mean, std = self.label_stats
+        return add_labels(self.holdout.copy(), self.sigma, mean=mean, std=std)
+
+    def keep_holdout(self, rows, rng):
+        """Add ``rows`` to the reservoir: a uniform sample of every held-back row so far."""
+        rows = rows.drop(columns=["Irregular", "Regular", "Fertility"], errors="ignore")
+        if self.holdout is None:
+            self.holdout = rows.iloc[:0]
+        head = rows.iloc[:max(HOLDOUT_SIZE - len(self.holdout), 0)]
+        rest = rows.iloc[len(head):]
+        self.holdout = pd.concat([self.holdout, head])
+        # Algorithm R, vectorized: the i-th row seen replaces a random slot with
+        # probability HOLDOUT_SIZE / i; for a slot drawn twice the later row wins
+        seen = self.holdout_seen + len(head) + np.arange(1, len(rest) + 1)
+        slots = (rng.random(len(rest)) * seen).astype(np.int64)
+        chosen = np.flatnonzero(slots < HOLDOUT_SIZE)
+        _, last = np.unique(slots[chosen][::-1], return_index=True)
+        chosen = chosen[len(chosen) - 1 - last]
+        kept = np.ones(len(self.holdout), dtype=bool)
+        kept[slots[chosen]] = False
+        self.holdout = pd.concat([self.holdout[kept], rest.iloc[chosen]])
+        self.holdout_seen += len(rows)
+
+    def save(self, path=STATE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        # A plain dict, so the file loads whichever module saved it
+        joblib.dump(vars(self), temporary)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path=STATE_PATH):
+        fields = joblib.load(path)
+        if fields.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{path} has format {fields.get('format')}, "
+                             f"expected {FORMAT_VERSION}; run `retrain.py init` again")
+        state = cls.__new__(cls)
+        state.__dict__.update(fields)
+        return state
+
+
+def grow(model, X, y, trees=TREES, max_trees=MAX_TREES, random_state=None):
+    """A copy of ``model`` with ``trees`` more trees fitted on ``X``, ``y``.
+
+    The oldest trees beyond ``max_trees`` are dropped; returns the copy and
+    the number dropped.
+    """
+    candidate = copy.deepcopy(model)
+    candidate.set_params(warm_start=True, n_estimators=len(candidate.estimators_) + trees,
+                         random_state=random_state)
+    with warnings.catch_warnings():
+        # Balanced class weights are computed from the new rows only, which is
+        # what the new trees should be fitted with
+        warnings.filterwarnings("ignore", message="class_weight presets")
+        candidate.fit(X, y)
+    retired = max(len(candidate.estimators_) - max_trees, 0)
+    # warm_start appends, so the oldest trees come first
+    candidate.estimators_ = candidate.estimators_[retired:]
+    candidate.set_params(warm_start=False, n_estimators=len(candidate.estimators_))
+    return candidate, retired
+
+
+def _scores(model, X, y):
+    from sklearn.metrics import accuracy_score, f1_score
+
+    predicted = model.predict(X)
+    return {"accuracy": float(accuracy_score(y, predicted)),
+            "f1": float(f1_score(y, predicted, zero_division=0))}
+
+
+def _balance(X, y, seed):
+    """SMOTE as in pipeline.train_model, with fewer neighbours for small batches."""
+    from imblearn.over_sampling import SMOTE
+
+    minority = int(y.value_counts().min())
+    if minority < 2:
+        return X, y
+    return SMOTE(random_state=seed, k_neighbors=min(5, minority - 1)).fit_resample(X, y)
+
+
+def update(state, registry, models=tuple(MODELS), trees=TREES, max_trees=MAX_TREES,
+           tolerance=TOLERANCE, test_size=0.2, publish=True):
+    """Read the appended cycles and retrain ``models``; returns one report per model."""
+    cycles = state.read()
+    if not len(cycles):
+        return []
+    rng = np.random.default_rng([state.seed, state.rows])
+    held_back = rng.random(len(cycles)) < test_size
+    training, new_holdout = cycles[~held_back], cycles[held_back]
+    holdout = pd.concat([state.labelled_holdout(), new_holdout])
+
+    reports = []
+    for name in models:
+        spec = MODELS[name]
+        columns, target = spec["columns"], spec["target"]
+        train = training.dropna(subset=columns)
+        test = holdout.dropna(subset=columns)
+        entry = registry.resolve(name, compatible_only=True)
+        current = registry.load_model(name, entry["version"])
+        report = {"model": name, "base_version": entry["version"],
+                  "train_rows": len(train), "holdout_rows": len(test)}
+        reports.append(report)
+        if len(train) < MIN_ROWS:
+            report["status"] = f"skipped: fewer than {MIN_ROWS} new training rows"
+            continue
+        if set(train[target].unique()) != set(current.classes_.tolist()):
+            report["status"] = "skipped: the new rows do not have every class"
+            continue
+        if not len(test):
+            report["status"] = "skipped: no holdout rows"
+            continue
+
+        seed = int(rng.integers(2 ** 31))
+        X, y = train[columns], train[target]
+        if spec["smote"]:
+            X, y = _balance(X, y, seed)
+        candidate, retired = grow(current, X, y, trees, max_trees, seed)
+        report["before"] = _scores(current, test[columns], test[target])
+        report["after"] = _scores(candidate, test[columns], test[target])
+        report["trees_retired"] = retired
+        passed = all(report["after"][metric] >= report["before"][metric] - tolerance
+                     for metric in ("accuracy", "f1"))
+        if not passed:
+            report["status"] = "rejected: holdout metrics dropped by more than the tolerance"
+        elif publish:
+            metrics = dict(report["after"], train_rows=len(X), test_rows=len(test),
+                           base_version=entry["version"], trees_added=trees, trees_retired=retired)
+            published = registry.publish(candidate, name, metrics=metrics, source="retrain.py")
+            report["status"] = f"published v{published['version']}"
+        else:
+            report["status"] = "passed (not published)"
+
+    state.keep_holdout(new_holdout, rng)
+    state.updates += 1
+    return reports
+
+
+def init(source, sigma=1.5, noise_scale=2.0, seed=42):
+    """A state that has read every row of ``source``, without training."""
+    state = RetrainState(source, sigma, noise_scale, seed)
+    state.read()
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrain the models on newly appended cycles")
+    parser.add_argument("--data", default="FilteredData.csv", help="CSV export that grows")
+    parser.add_argument("--state", default=STATE_PATH)
+    parser.add_argument("--registry", default=REGISTRY_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    starter = commands.add_parser("init", help="Read the rows the published models were trained on")
+    starter.add_argument("--seed", type=int, default=42)
+    starter.add_argument("--sigma", type=float, default=1.5,
+                         help="Standard deviations from the mean length that count as irregular")
+    starter.add_argument("--noise-scale", type=float, default=2.0)
+    updater = commands.add_parser("update", help="Retrain on the rows appended since")
+    updater.add_argument("--models", nargs="+", choices=list(MODELS), default=list(MODELS))
+    updater.add_argument("--trees", type=int, default=TREES, help="Trees added per model")
+    updater.add_argument("--max-trees", type=int, default=MAX_TREES,
+                         help="Trees kept per model; the oldest go first")
+    updater.add_argument("--tolerance", type=float, default=TOLERANCE,
+                         help="Largest drop in holdout accuracy or F1 still published")
+    updater.add_argument("--test-size", type=float, default=0.2, help="Share of new rows held back")
+    updater.add_argument("--dry-run", action="store_true",
+                         help="Report without publishing or saving the state")
+    args = parser.parse_args()
+
+    if args.command == "init":
+        state = init(args.data, args.sigma, args.noise_scale, args.seed)
+        state.save(args.state)
+        mean, std = state.label_stats
+        print(f"Read {state.rows} rows of {args.data} (cycle length {mean:.2f} +/- {std:.2f}) "
+              f"-> {args.state}")
+        return
+
+    state = RetrainState.load(args.state)
+    if os.path.abspath(state.source) != os.path.abspath(args.data):
+        parser.error(f"{args.state} follows {state.source}, not {args.data}")
+    rows = state.rows
+    reports = update(state, Registry(args.registry), args.models, args.trees, args.max_trees,
+                     args.tolerance, args.test_size, publish=not args.dry_run)
+    print(f"{state.rows - rows} new rows")
+    for report in reports:
+        line = (f"{report['model']:<14} v{report['base_version']}  {report['train_rows']} train / "
+                f"{report['holdout_rows']} holdout rows  ")
+        if "after" in report:
+            line += (f"accuracy {report['before']['accuracy']:.3f} -> {report['after']['accuracy']:.3f}, "
+                     f"f1 {report['before']['f1']:.3f} -> {report['after']['f1']:.3f}  ")
+        print(line + report["status"])
+    if not args.dry_run:
+        state.save(args.state)
+
+
+if __name__ == "__main__":
+    main()
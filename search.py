@@ -0,0 +1,260 @@
+"""Hyperparameter search for the forest models, with k-fold cross-validation.
+
+Each candidate (forest size, depth, leaf settings) is fitted on every fold
+of a stratified k-fold split, across a process pool. The folds, including
+the SMOTE resampling of their training part, are built once per model and
+cached under ``.cache/search``; the workers load them from there.
+
+Results are appended to a JSONL file as candidates finish. Running the same
+search again skips the candidates already in the file, so an interrupted
+search resumes where it stopped.
+
+Every candidate is reported with its cross-validated accuracy, the latency
+of a single-row prediction through the packed engine the apps score with
+(``forest_engine.PackedForest``, as the registry loads it) and its size as a
+joblib file. Candidates on the Pareto
+front (no other candidate is at least as good on all three and better on
+one) are marked with ``*``.
+
+Usage::
+
+    python search.py --model fertility_v3 --folds 5
+    python search.py --model irregular --random 30 --workers 4
+"""
+import argparse
+import hashlib
+import io
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+
+from pipeline import MODELS, StageCache
+from pipeline import run as run_pipeline
+
+CACHE_DIR = os.path.join(".cache", "search")
+
+# Recorded with every result: the engine its latency was measured with
+LATENCY_ENGINE = "packed"
+
+GRID = {
+    "n_estimators": [10, 25, 50, 100, 200],
+    "max_depth": [None, 4, 8, 16],
+    "min_samples_leaf": [1, 2, 5, 10],
+}
+
+# Ranges for --random: integer ranges are inclusive, lists are sampled from
+RANDOM_SPACE = {
+    "n_estimators": (5, 300),
+    "max_depth": [None, 2, 3, 4, 6, 8, 12, 16, 24],
+    "min_samples_leaf": (1, 20),
+    "max_features": ["sqrt", "log2", None],
+}
+
+
+def grid_candidates(grid=GRID):
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def random_candidates(n, seed=0, space=RANDOM_SPACE):
+    rng = np.random.default_rng(seed)
+    candidates = []
+    for _ in range(n):
+        candidate = {}
+        for name, choices in space.items():
+            if isinstance(choices, tuple):
+                candidate[name] = int(rng.integers(choices[0], choices[1] + 1))
+            else:
+                candidate[name] = choices[rng.integers(len(choices))]
+        candidates.append(candidate)
+    return candidates
+
+
+def candidate_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def build_folds(cycles, spec, n_folds=5, seed=42):
+    """``[(X_train, y_train, X_test, y_test), ...]``, resampled with SMOTE where the model uses it."""
+    from sklearn.model_selection import StratifiedKFold
+
+    rows = cycles.dropna(subset=spec["columns"])
+    X = rows[spec["columns"]].to_numpy(dtype=np.float64)
+    y = rows[spec["target"]].to_numpy()
+    folds = []
+    for train, test in StratifiedKFold(n_folds, shuffle=True, random_state=seed).split(X, y):
+        X_train, y_train = X[train], y[train]
+        if spec["smote"]:
+            from imblearn.over_sampling import SMOTE
+
+            X_train, y_train = SMOTE(random_state=seed).fit_resample(X_train, y_train)
+        folds.append((X_train, y_train, X[test], y[test]))
+    return folds
+
+
+def cached_folds(model_name, n_folds=5, seed=42, source="FilteredData.csv", cache=None):
+    """Path of the cached folds for ``model_name``, building them if needed."""
+    cache = cache if cache is not None else StageCache()
+    start = len(cache.log)
+    cycles, _ = run_pipeline(source, models=(), seed=seed, cache=cache)
+    spec = MODELS[model_name]
+    # The folds depend on the labelled data (the stage keys of this pipeline
+    # run, not of others the cache has served) and the split
+    stages = [key for _, key, _ in cache.log[start:]]
+    payload = json.dumps({"folds": n_folds, "seed": seed, "spec": spec, "stages": stages},
+                         sort_keys=True)
+    key = hashlib.sha256(payload.encode()).hexdigest()[:16]
+    path = os.path.join(CACHE_DIR, f"folds-{model_name}-{key}.joblib")
+    if not os.path.exists(path):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        joblib.dump(build_folds(cycles, spec, n_folds, seed), temporary)
+        os.replace(temporary, path)
+    return path
+
+
+_folds = None
+
+
+def _init_worker(folds_path):
+    global _folds
+    _folds = joblib.load(folds_path, mmap_mode="r")
+
+
+def _single_row_latency(model, X, repeats=200):
+    from forest_engine import CompiledForest, PackedForest
+
+    engine = PackedForest.from_forest(CompiledForest.from_sklearn(model))
+    rows = X[:repeats]
+    timings = np.empty(len(rows))
+    for i, row in enumerate(rows):
+        start = time.perf_counter()
+        engine.predict(row)
+        timings[i] = time.perf_counter() - start
+    return float(np.median(timings))
+
+
+def evaluate(params, seed=42):
+    """Cross-validate one candidate on the worker's folds."""
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.metrics import accuracy_score, f1_score
+
+    accuracies, f1s = [], []
+    for X_train, y_train, X_test, y_test in _folds:
+        model = RandomForestClassifier(random_state=seed, n_jobs=1, **params)
+        model.fit(X_train, y_train)
+        predicted = model.predict(X_test)
+        accuracies.append(accuracy_score(y_test, predicted))
+        f1s.append(f1_score(y_test, predicted, zero_division=0))
+
+    # Latency and size are measured on the last fold's model
+    buffer = io.BytesIO()
+    joblib.dump(model, buffer)
+    return {
+        "params": params,
+        "accuracy": float(np.mean(accuracies)), "accuracy_std": float(np.std(accuracies)),
+        "f1": float(np.mean(f1s)),
+        "latency_ms": _single_row_latency(model, X_test) * 1000,
+        "size_bytes": buffer.tell(),
+        "nodes": int(sum(tree.tree_.node_count for tree in model.estimators_)),
+    }
+
+
+def read_results(path):
+    """Results already in a checkpoint file; a truncated last line is ignored."""
+    results = []
+    if not os.path.exists(path):
+        return results
+    with open(path) as file:
+        for line in file:
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return results
+
+
+def search(candidates, folds_path, results_path, workers=None, seed=42):
+    """Evaluate the candidates not yet in ``results_path`` and return all results.
+
+    Results from other folds (another model, split or dataset) in the same
+    file are left alone and not returned.
+    """
+    folds = os.path.basename(folds_path)
+    # Results timed with another engine are measured again
+    results = [result for result in read_results(results_path)
+               if result.get("folds") == folds and result.get("seed") == seed
+               and result.get("engine") == LATENCY_ENGINE]
+    done = {candidate_key(result["params"]) for result in results}
+    pending = [params for params in candidates if candidate_key(params) not in done]
+    if not pending:
+        return results
+
+    os.makedirs(os.path.dirname(results_path) or ".", exist_ok=True)
+    with open(results_path, "a") as out, ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(folds_path,)
+    ) as pool:
+        futures = [pool.submit(evaluate, params, seed) for params in pending]
+        for i, future in enumerate(as_completed(futures), 1):
+            result = dict(future.result(), folds=folds, seed=seed, engine=LATENCY_ENGINE)
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+            results.append(result)
+            print(f"[{i}/{len(pending)}] {candidate_key(result['params'])}: "
+                  f"accuracy {result['accuracy']:.3f}, {result['latency_ms']:.3f} ms, "
+                  f"{result['size_bytes'] / 1024:.0f} KiB")
+    return results
+
+
+def pareto_front(results):
+    """Indices of the results no other result dominates (higher accuracy, lower latency and size)."""
+    if not results:
+        return []
+    scores = np.array([[-r["accuracy"], r["latency_ms"], r["size_bytes"]] for r in results])
+    # dominated[i, j]: result j is at least as good as i everywhere and better somewhere
+    no_worse = (scores[None, :, :] <= scores[:, None, :]).all(axis=2)
+    better = (scores[None, :, :] < scores[:, None, :]).any(axis=2)
+    dominated = (no_worse & better).any(axis=1)
+    return [i for i in np.flatnonzero(~dominated)]
+
+
+def report(results):
+    front = set(pareto_front(results))
+    order = sorted(range(len(results)), key=lambda i: -results[i]["accuracy"])
+    print(f"\n{'':1} {'accuracy':>9} {'f1':>6} {'latency ms':>11} {'size KiB':>9}  params")
+    for i in order:
+        r = results[i]
+        print(f"{'*' if i in front else ' ':1} {r['accuracy']:>9.4f} {r['f1']:>6.3f} "
+              f"{r['latency_ms']:>11.3f} {r['size_bytes'] / 1024:>9.0f}  {candidate_key(r['params'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-validated hyperparameter search")
+    parser.add_argument("--model", choices=list(MODELS), default="fertility_v3")
+    parser.add_argument("--data", default="FilteredData.csv")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--random", type=int, metavar="N",
+                        help="Sample N candidates instead of the full grid")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPUs)")
+    parser.add_argument("--results", help="Checkpoint file (default: search_results/<model>.jsonl)")
+    args = parser.parse_args()
+
+    candidates = (random_candidates(args.random, args.seed) if args.random
+                  else grid_candidates())
+    results_path = args.results or os.path.join("search_results", f"{args.model}.jsonl")
+    folds_path = cached_folds(args.model, args.folds, args.seed, args.data)
+
+    results = search(candidates, folds_path, results_path, args.workers, args.seed)
+    wanted = {candidate_key(params) for params in candidates}
+    report([result for result in results if candidate_key(result["params"]) in wanted])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""What-if sweeps: predictions over a grid of one or two features.
+
+The other features stay at the user's values. The whole grid goes through
+one ``predict_proba`` call. Given a model from ``prediction_cache.cached_model``
+the grid rows are looked up in the shared prediction cache first, so a later
+sweep only scores the rows it has not seen: moving a slider back, or
+switching between sweeps that share a row, costs nothing.
+
+    result = sweep(fertility, input_values, "Ovulation Day", "Luteal Phase Length")
+    result.probability   # (len(y_values), len(x_values)) probability of class 1
+"""
+import numpy as np
+
+from features import FEATURE_COLUMNS
+
+# Values swept for each app input: (start, stop, step) or an explicit list.
+# Bounded inputs use the app's bounds, the others a plausible range.
+SWEEP_VALUES = {
+    "Cycle Length": (15, 60, 1),
+    "Ovulation Day": (1, 31, 1),
+    "Luteal Phase Length": (1, 18, 1),
+    "Average Cycle Length": (15, 60, 1),
+    "Peak Cycle": [0, 1],
+    "Body Mass Index": (10.0, 50.0, 0.5),
+    "Reproductive Status": [0, 1],
+    "High Fertility Start": (1, 31, 1),
+}
+
+
+def sweep_values(feature):
+    values = SWEEP_VALUES[feature]
+    if isinstance(values, tuple):
+        start, stop, step = values
+        return np.arange(start, stop + step / 2, step, dtype=np.float64)
+    return np.asarray(values, dtype=np.float64)
+
+
+class SweepResult:
+    def __init__(self, x_feature, x_values, y_feature, y_values, probability, prediction):
+        self.x_feature = x_feature
+        self.x_values = x_values
+        self.y_feature = y_feature
+        self.y_values = y_values
+        self.probability = probability
+        self.prediction = prediction
+
+    def flips(self):
+        """``x_values`` where the prediction changes from the previous value, per y row."""
+        changed = self.prediction[:, 1:] != self.prediction[:, :-1]
+        return [self.x_values[1:][row] for row in changed]
+
+
+def sweep_grid(input_values, x_feature, y_feature=None, feature_names=FEATURE_COLUMNS):
+    """The grid rows (y-major) and the swept values of each axis."""
+    x_values = sweep_values(x_feature)
+    y_values = sweep_values(y_feature) if y_feature else np.array([np.nan])
+    base = np.array([input_values[name] for name in feature_names], dtype=np.float64)
+
+    X = np.tile(base, (len(y_values) * len(x_values), 1))
+    X[:, feature_names.index(x_feature)] = np.tile(x_values, len(y_values))
+    if y_feature:
+        X[:, feature_names.index(y_feature)] = np.repeat(y_values, len(x_values))
+    return X, x_values, y_values
+
+
+def sweep(model, input_values, x_feature, y_feature=None, feature_names=FEATURE_COLUMNS):
+    """Score ``model`` over ``x_feature`` (and ``y_feature``), the rest held at ``input_values``.
+
+    ``model`` is a ``CachedModel`` or anything else with ``predict_proba`` and ``classes``.
+    """
+    if y_feature == x_feature:
+        raise ValueError("Sweep two different features")
+    X, x_values, y_values = sweep_grid(input_values, x_feature, y_feature, feature_names)
+    proba = model.predict_proba(X)
+
+    shape = (len(y_values), len(x_values))
+    prediction = model.classes.take(np.argmax(proba, axis=1))
+    return SweepResult(x_feature, x_values, y_feature, y_values if y_feature else None,
+                       proba[:, 1].reshape(shape), prediction.reshape(shape))
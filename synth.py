@@ -0,0 +1,333 @@
+"""Synthetic cycle exports in the schema of FilteredData.csv, for load testing.
+
+The real export has 1,554 cycles, too few to see how scoring, indexing or
+training scale. ``CohortModel.fit`` learns from it
+
+    per client      the number of cycles tracked, and the columns that are
+                    constant (Group) or only filled in on the first cycle
+                    (age, height, weight, ...)
+    per cycle       every other numeric column
+    blanks          which columns are blank together, by resampling the blank
+                    patterns of real clients and cycles
+
+Numeric columns are sampled through a Gaussian copula: each column keeps its
+observed distribution, and the normal scores keep the correlations between
+columns, split into the part shared by all cycles of a client and the part
+that varies from cycle to cycle. After sampling, the identities of the
+export are restored (see ``_derive``): the luteal phase is the cycle length
+minus the ovulation day, there is one menses score per day of menses, and so
+on.
+
+``generate`` yields chunks of rows, each sampled with array operations from
+its own seeded generator, so the same seed and chunk size always give the same
+rows. ``write_csv`` streams them to disk with blanks padded as one space, like
+the real export, so the output reads through data_store.py like the original:
+
+    python synth.py --rows 5000000 --output synthetic.csv --seed 0
+    python batch_score.py synthetic.csv scored.csv
+
+Synthetic ClientIDs start with ``syn``, so they are never mistaken for real ones.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr, ndtri
+
+from data_store import SCHEMA
+
+CLIENT_PREFIX = "syn"
+
+MENSES_SCORES = [column for column in SCHEMA if column.startswith("MensesScoreDay")]
+
+# Columns computed from others by _derive instead of being sampled
+DERIVED = ("LengthofLutealPhase", "TotalMensesScore", "MeanCycleLength", "BMI")
+
+
+def _numbers(table, columns):
+    return np.column_stack([table[column].to_numpy(dtype=np.float64, na_value=np.nan)
+                            for column in columns]) if columns else np.empty((len(table), 0))
+
+
+def _normal_scores(values):
+    """Each column mapped to standard normal scores through its mid-ranks; NaN stays NaN."""
+    scores = np.full(values.shape, np.nan)
+    for j in range(values.shape[1]):
+        known = ~np.isnan(values[:, j])
+        if known.any():
+            ranks = pd.Series(values[known, j]).rank().to_numpy()
+            scores[known, j] = ndtri((ranks - 0.5) / known.sum())
+    return scores
+
+
+def _covariance(scores):
+    """Pairwise-complete covariance of the columns of ``scores``."""
+    return pd.DataFrame(scores).cov().fillna(0.0).to_numpy()
+
+
+def _factor(covariance):
+    """``F`` with ``F @ F.T`` the nearest positive semi-definite matrix to ``covariance``."""
+    eigenvalues, eigenvectors = np.linalg.eigh((covariance + covariance.T) / 2)
+    return eigenvectors * np.sqrt(np.clip(eigenvalues, 0.0, None))
+
+
+def _quantiles(sorted_values, u):
+    """The observed values at probabilities ``u``, column by column."""
+    out = np.empty(u.shape)
+    for j, values in enumerate(sorted_values):
+        out[:, j] = values[np.minimum((u[:, j] * len(values)).astype(np.intp), len(values) - 1)]
+    return out
+
+
+class _Copula:
+    """Numeric columns with their observed distributions and correlated normal scores."""
+
+    def __init__(self, values, groups=None):
+        self.sorted_values = [np.sort(column[~np.isnan(column)]) for column in values.T]
+        scores = _normal_scores(values)
+        if groups is None:
+            self.between = np.zeros((values.shape[1], values.shape[1]))
+            within = _covariance(scores)
+        else:
+            # Client means of the scores, and each cycle's deviation from them
+            known = ~np.isnan(scores)
+            counts = np.stack([np.bincount(groups, known[:, j]) for j in range(scores.shape[1])], axis=1)
+            sums = np.stack([np.bincount(groups, np.where(known[:, j], scores[:, j], 0.0))
+                             for j in range(scores.shape[1])], axis=1)
+            means = np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)
+            within = _covariance(scores - means[groups])
+            # The spread of the means includes within-client noise, and the
+            # deviations miss the part of it each client mean absorbed
+            shrink = np.mean(1.0 / np.bincount(groups))
+            within /= 1.0 - shrink
+            self.between = _covariance(means) - within * shrink
+        self.between_factor = _factor(self.between)
+        self.within_factor = _factor(within)
+        total = self.between_factor @ self.between_factor.T + self.within_factor @ self.within_factor.T
+        self.scale = np.sqrt(np.clip(np.diag(total), 1e-12, None))
+
+    def sample(self, rng, groups, n_groups):
+        """One row per entry of ``groups``; rows of a group share its client-level part."""
+        k = len(self.sorted_values)
+        z = rng.standard_normal((len(groups), k)) @ self.within_factor.T
+        if self.between.any():
+            z += (rng.standard_normal((n_groups, k)) @ self.between_factor.T)[groups]
+        return _quantiles(self.sorted_values, ndtr(z / self.scale))
+
+
+class CohortModel:
+    """What ``generate`` samples from; build it with ``fit``."""
+
+    @classmethod
+    def fit(cls, path="FilteredData.csv"):
+        from data_store import load_table
+
+        table = load_table(path)
+        clients = table["ClientID"].to_numpy(dtype=object)
+        first = np.r_[True, clients[1:] != clients[:-1]]
+        groups = np.cumsum(first) - 1
+
+        model = cls()
+        model.columns = list(table.columns)
+        model.cycle_counts = np.bincount(groups)
+        model.empty, model.constant, model.first_row, model.cycle = [], [], [], []
+        for column in model.columns[2:]:  # after ClientID and CycleNumber
+            present = table[column].notna().to_numpy()
+            if not present.any() or column in DERIVED:
+                model.empty.append(column)
+            elif not present[~first].any():
+                model.first_row.append(column)
+            elif present.all() and (table.groupby(groups)[column].nunique() <= 1).all():
+                model.constant.append(column)
+            else:
+                model.cycle.append(column)
+        model.derived = [column for column in DERIVED if column in model.columns]
+        model.empty = [column for column in model.empty if column not in model.derived]
+
+        # Per client: the constant and first-row columns, from the first rows
+        model.client_columns = model.constant + model.first_row
+        model.client_text = [c for c in model.client_columns if SCHEMA.get(c) == "string"
+                             or table[c].dtype.name == "category"]
+        model.client_numeric = [c for c in model.client_columns if c not in model.client_text]
+        profiles = table[first]
+        model.client_blanks = profiles[model.client_columns].isna().to_numpy()
+        model.client_copula = _Copula(_numbers(profiles, model.client_numeric))
+        model.text_values = {c: profiles[c].dropna().astype(str).to_numpy() for c in model.client_text}
+
+        # Per cycle: the rest, correlated within each client
+        model.cycle_blanks = table[model.cycle].isna().to_numpy()
+        model.cycle_copula = _Copula(_numbers(table, model.cycle), groups)
+        model.ranges = {c: (table[c].min(), table[c].max()) for c in model.derived}
+        return model
+
+    def _cycles_per_client(self, rng, rows):
+        mean = self.cycle_counts.mean()
+        counts = rng.choice(self.cycle_counts, int(np.ceil(rows / mean * 1.2)) + 10)
+        while counts.sum() < rows:
+            counts = np.concatenate([counts, rng.choice(self.cycle_counts, len(counts))])
+        ends = np.cumsum(counts)
+        counts = counts[:np.searchsorted(ends, rows) + 1]
+        counts[-1] -= counts.sum() - rows  # the last client of the chunk stops early
+        return counts
+
+    def sample(self, rng, rows, first_client=0):
+        """``rows`` synthetic cycles as a frame, clients numbered from ``first_client``."""
+        counts = self._cycles_per_client(rng, rows)
+        n_clients = len(counts)
+        groups = np.repeat(np.arange(n_clients), counts)
+        starts = np.cumsum(counts) - counts
+        first = np.zeros(rows, dtype=bool)
+        first[starts] = True
+
+        columns = {
+            "ClientID": np.char.add(CLIENT_PREFIX, (first_client + groups).astype(str)).astype(object),
+            "CycleNumber": (np.arange(rows) - starts[groups] + 1).astype(np.float64),
+        }
+
+        # Cycle-level columns, blanked like a randomly chosen real cycle
+        values = self.cycle_copula.sample(rng, groups, n_clients)
+        values[self.cycle_blanks[rng.integers(len(self.cycle_blanks), size=rows)]] = np.nan
+        columns.update(zip(self.cycle, values.T))
+
+        # Client-level columns, blanked like a randomly chosen real client
+        blanks = self.client_blanks[rng.integers(len(self.client_blanks), size=n_clients)]
+        client_values = {}
+        numeric = self.client_copula.sample(rng, np.arange(n_clients), n_clients)
+        client_values.update(zip(self.client_numeric, numeric.T))
+        for column in self.client_text:
+            choices = self.text_values[column]
+            client_values[column] = choices[rng.integers(len(choices), size=n_clients)].astype(object) \
+                if len(choices) else np.full(n_clients, None, dtype=object)
+        for j, column in enumerate(self.client_columns):
+            per_client = client_values[column]
+            per_client[blanks[:, j]] = np.nan if per_client.dtype != object else None
+            if column in self.constant:
+                columns[column] = per_client[groups]
+            else:
+                columns[column] = np.full(rows, np.nan if per_client.dtype != object else None,
+                                          dtype=per_client.dtype)
+                columns[column][starts] = per_client
+
+        for column in self.empty:
+            columns[column] = np.full(rows, None if SCHEMA.get(column) == "string" else np.nan,
+                                      dtype=object if SCHEMA.get(column) == "string" else np.float64)
+        _derive(columns, groups, starts, self.ranges)
+        return _frame(columns, self.columns)
+
+    def generate(self, rows, seed=0, chunksize=100_000):
+        """Frames of at most ``chunksize`` rows, ``rows`` in total."""
+        produced = clients = 0
+        for block in range(-(-rows // chunksize)):
+            rng = np.random.default_rng([seed, block])
+            chunk = self.sample(rng, min(chunksize, rows - produced), clients)
+            produced += len(chunk)
+            clients += int((chunk["CycleNumber"] == 1).sum())
+            yield chunk
+
+    def write_csv(self, path, rows, seed=0, chunksize=100_000):
+        """Stream ``generate`` to ``path``, blanks written as one space."""
+        with open(path, "w", newline="") as file:
+            file.write(",".join(self.columns) + "\n")
+            for chunk in self.generate(rows, seed, chunksize):
+                file.write(_csv_rows(chunk))
+
+
+def _derive(columns, groups, starts, ranges):
+    """Restore the identities between columns of the export (in place)."""
+    def clip(column, values):
+        low, high = ranges[column]
+        return np.clip(values, low, high)
+
+    if "LengthofLutealPhase" in ranges:
+        columns["LengthofLutealPhase"] = clip(
+            "LengthofLutealPhase", columns["LengthofCycle"] - columns["EstimatedDayofOvulation"])
+
+    # A score for each day of menses and none after; the total is their sum
+    length = columns["LengthofMenses"]
+    scores = [column for column in MENSES_SCORES if column in columns]
+    for day, column in enumerate(scores, start=1):
+        if np.isnan(columns[column]).all():
+            continue
+        columns[column] = np.where(day <= length, columns[column], np.nan)
+    if "TotalMensesScore" in ranges:
+        total = np.nansum(np.column_stack([columns[c] for c in scores]), axis=1)
+        columns["TotalMensesScore"] = clip("TotalMensesScore", np.where(np.isnan(length), np.nan, total))
+
+    # The client's mean cycle length, on the first cycle like the export
+    if "MeanCycleLength" in ranges:
+        known = ~np.isnan(columns["LengthofCycle"])
+        sums = np.bincount(groups, np.where(known, columns["LengthofCycle"], 0.0))
+        counts = np.bincount(groups, known)
+        mean = np.round(np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0), 2)
+        columns["MeanCycleLength"] = np.full(len(groups), np.nan)
+        columns["MeanCycleLength"][starts] = mean
+
+    # Height is in inches and weight in pounds
+    if "BMI" in ranges:
+        height, weight = columns["Height"], columns["Weight"]
+        valid = (height > 0) & (weight > 0)
+        columns["BMI"] = np.where(valid, 703.0 * weight / np.where(valid, height, 1.0) ** 2, np.nan)
+
+
+def _frame(columns, order):
+    """The sampled columns as a frame with the export's column types."""
+    data = {}
+    for name in order:
+        values = columns[name]
+        kind = SCHEMA.get(name, "Float64")
+        if values.dtype == object or kind == "string":
+            data[name] = values
+        elif kind.startswith("Int"):
+            missing = np.isnan(values)
+            data[name] = pd.arrays.IntegerArray(np.where(missing, 0, np.round(values)).astype(np.int64),
+                                                missing)
+        else:
+            data[name] = values
+    return pd.DataFrame(data, columns=order)
+
+
+def _quote(text):
+    if any(mark in text for mark in ',"\r\n'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def _csv_rows(frame):
+    """The rows of ``frame`` as CSV text, blanks as one space.
+
+    Every column holds few distinct values, so each is formatted once and
+    the rows are joined from lookups; ``DataFrame.to_csv`` is several times slower.
+    """
+    columns = []
+    for name in frame.columns:
+        codes, uniques = pd.factorize(frame[name])
+        if frame[name].dtype == object:
+            text = [_quote(str(value)) for value in uniques]
+        elif pd.api.types.is_integer_dtype(frame[name].dtype):
+            text = [str(int(value)) for value in uniques]
+        else:
+            text = [str(float(value)) for value in uniques]
+        # Code -1 (missing) picks the blank at the end
+        columns.append(np.array(text + [" "], dtype=object)[codes].tolist())
+    return "".join([",".join(row) + "\n" for row in zip(*columns)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic export in the schema of FilteredData.csv")
+    parser.add_argument("--data", default="FilteredData.csv", help="Real export to learn from")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunksize", type=int, default=100_000, help="Rows sampled and written at a time")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    model = CohortModel.fit(args.data)
+    model.write_csv(args.output, args.rows, args.seed, args.chunksize)
+    seconds = time.perf_counter() - start
+    print(f"Wrote {args.rows:,} rows to {args.output} in {seconds:.1f} s ({args.rows / seconds:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
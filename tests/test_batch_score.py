@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from batch_score import MODEL_SETS, _chunks, _union_columns, score_file
+from features import feature_frame, fill_missing_values
+from pipeline import CYCLE_COLUMNS, load_cycles
+
+
+def test_one_pass_fill_is_what_training_uses():
+    expected = load_cycles("FilteredData.csv")
+    table = pd.read_csv("FilteredData.csv")
+    frame, _ = fill_missing_values(feature_frame(table, CYCLE_COLUMNS), table["ClientID"].to_numpy())
+    assert frame.loc[expected.index, CYCLE_COLUMNS].equals(expected[CYCLE_COLUMNS])
+
+
+def test_fill_carries_client_values_across_chunks():
+    frame = pd.DataFrame({"Cycle Length": [28.0, 30.0, 26.0, 32.0],
+                          "Average Cycle Length": [29.0, np.nan, np.nan, np.nan],
+                          "Body Mass Index": [20.0, np.nan, 30.0, np.nan]})
+    clients = np.array(["a", "a", "b", "b"])
+    first, state = fill_missing_values(frame.iloc[:3].copy(), clients[:3])
+    second, _ = fill_missing_values(frame.iloc[3:].copy(), clients[3:], state)
+    filled = pd.concat([first, second])
+    # a reported its mean, b never did and gets the mean of its own lengths
+    assert filled["Average Cycle Length"].tolist() == [29.0, 29.0, 26.0, 29.0]
+    assert filled["Body Mass Index"].tolist() == [20.0, 20.0, 30.0, 30.0]
+
+
+def test_scoring_inputs_have_no_blank_client_values():
+    columns = _union_columns(MODEL_SETS["v4"])
+    X = np.concatenate([X for _, X in _chunks("FilteredData.csv", columns, 500)])
+    for name in ("Average Cycle Length", "Body Mass Index"):
+        assert not np.isnan(X[:, columns.index(name)]).any(), name
+
+
+@pytest.mark.parametrize("model_set", sorted(MODEL_SETS))
+def test_score_file_keeps_every_row_in_order(tmp_path, model_set):
+    output = tmp_path / "predictions.csv"
+    n_rows = score_file("FilteredData.csv", str(output), MODEL_SETS[model_set],
+                        chunksize=400, workers=1)
+    scored = pd.read_csv(output)
+    source = pd.read_csv("FilteredData.csv", usecols=["ClientID", "CycleNumber"])
+    assert n_rows == len(source) == len(scored)
+    assert scored["ClientID"].tolist() == source["ClientID"].tolist()
+    for name in MODEL_SETS[model_set]:
+        assert scored[f"{name}_probability"].between(0, 1).all()
+
+
+def test_chunked_fill_equals_one_pass():
+    columns = _union_columns(MODEL_SETS["v4"])
+    table = pd.read_csv("FilteredData.csv")
+    expected, _ = fill_missing_values(feature_frame(table, columns), table["ClientID"].to_numpy())
+    X = np.concatenate([X for _, X in _chunks("FilteredData.csv", columns, 7)])
+    assert np.array_equal(X, expected.to_numpy(dtype=np.float32), equal_nan=True)
+
+
+def test_predictions_do_not_depend_on_the_chunk_size(tmp_path):
+    # 200 rows of the export, so that one row per chunk stays quick; they
+    # include clients who never reported a BMI or their mean cycle length
+    source = tmp_path / "export.csv"
+    with open("FilteredData.csv") as file:
+        lines = file.readlines()
+    source.write_text("".join(lines[:1] + lines[451:651]))
+    outputs = []
+    for chunksize in (1, 7, 200):
+        output = tmp_path / f"predictions-{chunksize}.csv"
+        score_file(str(source), str(output), MODEL_SETS["v4"], chunksize=chunksize, workers=1)
+        outputs.append(output.read_bytes())
+    assert outputs[0] == outputs[1] == outputs[2]
+
+
+def test_parquet_output_without_pyarrow_exits_before_scoring(monkeypatch, tmp_path, capsys):
+    import importlib.util
+
+    import batch_score
+
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(importlib.util, "find_spec",
+                        lambda name, *args: None if name == "pyarrow" else find_spec(name, *args))
+    monkeypatch.setattr(batch_score, "score_file", lambda *args, **kwargs: pytest.fail("scored"))
+    monkeypatch.setattr("sys.argv", ["batch_score.py", "FilteredData.csv", str(tmp_path / "out.parquet")])
+    with pytest.raises(SystemExit) as exit_info:
+        batch_score.main()
+    assert exit_info.value.code == 2
+    assert "install pyarrow" in capsys.readouterr().err
@@ -0,0 +1,38 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "benchmarks"))
+
+from suite import _flatten, _timings, compare  # noqa: E402
+
+
+def test_flatten_keeps_numbers_only():
+    results = {"models": {"fertility": {"load_ms": 3.0, "rows": 200, "ok": True}},
+               "python": "3.12", "apps": {"app.py": {"exceptions": 0}}}
+    assert _flatten(results) == {"models.fertility.load_ms": 3.0,
+                                 "models.fertility.rows": 200,
+                                 "apps.app.py.exceptions": 0}
+
+
+def test_compare_marks_only_numbers_beyond_the_tolerance(capsys):
+    baseline = {"a": {"fast_ms": 10.0, "slow_ms": 10.0, "rows": 200}}
+    results = {"a": {"fast_ms": 12.0, "slow_ms": 13.0, "rows": 100, "new_ms": 1.0}}
+    assert compare(results, baseline, tolerance=0.25) == ["a.slow_ms"]
+    out = capsys.readouterr().out
+    assert "(new)" in out and "(was 200)" in out and out.count("SLOWER") == 1
+
+
+def test_saved_results_compare_with_themselves(capsys):
+    for name in ("suite.json", "batch_crossover.json"):
+        with open(os.path.join("benchmarks", "results", name)) as file:
+            results = json.load(file)
+        assert compare(results, results, tolerance=0.0) == [], name
+
+
+def test_timings_are_milliseconds_per_repeat():
+    timings = _timings(lambda: None, 3)
+    assert timings.shape == (3,) and np.all(timings >= 0)
@@ -0,0 +1,44 @@
+import io
+import subprocess
+import sys
+
+from PIL import Image
+
+import charts
+
+
+def _stats():
+    return charts.chart_cache_stats()
+
+
+def test_a_chart_is_rendered_once_per_key():
+    before = _stats()
+    first = charts.feature_importance_chart([[0.5, 0.3, 0.2]], ["a", "b", "c"], ["m"], ["red"])
+    second = charts.feature_importance_chart([(0.5, 0.3, 0.2)], ("a", "b", "c"), ("m",), ("red",))
+    after = _stats()
+    assert first is second
+    assert after["misses"] - before["misses"] <= 1 and after["hits"] - before["hits"] >= 1
+    assert first.startswith(b"\x89PNG")
+
+
+def test_other_values_render_another_chart():
+    assert charts.fertility_gauge("#4CAF50") != charts.fertility_gauge("#FF5733")
+
+
+def test_the_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(charts, "MAX_CACHED_CHARTS", 3)
+    for color in ("#000001", "#000002", "#000003", "#000004", "#000005"):
+        charts.fertility_gauge(color)
+    assert _stats()["entries"] <= 3
+
+
+def test_the_gauge_is_a_circle_of_its_color():
+    image = Image.open(io.BytesIO(charts.fertility_gauge("#FF0000")))
+    assert image.getpixel((image.width // 2, image.height // 2)) == (255, 0, 0)
+    assert image.getpixel((2, 2)) == (255, 255, 255)
+
+
+def test_the_gauge_does_not_import_matplotlib():
+    code = "import sys, charts; charts.fertility_gauge('red'); print('matplotlib' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
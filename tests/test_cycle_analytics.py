@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+from cycle_analytics import (FERTILE_DAYS_BEFORE, PHASES, client_irregular_label, client_length_stats,
+                             fertile_window, fertility_label, fertility_status, irregular_label,
+                             label_cycles, ovulation_day, phase_on, phases)
+from data_store import load_table
+
+
+def test_labels_match_the_notebook_rules():
+    length = pd.Series([28, 19, 41, 30, np.nan, 35, 24, 29])
+    mean, std = length.mean(), length.std()
+    irregular = ((length < 20) | (length > 40) | (abs(length - mean) > 1.5 * std)).astype(int)
+    assert np.array_equal(irregular_label(length), irregular)
+
+    ovulation = np.array([11, 12, 16, 17, np.nan])
+    assert fertility_label(ovulation).tolist() == [0, 1, 1, 0, 0]
+    assert fertility_status(14) == "High Fertility"
+
+
+def test_arrays_equal_one_cycle_at_a_time():
+    rng = np.random.default_rng(0)
+    length = rng.integers(18, 45, 50).astype(float)
+    ovulation = np.where(rng.random(50) < 0.2, np.nan, length - rng.integers(10, 16, 50))
+    luteal = rng.integers(10, 16, 50).astype(float)
+    first_high = np.where(rng.random(50) < 0.3, np.nan, ovulation - 4)
+    bounds = phases(length, ovulation, luteal, first_high, np.full(50, 5.0))
+    for i in range(50):
+        one = phases(length[i], ovulation[i], luteal[i], first_high[i], 5.0)
+        for name, values in bounds.items():
+            assert np.array_equal(one[name], values[i], equal_nan=True), name
+        assert phase_on(10, one) == phase_on(10, bounds)[i]
+
+
+def test_client_statistics_equal_a_groupby():
+    table = load_table("FilteredData.csv", ["ClientID", "LengthofCycle"])
+    clients = table["ClientID"].to_numpy(dtype=object)
+    length = table["LengthofCycle"].to_numpy(dtype=np.float64, na_value=np.nan)
+    count, mean, std = client_length_stats(clients, length)
+    grouped = pd.Series(length).groupby(clients)
+    assert np.array_equal(count, grouped.transform("count").to_numpy())
+    assert np.allclose(mean, grouped.transform("mean").to_numpy(), equal_nan=True)
+    assert np.allclose(std, grouped.transform("std").to_numpy(), equal_nan=True)
+
+
+def test_client_sigma_judges_each_client_by_their_own_cycles():
+    clients = ["a"] * 4 + ["b"] * 5 + ["c"]
+    length = [33, 34, 35, 34, 24, 24, 25, 24, 28, 34]
+    labels = client_irregular_label(clients, length)
+    # 34 days is usual for a, 28 is not for b; c has too few cycles of their own
+    assert labels[:4].tolist() == [0, 0, 0, 0] and labels[8] == 1
+    assert labels[9] == irregular_label(length)[9]
+
+
+def test_fertile_window_and_phases():
+    ovulation = ovulation_day([28, 30, 32], ovulation=[14, np.nan, np.nan], luteal=[12, 13, np.nan])
+    assert np.array_equal(ovulation, [14, 17, np.nan], equal_nan=True)
+    start, end = fertile_window([14, 14], first_high=[11, 16])
+    # A first high day after ovulation is ignored
+    assert start.tolist() == [11, 14 - FERTILE_DAYS_BEFORE] and end.tolist() == [15, 15]
+
+    bounds = phases(28, 14, menses=5)
+    days = np.arange(1, 30)
+    assert PHASES[[int(phase_on(day, bounds)) for day in days]].tolist() == (
+        ["menses"] * 5 + ["follicular"] * 3 + ["fertile"] * 7 + ["luteal"] * 13 + ["unknown"])
+
+
+def test_label_cycles_keeps_every_row():
+    table = load_table("FilteredData.csv")
+    cycles = label_cycles(table)
+    assert len(cycles) == len(table) and cycles.index.equals(table.index)
+    assert set(cycles["Irregular"].unique()) <= {0, 1}
@@ -0,0 +1,54 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import data_store
+from data_store import build_store, load_table, store_path
+
+CSV = "ClientID,CycleNumber,LengthofCycle,BMI\nnfp1,1,28, \nnfp1,2,31,22.5\nnfp2,1, ,19.1\n"
+
+
+def _write(path, text=CSV):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return str(path)
+
+
+def test_load_table_types_the_padded_blanks(tmp_path):
+    table = load_table(_write(tmp_path / "export.csv"), root=str(tmp_path / "store"))
+    assert str(table["LengthofCycle"].dtype) == "Int16"
+    assert table["LengthofCycle"].isna().tolist() == [False, False, True]
+    assert np.isclose(table["BMI"][1], 22.5) and pd.isna(table["BMI"][0])
+
+
+def test_exports_with_the_same_name_get_their_own_store(tmp_path):
+    root = str(tmp_path / "store")
+    first = _write(tmp_path / "a" / "export.csv")
+    second = _write(tmp_path / "b" / "export.csv", CSV.replace("28", "35"))
+    assert store_path(first, root) != store_path(second, root)
+    assert load_table(first, root=root)["LengthofCycle"][0] == 28
+    assert load_table(second, root=root)["LengthofCycle"][0] == 35
+    assert store_path(first, root) == store_path(os.path.relpath(first), root)
+
+
+def test_concurrent_builds_leave_one_complete_store(tmp_path):
+    root = str(tmp_path / "store")
+    path = _write(tmp_path / "export.csv")
+    errors = []
+
+    def build():
+        try:
+            build_store(path, root)
+        except Exception as error:  # pragma: no cover - reported below
+            errors.append(error)
+
+    threads = [threading.Thread(target=build) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert os.listdir(root) == [os.path.basename(store_path(path, root))]
+    assert len(data_store.open_store(store_path(path, root))) == 3
@@ -0,0 +1,83 @@
+import json
+import threading
+import warnings
+
+import numpy as np
+import pytest
+
+import drift_monitor
+from drift_monitor import DriftMonitor, Sketch, build_reference, export_features, psi
+
+
+@pytest.fixture(scope="module")
+def reference():
+    return build_reference("FilteredData.csv")
+
+
+def test_check_on_the_reference_data_reports_no_shift(reference):
+    from batch_score import MODEL_SETS
+    from ensemble import load_ensemble
+
+    monitor = DriftMonitor(reference)
+    ensemble = load_ensemble(MODEL_SETS["v4"])
+    for X in export_features("FilteredData.csv", monitor.features):
+        monitor.observe(X, ensemble.score(X))
+    report = monitor.report()
+    assert report["rows"] == reference["rows"]
+    for name, row in list(report["features"].items()) + list(report["predictions"].items()):
+        assert row["psi"] == pytest.approx(0.0, abs=1e-12), name
+        assert row["status"] == "ok", name
+    assert all(row["ks"] == 0.0 for row in report["features"].values())
+
+
+def test_sketch_moments_merge_across_batches():
+    values = np.random.default_rng(0).normal(28, 4, 10_000)
+    sketch = Sketch(np.arange(15, 45))
+    for batch in np.array_split(values, 7):
+        sketch.add(batch)
+    assert sketch.count == len(values)
+    assert sketch.mean == pytest.approx(values.mean())
+    assert sketch.std == pytest.approx(values.std(ddof=1))
+    assert sketch.counts.sum() == len(values)
+
+
+def test_psi_is_zero_for_the_same_shares_and_grows_with_a_shift():
+    expected = np.array([10.0, 30, 40, 20])
+    assert psi(expected, expected * 3) == pytest.approx(0.0)
+    assert psi(expected, np.array([40.0, 30, 20, 10])) > drift_monitor.PSI_ALERT
+
+
+def test_observe_starts_one_flush_at_a_time(reference, monkeypatch):
+    monitor = DriftMonitor(reference)
+    started = []
+    monkeypatch.setattr(monitor, "_flush_in_background", lambda: started.append(1))
+    monkeypatch.setattr(drift_monitor, "FLUSH_ROWS", 1)
+    X = np.zeros((1, len(monitor.features)))
+
+    def observe():
+        for _ in range(200):
+            monitor.observe(X)
+
+    threads = [threading.Thread(target=observe) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The flag is only cleared by the flush, which never ran
+    assert len(started) == 1
+
+
+def test_default_monitor_starts_empty_on_a_corrupt_state(tmp_path, monkeypatch, reference):
+    reference_path = tmp_path / "reference.json"
+    reference_path.write_text(json.dumps(reference))
+    monkeypatch.setattr(drift_monitor, "STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(drift_monitor, "_monitors", {})
+    (tmp_path / "broken.json").write_text('{"format": 1, "rows": 3, "feat')
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        monitor = drift_monitor.default_monitor("broken", str(reference_path))
+    assert isinstance(monitor, DriftMonitor)
+    assert monitor.rows == 0
+    assert any("broken.json" in str(warning.message) for warning in caught)
+    # Nothing to write at exit
+    monitor.save_path = None
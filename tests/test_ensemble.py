@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from batch_score import MODEL_SETS, _chunks
+from ensemble import Ensemble, load_ensemble, union_features
+from forest_engine import BATCH_CROSSOVER
+
+
+@pytest.fixture(scope="module", params=sorted(MODEL_SETS))
+def model_set(request):
+    models = MODEL_SETS[request.param]
+    ensemble = load_ensemble(models)
+    X = np.concatenate([X for _, X in _chunks("FilteredData.csv", ensemble.features, 100_000)])
+    return models, ensemble, X
+
+
+def test_union_features_keeps_the_first_appearance():
+    assert union_features([["a", "b"], ["c", "a"], ["d"]]) == ["a", "b", "c", "d"]
+
+
+def test_ensemble_equals_each_model_on_its_own(model_set):
+    models, ensemble, X = model_set
+    # Small batches take the joined walk, the whole export each model's forest
+    for batch in (X[:1], X[:BATCH_CROSSOVER - 1], X):
+        result = ensemble.score(batch)
+        for name in models:
+            engine = ensemble.engines[name]
+            expected = engine.predict_proba(batch[:, ensemble._feature_index[name]])
+            assert np.array_equal(result[name], expected), name
+
+
+def test_joined_walk_equals_the_large_batch_path(model_set):
+    _, ensemble, X = model_set
+    joined = np.empty((len(X), len(ensemble.classes)))
+    ensemble._proba(X, joined)
+    assert np.array_equal(ensemble.predict_proba(X), joined)
+
+
+def test_matrix_takes_a_dict_of_scalars(model_set):
+    _, ensemble, X = model_set
+    row = dict(zip(ensemble.features, X[0].tolist()))
+    assert np.array_equal(ensemble.matrix(row), X[:1])
+    with pytest.raises(ValueError):
+        ensemble.matrix({})
+
+
+def test_ensemble_needs_a_model():
+    with pytest.raises(ValueError):
+        Ensemble({})
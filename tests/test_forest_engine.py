@@ -0,0 +1,106 @@
+import warnings
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from forest_engine import BATCH_CROSSOVER, CompiledForest, PackedForest, _float32_at_most
+
+
+@pytest.fixture(scope="module")
+def forest():
+    rng = np.random.default_rng(0)
+    X = rng.uniform(0, 40, (400, 4))
+    X[rng.random(X.shape) < 0.05] = np.nan
+    y = (np.nan_to_num(X[:, 0]) + rng.normal(0, 5, len(X)) > 20).astype(int)
+    return RandomForestClassifier(n_estimators=20, random_state=0).fit(X, y)
+
+
+@pytest.fixture(scope="module")
+def rows():
+    X = np.random.default_rng(1).uniform(-5, 45, (2000, 4))
+    X[::9, 1] = np.nan
+    return X.astype(np.float32)
+
+
+@pytest.mark.parametrize("engine", [CompiledForest, PackedForest])
+def test_engine_equals_sklearn(forest, rows, engine):
+    compiled = engine.from_sklearn(forest)
+    assert np.array_equal(compiled.predict_proba(rows[:300]), forest.predict_proba(rows[:300]))
+    assert np.array_equal(compiled.predict(rows[:300]), forest.predict(rows[:300]))
+
+
+def test_packed_forest_round_trips_through_its_file(forest, rows, tmp_path):
+    packed = PackedForest.from_sklearn(forest)
+    path = tmp_path / "forest.forest"
+    packed.save(path)
+    loaded = PackedForest.load(path)
+    assert np.array_equal(loaded.predict_proba(rows[:300]), packed.predict_proba(rows[:300]))
+
+
+def test_float32_thresholds_round_down():
+    threshold = np.array([0.1, 1.5, 27.500001, -3.3, 1e-40])
+    rounded = _float32_at_most(threshold)
+    assert rounded.dtype == np.float32
+    assert (rounded.astype(np.float64) <= threshold).all()
+    # The next float32 up is above the threshold, so no float32 input changes side
+    assert (np.nextafter(rounded, np.float32(np.inf)).astype(np.float64) > threshold).all()
+
+
+def test_large_batches_fall_back_to_the_forest(forest, rows):
+    engine = PackedForest.from_sklearn(forest)
+    expected = engine.predict_proba(rows)
+    calls = []
+
+    def fallback():
+        calls.append(len(rows))
+        return forest
+
+    engine.fallback = fallback
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert np.array_equal(engine.predict_proba(rows[:BATCH_CROSSOVER - 1]),
+                              expected[:BATCH_CROSSOVER - 1])
+        assert not calls
+        assert np.array_equal(engine.predict_proba(rows), expected)
+    assert calls
+
+
+def test_an_unavailable_fallback_keeps_the_engine(forest, rows):
+    engine = PackedForest.from_sklearn(forest)
+    expected = engine.predict_proba(rows)
+    engine.fallback = lambda: None
+    assert np.array_equal(engine.predict_proba(rows), expected)
+
+
+def test_packing_shares_identical_trees_and_leaves(forest, rows):
+    compiled = CompiledForest.from_sklearn(forest)
+    packed = PackedForest.from_forest(compiled)
+    assert packed.n_nodes < len(compiled.is_leaf)
+    assert len(np.unique(packed.value, axis=0)) == len(packed.value)
+
+    # A tree repeated adds no nodes, only a root
+    doubled = CompiledForest.from_sklearn(forest)
+    doubled.roots = np.concatenate([compiled.roots, compiled.roots])
+    twice = PackedForest.from_forest(doubled)
+    assert twice.n_nodes == packed.n_nodes and twice.n_trees == 2 * packed.n_trees
+    assert np.array_equal(twice.predict_proba(rows[:300]), packed.predict_proba(rows[:300]))
+
+
+def test_loaded_arrays_are_views_of_the_file(forest, tmp_path):
+    path = tmp_path / "forest.forest"
+    PackedForest.from_sklearn(forest).save(path)
+    loaded = PackedForest.load(path)
+    for name in ("feature", "threshold", "left", "value", "roots"):
+        array = getattr(loaded, name)
+        assert not array.flags.owndata and not array.flags.writeable, name
+    with pytest.raises(ValueError):
+        PackedForest.load(__file__)
+
+
+def test_float32_values_are_smaller_and_close(forest, rows):
+    exact = PackedForest.from_sklearn(forest)
+    rounded = PackedForest.from_sklearn(forest, value_dtype=np.float32)
+    assert rounded.value.dtype == np.float32 and rounded.nbytes < exact.nbytes
+    assert np.allclose(rounded.predict_proba(rows[:300]), exact.predict_proba(rows[:300]),
+                       atol=1e-6)
@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+from gemini_client import AnswerCache, FakeBackend, GeminiClient
+
+
+class _Failing:
+    calls = 0
+
+    def stream(self, model, prompt):
+        self.calls += 1
+        yield "partial "
+        raise RuntimeError("quota")
+
+
+def test_the_same_question_is_answered_once():
+    backend = FakeBackend(answer="Track your cycle")
+    client = GeminiClient(backend)
+    first = client.ask("When am I fertile?").result(5)
+    second = client.ask("  when am I   FERTILE? ").result(5)
+    assert first == second == "Track your cycle "
+    assert backend.calls == 1 and client.stats["cache_hits"] == 1
+
+
+def test_readers_join_an_answer_in_flight():
+    backend = FakeBackend(answer="one two three four", delay=0.01)
+    client = GeminiClient(backend)
+    answers = [client.ask("Question") for _ in range(3)]
+    assert len({id(answer) for answer in answers}) == 1
+    assert list(answers[0].stream(5)) == ["one ", "two ", "three ", "four "]
+    assert backend.calls == 1
+
+
+def test_failed_answers_are_not_cached():
+    backend = _Failing()
+    client = GeminiClient(backend)
+    with pytest.raises(RuntimeError):
+        client.ask("Question").result(5)
+    with pytest.raises(RuntimeError):
+        client.ask("Question").result(5)
+    assert backend.calls == 2 and client.stats["errors"] == 2
+
+
+def test_answers_expire_and_the_cache_is_bounded():
+    now = [0.0]
+    cache = AnswerCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.put("c", "3")
+    assert cache.get("a") is None and cache.get("c") == "3"
+    now[0] = 11
+    assert cache.get("c") is None
+
+
+def test_many_readers_see_the_whole_stream():
+    client = GeminiClient(FakeBackend(answer="a b c d e f", delay=0.005))
+    answer = client.ask("Question")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(answer.result(5))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["a b c d e f "] * 4
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from history import METRICS, CycleHistory
+
+
+@pytest.fixture(scope="module")
+def cycles():
+    rng = np.random.default_rng(0)
+    clients = rng.choice(["a", "b", "c", "d"], 60)
+    values = rng.normal([29, 15, 13], [3, 2, 1], (60, len(METRICS)))
+    values[rng.random(values.shape) < 0.15] = np.nan
+    return clients, values
+
+
+def _appended(clients, values, window=4):
+    history = CycleHistory(window, capacity=1)
+    for client, row in zip(clients, values):
+        history.append(client, row)
+    return history
+
+
+def _assert_same(history, expected):
+    stats, other = history.statistics(), expected.statistics()
+    order, other_order = np.argsort(stats["client"]), np.argsort(other["client"])
+    assert list(stats["client"][order]) == list(other["client"][other_order])
+    for name in stats.keys() - {"client"}:
+        assert np.allclose(stats[name][order], other[name][other_order], equal_nan=True), name
+
+
+def test_update_equals_repeated_append(cycles):
+    clients, values = cycles
+    history = CycleHistory(4, capacity=1)
+    # Uneven chunks, so the merge of running and chunk statistics is exercised
+    for start, stop in ((0, 7), (7, 8), (8, 41), (41, 60)):
+        history.update(clients[start:stop], values[start:stop])
+    _assert_same(history, _appended(clients, values))
+
+
+def test_statistics_equal_the_whole_sample(cycles):
+    clients, values = cycles
+    history = CycleHistory(4)
+    history.update(clients, values)
+    for client in set(clients):
+        own = values[clients == client]
+        stats = history.client_statistics(client)
+        for j, name in enumerate(METRICS):
+            known = own[:, j][~np.isnan(own[:, j])]
+            assert stats[f"{name}_count"] == len(known)
+            assert np.isclose(stats[f"{name}_mean"], known.mean())
+            assert np.isclose(stats[f"{name}_std"], known.std(ddof=1))
+            recent = own[-4:, j]
+            assert np.isclose(stats[f"{name}_recent_mean"], np.nanmean(recent))
+
+
+def test_forecast_places_ovulation_one_luteal_phase_before_the_end():
+    history = CycleHistory()
+    history.update(["a"] * 3, [[28, 14, 14], [30, 16, 14], [29, np.nan, 15]])
+    forecast = history.client_forecast("a", last_start=np.datetime64("2024-01-01"))
+    assert forecast["next_period_day"] == 30
+    assert forecast["ovulation_day"] == np.round(29 - 43 / 3)
+    assert forecast["next_period_date"] == np.datetime64("2024-01-30")
+
+
+def test_save_and_load_round_trip(cycles, tmp_path):
+    clients, values = cycles
+    history = _appended(clients, values)
+    history.save(tmp_path / "history.npz")
+    _assert_same(CycleHistory.load(tmp_path / "history.npz"), history)
+
+
+def test_cycles_without_a_client_are_skipped(cycles):
+    import pandas as pd
+
+    clients, values = cycles
+    blank = clients.astype(object)
+    blank[[3, 20, 41, 50]] = [np.nan, None, pd.NA, " "]
+    history = CycleHistory(4, capacity=1)
+    history.update(blank[:30], values[:30])
+    history.update(blank[30:], values[30:])
+    known = np.ones(len(clients), dtype=bool)
+    known[[3, 20, 41, 50]] = False
+    _assert_same(history, _appended(clients[known], values[known]))
+    history.append(np.nan, values[0])
+    assert len(history) == len(set(clients[known]))
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import instrumentation
+from instrumentation import DISABLED, Rerun, start_rerun
+
+
+@pytest.fixture(autouse=True)
+def quiet(monkeypatch, tmp_path):
+    monkeypatch.setattr(instrumentation, "_panel", lambda record, top=None: None)
+    monkeypatch.setattr(instrumentation, "_set_query_mode", lambda mode: None)
+    monkeypatch.setattr(instrumentation, "PROFILE_DIR", str(tmp_path))
+
+
+def test_profiling_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("APP_PROFILE", raising=False)
+    assert start_rerun("app") is DISABLED
+    with DISABLED.stage("predict"):
+        pass
+
+
+def test_a_rerun_logs_its_stages(tmp_path):
+    log = tmp_path / "reruns.jsonl"
+    run = Rerun("app", log_path=str(log))
+    with run.stage("predict"):
+        pass
+    run.count("rows", 3)
+    run.finish()
+    record = json.loads(log.read_text())
+    assert [stage["stage"] for stage in record["stages"]] == ["predict"]
+    assert record["counters"] == {"rows": 3}
+
+
+def test_one_session_profiles_at_a_time(tmp_path):
+    log = str(tmp_path / "reruns.jsonl")
+    first = Rerun("app", "cprofile", log)
+    second = Rerun("app", "tracemalloc", log)
+    assert second.mode == "1" and second.note
+    second.finish()
+    first.finish()
+    assert first.dump_path.endswith(".prof")
+    # Free again once the first rerun is done
+    third = Rerun("app", "tracemalloc", log)
+    assert third.mode == "tracemalloc"
+    third.finish()
+    assert third.dump_path.endswith(".tracemalloc")
+
+
+def test_an_abandoned_rerun_frees_the_profiler(tmp_path):
+    run = Rerun("app", "cprofile", str(tmp_path / "reruns.jsonl"))
+    del run
+    assert not instrumentation._profiler_lock.locked()
@@ -0,0 +1,27 @@
+import subprocess
+import sys
+
+import pytest
+
+# What app_v4.py imports at the top
+APP_MODULES = ["charts", "drift_monitor", "ensemble", "features", "gemini_client", "history",
+               "instrumentation", "prediction_cache", "registry", "sweep"]
+HEAVY = ["sklearn", "pandas", "matplotlib", "google.generativeai", "scipy"]
+
+
+def _imported_after(code):
+    check = f"import sys\n{code}\nprint(' '.join(m for m in {HEAVY!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def test_app_modules_import_nothing_heavy():
+    assert _imported_after(f"import {', '.join(APP_MODULES)}") == []
+
+
+@pytest.mark.parametrize("name", ["fertility", "regular_cycle"])
+def test_scoring_a_registry_model_needs_no_scikit_learn(name):
+    code = ("import numpy as np, registry\n"
+            f"engine = registry.load_compiled({name!r})\n"
+            "engine.predict(np.zeros((1, engine.n_features)))")
+    assert "sklearn" not in _imported_after(code)
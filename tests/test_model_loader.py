@@ -0,0 +1,53 @@
+import os
+
+import joblib
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+import model_loader
+from model_loader import ModelLoadError, load_compiled, load_model, model_fingerprint
+
+
+def _forest(seed=0):
+    X = np.random.default_rng(seed).uniform(0, 40, (60, 2))
+    return RandomForestClassifier(n_estimators=3, random_state=seed).fit(X, X[:, 0] > 20)
+
+
+@pytest.fixture
+def model_file(tmp_path):
+    path = tmp_path / "model.joblib"
+    joblib.dump(_forest(), path)
+    yield str(path)
+    model_loader.clear_models()
+
+
+def test_a_model_is_loaded_once_and_shared(model_file):
+    assert load_model(model_file) is load_model(os.path.relpath(model_file))
+
+
+def test_a_changed_file_is_reloaded(model_file):
+    first = load_model(model_file)
+    joblib.dump(_forest(seed=1), model_file)
+    os.utime(model_file, ns=(0, os.stat(model_file).st_mtime_ns + 1))
+    second = load_model(model_file)
+    assert second is not first
+    assert model_fingerprint(second) != model_fingerprint(first)
+
+
+def test_expected_features_are_checked(model_file):
+    load_model(model_file, expected_features=["a", "b"])
+    with pytest.raises(ModelLoadError):
+        load_model(model_file, expected_features=["a", "b", "c"])
+
+
+def test_the_same_forest_has_the_same_fingerprint(tmp_path):
+    path = tmp_path / "copy.joblib"
+    joblib.dump(_forest(), path)
+    assert model_fingerprint(model_loader._read_artifact(str(path))) == model_fingerprint(_forest())
+
+
+def test_compiled_model_is_shared_and_falls_back_to_the_model(model_file):
+    compiled = load_compiled(model_file)
+    assert compiled is load_compiled(model_file)
+    assert compiled.fallback() is load_model(model_file)
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from model_loader import model_fingerprint
+from pipeline import CYCLE_COLUMNS, StageCache, add_labels, add_noise, load_cycles, run
+
+
+@pytest.fixture(scope="module")
+def cycles():
+    return load_cycles("FilteredData.csv")
+
+
+def test_cycles_have_every_model_input(cycles):
+    # Luteal phase and first high day may be unknown, the rest is filled or required
+    required = [name for name in CYCLE_COLUMNS
+                if name not in ("Luteal Phase Length", "High Fertility Start")]
+    assert not cycles[required].isna().any().any()
+    # The index is the row number in the source
+    source = pd.read_csv("FilteredData.csv", usecols=["ClientID"])
+    assert (source["ClientID"].iloc[cycles.index] == cycles["ClientID"]).all()
+
+
+def test_labels_follow_the_notebook(cycles):
+    labelled = add_labels(cycles.copy())
+    length = cycles["Cycle Length"]
+    irregular = ((length < 20) | (length > 40)
+                 | ((length - length.mean()).abs() > 1.5 * length.std())).astype(int)
+    fertility = cycles["Ovulation Day"].between(12, 16).astype(int)
+    assert (labelled["Irregular"] == irregular).all()
+    assert (labelled["Regular"] == 1 - irregular).all()
+    assert (labelled["Fertility"] == fertility).all()
+
+
+def test_noise_is_seeded_and_never_negative(cycles):
+    first = add_noise(cycles.copy(), seed=3)["Ovulation Day (Noisy)"]
+    second = add_noise(cycles.copy(), seed=3)["Ovulation Day (Noisy)"]
+    assert first.equals(second) and (first >= 0).all()
+
+
+def test_stages_are_cached_by_what_they_read(tmp_path):
+    cache = StageCache(str(tmp_path))
+    params = {"forest_params": {"n_estimators": 5}, "cache": cache}
+    _, first = run(models=("irregular", "fertility_v3"), **params)
+    _, again = run(models=("irregular", "fertility_v3"), **params)
+    assert [outcome for _, _, outcome in cache.log[-5:]] == ["hit"] * 5
+    assert model_fingerprint(again["irregular"][0]) == model_fingerprint(first["irregular"][0])
+
+    cache.log.clear()
+    run(models=("irregular", "fertility_v3"), noise_scale=1.0, **params)
+    # Only the noisy column and the model reading it are computed again
+    assert dict((stage, outcome) for stage, _, outcome in cache.log) == {
+        "cycles": "hit", "labels": "hit", "noise": "miss",
+        "train:irregular": "hit", "train:fertility_v3": "miss"}
+    assert np.isfinite(first["irregular"][1]["accuracy"])
@@ -0,0 +1,49 @@
+import numpy as np
+
+from features import FEATURE_COLUMNS
+from prediction_cache import PredictionCache, cached_model, quantize
+
+ROWS = np.array([[28, 14, 12, 28, 1, 22.54, 0, 12],
+                 [35, 20, 13, 33, 0, 30.0, 1, 17],
+                 [28, 14, 12, 28, 1, 22.46, 0, 12]])
+
+
+def test_quantize_rounds_to_the_input_resolution():
+    X = quantize([[13.6, -0.2, 22.46]], ["Cycle Length", "Peak Cycle", "Body Mass Index"])
+    assert X.tolist() == [[14.0, 0.0, 22.5]]
+    # -0.0 rounds to the same key as 0.0
+    assert X[0, 1].tobytes() == np.float64(0.0).tobytes()
+
+
+def test_cached_equals_the_engine_on_quantized_rows():
+    cache = PredictionCache()
+    model = cached_model("fertility", expected_features=FEATURE_COLUMNS, cache=cache,
+                         precompute=False)
+    expected = model.engine.predict_proba(quantize(ROWS, FEATURE_COLUMNS))
+    assert np.array_equal(model.predict_proba(ROWS), expected)
+    # The first and last row round to the same input, so share an entry
+    assert cache.stats()["entries"] == 2 and cache.stats()["misses"] == 3
+    assert np.array_equal(model.predict_proba(ROWS), expected)
+    assert cache.stats()["hits"] == 3
+
+
+def test_cache_evicts_the_least_recently_used():
+    class Engine:
+        classes = np.array([0, 1])
+        calls = 0
+
+        def predict_proba(self, X):
+            Engine.calls += len(X)
+            return np.column_stack([1 - X[:, 0] / 10, X[:, 0] / 10])
+
+    cache, engine = PredictionCache(maxsize=2), Engine()
+    for value in (1, 2, 1, 3):
+        cache.predict_proba(engine, "v1", [[value]], ["x"])
+    assert Engine.calls == 3
+    cache.predict_proba(engine, "v1", [[1]], ["x"])
+    assert Engine.calls == 3
+    cache.predict_proba(engine, "v1", [[2]], ["x"])
+    assert Engine.calls == 4
+    # Another version never shares rows
+    cache.predict_proba(engine, "v2", [[2]], ["x"])
+    assert Engine.calls == 5
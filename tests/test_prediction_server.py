@@ -0,0 +1,91 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import drift_monitor
+from features import FEATURE_COLUMNS
+from prediction_server import (MODELS, LatencyStats, MicroBatcher, PredictionHandler,
+                               PredictionServer, make_server)
+from registry import REGISTRY_DIR, Registry, load_model
+
+ROW = {"Cycle Length": 28, "Ovulation Day": 14, "Luteal Phase Length": 12,
+       "Average Cycle Length": 28, "Peak Cycle": 1, "Body Mass Index": 22.0,
+       "Reproductive Status": 1, "High Fertility Start": 12}
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(drift_monitor, "STATE_DIR", str(tmp_path_factory.mktemp("drift")))
+        patch.setattr(drift_monitor, "_monitors", {})
+        server = make_server(port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+        server.shutdown()
+        server.RequestHandlerClass.monitor.save_path = None
+
+
+def _request(url, payload=None):
+    data = None if payload is None else json.dumps(payload).encode()
+    try:
+        with urllib.request.urlopen(url, data) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+
+def test_micro_batcher_groups_concurrent_rows():
+    sizes = []
+
+    def score(X):
+        sizes.append(len(X))
+        return X[:, 0].tolist()
+
+    batcher = MicroBatcher(score, max_batch=8, max_wait=0.05)
+    futures = [batcher.submit([float(i)]) for i in range(20)]
+    assert [future.result(5) for future in futures] == list(range(20))
+    assert max(sizes) > 1 and sum(sizes) == 20
+
+
+def test_predictions_match_the_models(server):
+    rows = [dict(ROW, **{"Ovulation Day": day}) for day in range(8, 22)]
+    status, body = _request(f"{server}/predict", {"instances": rows})
+    assert status == 200
+    X = np.array([[row[name] for name in FEATURE_COLUMNS] for row in rows], dtype=np.float32)
+    for name, (model_name, _, _) in MODELS.items():
+        model = load_model(model_name, expected_features=FEATURE_COLUMNS)
+        expected = model.predict_proba(pd.DataFrame(X, columns=FEATURE_COLUMNS))[:, 1]
+        actual = [prediction[name]["probability"] for prediction in body["predictions"]]
+        assert np.array_equal(actual, expected), name
+
+
+def test_bad_requests_get_a_400(server):
+    status, body = _request(f"{server}/predict", {"Cycle Length": 28})
+    assert status == 400 and "Missing features" in body["error"]
+
+
+def test_metrics_report_latency_and_drift(server):
+    _request(f"{server}/predict", ROW)
+    status, body = _request(f"{server}/metrics")
+    assert status == 200
+    assert body["latency"] and "features" in body["drift"]
+
+
+def test_metrics_without_a_drift_monitor():
+    handler = type("Handler", (PredictionHandler,),
+                   {"stats": LatencyStats(), "registry": Registry(REGISTRY_DIR)})
+    server = PredictionServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        status, body = _request(f"http://127.0.0.1:{server.server_address[1]}/metrics")
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert status == 200 and body["drift"] is None
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from forest_engine import PackedForest
+from registry import Registry, RegistryError
+
+FEATURES = ["Cycle Length", "Ovulation Day"]
+
+
+def _forest(seed=0):
+    X = pd.DataFrame(np.random.default_rng(seed).uniform(0, 40, (80, 2)), columns=FEATURES)
+    return RandomForestClassifier(n_estimators=4, random_state=seed).fit(X, X["Cycle Length"] > 20)
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return Registry(str(tmp_path / "models"))
+
+
+def test_the_same_forest_is_stored_once(registry, tmp_path):
+    first = registry.publish(_forest(), "fertility")
+    again = registry.publish(_forest(), "fertility")
+    other = registry.publish(_forest(), "copy")
+    assert again["version"] == first["version"] == 1
+    assert other["object"] == first["object"]
+    objects = sorted(p.suffix for p in (tmp_path / "models" / "objects").iterdir())
+    assert objects == [".forest", ".joblib"]
+
+
+def test_new_forests_get_new_versions(registry):
+    registry.publish(_forest(0), "fertility")
+    registry.publish(_forest(1), "fertility")
+    assert [entry["version"] for entry in registry.versions("fertility")] == [1, 2]
+    assert registry.resolve("fertility", 1)["object"] != registry.resolve("fertility")["object"]
+    with pytest.raises(RegistryError):
+        registry.resolve("fertility", 3)
+
+
+def test_compiled_models_are_memory_mapped_and_exact(registry):
+    model = _forest()
+    registry.publish(model, "fertility")
+    engine = registry.load_compiled("fertility", expected_features=FEATURES)
+    assert isinstance(engine, PackedForest)
+    assert engine is registry.load_compiled("fertility")
+    assert registry.stats()[0]["memory_mapped"]
+    X = np.random.default_rng(5).uniform(0, 40, (50, 2)).astype(np.float32)
+    assert np.array_equal(engine.predict_proba(X), model.predict_proba(pd.DataFrame(X, columns=FEATURES)))
+
+
+def test_feature_names_are_checked(registry):
+    registry.publish(_forest(), "fertility")
+    with pytest.raises(RegistryError):
+        registry.load_compiled("fertility", expected_features=["Ovulation Day", "Cycle Length"])
+
+
+def test_unknown_names_raise(registry):
+    with pytest.raises(RegistryError):
+        registry.resolve("missing")
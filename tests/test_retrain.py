@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from retrain import HOLDOUT_SIZE, RetrainState, SourceChangedError, _moments, merge_moments
+
+
+def _lines(count=None):
+    with open("FilteredData.csv", "rb") as file:
+        lines = file.readlines()
+    return lines if count is None else lines[:count]
+
+
+def test_merged_moments_equal_the_whole_sample():
+    values = np.random.default_rng(0).normal(29, 4, 500)
+    values[::17] = np.nan
+    merged = (0, 0.0, 0.0)
+    for part in np.array_split(values, [3, 4, 200]):
+        merged = merge_moments(merged, _moments(part))
+    n, mean, m2 = _moments(values)
+    assert merged[0] == n
+    assert np.isclose(merged[1], mean) and np.isclose(merged[2], m2)
+
+
+def test_reading_appended_rows_equals_one_read(tmp_path):
+    lines = _lines()
+    whole, appended = tmp_path / "whole.csv", tmp_path / "appended.csv"
+    whole.write_bytes(b"".join(lines))
+    everything = RetrainState(str(whole))
+    expected = everything.read()
+
+    state = RetrainState(str(appended))
+    parts = []
+    # A client's cycles are split between reads, and one read stops mid-line
+    for stop in (400, 401, 1000):
+        appended.write_bytes(b"".join(lines[:stop]))
+        parts.append(state.read())
+    with open(appended, "ab") as file:
+        file.write(b"".join(lines[1000:])[:-5])
+    parts.append(state.read())
+    appended.write_bytes(b"".join(lines))
+    parts.append(state.read())
+
+    # Blanks are filled and cycles labelled with the statistics seen so far,
+    # so only the cycles read and the statistics must match
+    columns = ["ClientID", "Cycle Number", "Cycle Length", "Ovulation Day"]
+    pd.testing.assert_frame_equal(pd.concat(parts)[columns], expected[columns])
+    assert state.rows == everything.rows and state.offset == everything.offset
+    assert np.allclose(state.length, everything.length)
+    assert np.allclose(state.fill_state["bmi"], everything.fill_state["bmi"])
+    pd.testing.assert_frame_equal(state.fill_state["lengths"].sort_index(),
+                                  everything.fill_state["lengths"].sort_index(), check_dtype=False)
+
+
+def test_rewritten_source_is_refused(tmp_path):
+    path = tmp_path / "export.csv"
+    lines = _lines(200)
+    path.write_bytes(b"".join(lines))
+    state = RetrainState(str(path))
+    state.read()
+    path.write_bytes(b"".join(lines[:1] + lines[2:] + lines[1:2]))
+    with pytest.raises(SourceChangedError):
+        state.read()
+
+
+def test_holdout_reservoir_stays_bounded():
+    state = RetrainState("unused.csv")
+    rng = np.random.default_rng(0)
+    for start in range(0, 3 * HOLDOUT_SIZE, 2500):
+        state.keep_holdout(pd.DataFrame({"row": np.arange(start, start + 2500)}), rng)
+    assert len(state.holdout) == HOLDOUT_SIZE
+    assert state.holdout["row"].is_unique
+    assert state.holdout_seen == 3 * HOLDOUT_SIZE
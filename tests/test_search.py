@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+
+import search
+from forest_engine import PackedForest
+from pipeline import StageCache
+from pipeline import run as run_pipeline
+from search import LATENCY_ENGINE, candidate_key, grid_candidates, pareto_front, search as run_search
+
+
+def test_grid_covers_every_combination():
+    candidates = grid_candidates({"a": [1, 2], "b": [None, 3, 4]})
+    assert len(candidates) == 6
+    assert len({candidate_key(params) for params in candidates}) == 6
+
+
+def test_pareto_front_drops_dominated_results():
+    results = [
+        {"accuracy": 0.9, "latency_ms": 0.2, "size_bytes": 100},
+        {"accuracy": 0.8, "latency_ms": 0.3, "size_bytes": 200},  # worse everywhere
+        {"accuracy": 0.95, "latency_ms": 0.5, "size_bytes": 100},
+    ]
+    assert sorted(pareto_front(results)) == [0, 2]
+
+
+def test_latency_is_measured_on_the_packed_engine(monkeypatch):
+    X = np.random.default_rng(0).uniform(0, 40, (50, 3))
+    model = RandomForestClassifier(n_estimators=5, random_state=0).fit(X, X[:, 0] > 20)
+    engines = []
+    original = PackedForest.predict
+    monkeypatch.setattr(PackedForest, "predict",
+                        lambda self, row: engines.append(type(self)) or original(self, row))
+    assert search._single_row_latency(model, X, repeats=5) > 0
+    assert engines == [PackedForest] * 5
+
+
+def test_results_of_another_engine_are_measured_again(tmp_path):
+    results_path = tmp_path / "results.jsonl"
+    params = {"n_estimators": 10}
+    old = {"params": params, "folds": "folds.joblib", "seed": 42, "accuracy": 0.9,
+           "latency_ms": 1.0, "size_bytes": 1}
+    results_path.write_text(json.dumps(old) + "\n"
+                            + json.dumps(dict(old, engine=LATENCY_ENGINE)) + "\n")
+    # Nothing is pending, so no worker starts
+    results = run_search([params], str(tmp_path / "folds.joblib"), str(results_path))
+    assert [result["engine"] for result in results] == [LATENCY_ENGINE]
+
+
+def test_fold_cache_key_ignores_earlier_runs_of_the_stage_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(search, "CACHE_DIR", str(tmp_path / "search"))
+    cache = StageCache(str(tmp_path / "pipeline"))
+    first = search.cached_folds("irregular", n_folds=2, cache=cache)
+    run_pipeline(noise_scale=1.0, models=(), cache=cache)
+    assert search.cached_folds("irregular", n_folds=2, cache=cache) == first
+    assert search.cached_folds("irregular", n_folds=2, cache=StageCache(str(tmp_path / "pipeline"))) == first
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from features import FEATURE_COLUMNS
+from prediction_cache import PredictionCache, cached_model
+from sweep import sweep, sweep_grid, sweep_values
+
+INPUT = {"Cycle Length": 28, "Ovulation Day": 14, "Luteal Phase Length": 12,
+         "Average Cycle Length": 28, "Peak Cycle": 1, "Body Mass Index": 22.5,
+         "Reproductive Status": 0, "High Fertility Start": 12}
+
+
+@pytest.fixture(scope="module")
+def model():
+    return cached_model("fertility", expected_features=FEATURE_COLUMNS, cache=PredictionCache())
+
+
+def test_grid_is_y_major_with_the_rest_held():
+    X, x_values, y_values = sweep_grid(INPUT, "Ovulation Day", "Luteal Phase Length")
+    grid = X.reshape(len(y_values), len(x_values), -1)
+    x, y = FEATURE_COLUMNS.index("Ovulation Day"), FEATURE_COLUMNS.index("Luteal Phase Length")
+    assert np.array_equal(grid[0, :, x], x_values)
+    assert np.array_equal(grid[:, 0, y], y_values)
+    held = np.delete(X, [x, y], axis=1)
+    assert (held == np.delete([INPUT[name] for name in FEATURE_COLUMNS], [x, y])).all()
+
+
+def test_sweep_equals_scoring_each_row(model):
+    result = sweep(model, INPUT, "Ovulation Day", "Luteal Phase Length")
+    X, _, _ = sweep_grid(INPUT, "Ovulation Day", "Luteal Phase Length")
+    expected = np.array([model.engine.predict_proba(row.reshape(1, -1))[0, 1] for row in X])
+    assert result.probability.shape == (len(result.y_values), len(result.x_values))
+    assert np.array_equal(result.probability.ravel(), expected)
+
+
+def test_a_repeated_sweep_is_served_from_the_cache(model):
+    first = sweep(model, INPUT, "Cycle Length")
+    misses = model.cache.stats()["misses"]
+    again = sweep(model, INPUT, "Cycle Length")
+    assert model.cache.stats()["misses"] == misses
+    assert np.array_equal(again.probability, first.probability)
+
+
+def test_flips_are_the_values_where_the_prediction_changes(model):
+    result = sweep(model, INPUT, "Ovulation Day")
+    prediction = result.prediction[0]
+    changed = np.flatnonzero(prediction[1:] != prediction[:-1]) + 1
+    assert np.array_equal(result.flips()[0], sweep_values("Ovulation Day")[changed])
+
+
+def test_sweeping_one_feature_twice_is_an_error(model):
+    with pytest.raises(ValueError):
+        sweep(model, INPUT, "Cycle Length", "Cycle Length")
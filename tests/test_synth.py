@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_store import load_table
+from synth import CLIENT_PREFIX, CohortModel
+
+
+@pytest.fixture(scope="module")
+def model():
+    return CohortModel.fit("FilteredData.csv")
+
+
+def test_the_same_seed_gives_the_same_rows(model):
+    first = pd.concat(model.generate(2500, seed=3, chunksize=1000))
+    again = pd.concat(model.generate(2500, seed=3, chunksize=1000))
+    other = pd.concat(model.generate(2500, seed=4, chunksize=1000))
+    pd.testing.assert_frame_equal(first, again)
+    assert not first["LengthofCycle"].equals(other["LengthofCycle"])
+
+
+def test_rows_keep_the_export_schema_and_identities(model):
+    real = load_table("FilteredData.csv")
+    chunks = list(model.generate(2500, seed=0, chunksize=1000))
+    assert [len(chunk) for chunk in chunks] == [1000, 1000, 500]
+    frame = pd.concat(chunks, ignore_index=True)
+    assert list(frame.columns) == list(real.columns)
+    assert frame["ClientID"].str.startswith(CLIENT_PREFIX).all()
+    # Every chunk starts new clients, numbered on from the previous chunk's,
+    # so no ClientID is reused; each client's cycles count up from 1
+    assert all(chunk["CycleNumber"].iloc[0] == 1 for chunk in chunks)
+    clients = frame["ClientID"].to_numpy()
+    new = np.r_[True, clients[1:] != clients[:-1]]
+    assert (frame["CycleNumber"][new] == 1).all()
+    assert (np.diff(frame["CycleNumber"].to_numpy(dtype=float))[~new[1:]] == 1).all()
+    assert len(set(clients)) == new.sum()
+
+    luteal = frame["LengthofCycle"] - frame["EstimatedDayofOvulation"]
+    low, high = real["LengthofLutealPhase"].min(), real["LengthofLutealPhase"].max()
+    known = frame["LengthofLutealPhase"].notna()
+    assert np.array_equal(frame["LengthofLutealPhase"][known], luteal[known].clip(low, high))
+
+
+def test_written_csv_reads_back_through_the_store(model, tmp_path):
+    path = tmp_path / "synthetic.csv"
+    model.write_csv(path, 300, seed=1, chunksize=200)
+    table = load_table(str(path), root=str(tmp_path / "store"))
+    expected = pd.concat(model.generate(300, seed=1, chunksize=200), ignore_index=True)
+    assert len(table) == 300
+    assert np.allclose(table["LengthofCycle"].to_numpy(dtype=float, na_value=np.nan),
+                       expected["LengthofCycle"].to_numpy(dtype=float, na_value=np.nan),
+                       equal_nan=True)